@@ -0,0 +1,154 @@
+"""
+	Generator of synthetic books for the benchmarks: the number and the size of the chapters, and the
+	density of images, LaTeX equations and template directives can be chosen. The densities are the
+	part of the paragraphs that contain an element, and the same parameters always give the same book.
+	The equations are rendered by a local server, that simulates the latency of the network.
+
+	Usage: python benchmarks/bookgen.py <directory> [chapters] [paragraphs per chapter] [images] [latex] [templates]
+"""
+import sys, time, random, struct, zlib, threading
+import http.server, socketserver
+from pathlib import Path
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+	+ 'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea '
+	+ 'commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur '
+	+ 'été garçon cœur naïve').split()
+IMAGE_SIZES = [(640, 480), (1600, 900), (300, 300), (1200, 1600)] # Distinct images, reused by the chapters
+EQUATIONS = [
+	'$x_{{{0}}} = \\sqrt{{{0}}} + \\alpha$',
+	'$\\frac{{{0}}}{{k+1}} \\leq \\sum_{{i=0}}^{{{0}}} i^2$',
+]
+DISPLAY_EQUATION = '$$\n\\int_0^{{{0}}} e^{{-t^2}} dt = \\frac{{\\sqrt{{\\pi}}}}{{2}}\n$$'
+DIRECTIVES = [
+	'Note {{%note:counter%}}, {{%:eval:round({0} / 7, 2)%}}.',
+	'{{%:if:{0} % 2 == 0:An even paragraph.:else:An odd paragraph.%}}',
+	'{{%level:eval:{0} % 3%}}{{%:if:level == "0":A new part.%}}',
+]
+SVG = '<?xml version="1.0" standalone="no" ?>\n\
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n\
+<svg xmlns="http://www.w3.org/2000/svg" width="2.3ex" height="1.7ex" viewBox="0 -750 1000 800"></svg>\n'
+
+def make_png(width, height):
+	def chunk(kind, data):
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+	row = b'\0' + bytes((x * 255 // width) for x in range(width)) * 3
+	header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+	return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(row * height)) + chunk(b'IEND', b'')
+
+def start_latex_server(latency=0.0):
+	""" Local server answering every equation with the same svg image, return its url """
+	class Handler(http.server.BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+		wbufsize = 1 << 16 # Send the headers and the body together, to avoid delayed ACKs
+
+		def do_GET(self):
+			time.sleep(latency)
+			body = SVG.encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		def log_message(self, *args):
+			pass
+
+	class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+		daemon_threads = True
+
+	server = Server(('127.0.0.1', 0), Handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+def is_selected(i, density):
+	""" Spread the selected paragraphs regularly, density * n of the n first paragraphs are selected """
+	return int((i + 1) * density) > int(i * density)
+
+class BookGenerator:
+	def __init__(self, chapters=20, paragraphs=50, images=0.02, latex=0.05, templates=0.05, seed=0):
+		self.chapters = chapters
+		self.paragraphs = paragraphs # Per chapter
+		self.images = images
+		self.latex = latex
+		self.templates = templates
+		self.seed = seed
+
+	def get_params(self):
+		return {
+			'chapters' : self.chapters,
+			'paragraphs' : self.paragraphs,
+			'images' : self.images,
+			'latex' : self.latex,
+			'templates' : self.templates,
+			'seed' : self.seed,
+		}
+
+	def make_paragraph(self, rand, i):
+		words = [rand.choice(WORDS) for _ in range(rand.randint(40, 120))]
+		for k in range(0, len(words), 17):
+			words[k] = '*{}*'.format(words[k]) if k % 2 else '**{}**'.format(words[k])
+		text = ' '.join(words).capitalize() + '.'
+
+		if is_selected(i, self.latex):
+			if i % 4 == 0:
+				text += '\n\n' + DISPLAY_EQUATION.format(i)
+			else:
+				text += ' ' + EQUATIONS[i % len(EQUATIONS)].format(i)
+		if is_selected(i, self.templates):
+			text += ' ' + DIRECTIVES[i % len(DIRECTIVES)].format(i)
+		if is_selected(i, self.images):
+			text += '\n\n![Figure {}](images/image{}.png)'.format(i, i % len(IMAGE_SIZES))
+		return text
+
+	def make_chapter(self, rand, index):
+		lines = ['# Chapter {}'.format(index + 1)]
+		for k in range(self.paragraphs):
+			i = index * self.paragraphs + k
+			if k and k % 10 == 0:
+				lines.append('## Section {}'.format(k // 10))
+			if k and k % 25 == 0:
+				lines.append('***')
+			lines.append(self.make_paragraph(rand, i))
+		return '\n\n'.join(lines) + '\n'
+
+	def get_book_config(self, latex_server):
+		chapters = ', '.join('chapter{:03}.md'.format(i) for i in range(self.chapters))
+		return '\n'.join([
+			'targets:',
+			'  main:',
+			'    name: bench',
+			'    title: Synthetic book',
+			'    by: md2book',
+			'    chapters: [{}]'.format(chapters),
+			'    latex:',
+			'      renderer: http',
+			'      server: {}'.format(latex_server),
+			'',
+		])
+
+	def generate(self, path, latex_server):
+		""" Write the book in the directory path, and return the path of its configuration file """
+		path = Path(path)
+		(path / 'images').mkdir(parents=True, exist_ok=True)
+		for i, (width, height) in enumerate(IMAGE_SIZES):
+			(path / 'images' / 'image{}.png'.format(i)).write_bytes(make_png(width, height))
+
+		rand = random.Random(self.seed)
+		for index in range(self.chapters):
+			chapter = self.make_chapter(rand, index)
+			(path / 'chapter{:03}.md'.format(index)).write_text(chapter, encoding='utf-8')
+
+		book_path = path / 'book.yml'
+		book_path.write_text(self.get_book_config(latex_server), encoding='utf-8')
+		return book_path
+
+def main():
+	if len(sys.argv) < 2:
+		print(__doc__.strip())
+		sys.exit(1)
+	args = [int(sys.argv[2]) if len(sys.argv) > 2 else 20, int(sys.argv[3]) if len(sys.argv) > 3 else 50]
+	args += [float(arg) for arg in sys.argv[4:7]]
+	book_path = BookGenerator(*args).generate(sys.argv[1], 'http://127.0.0.1:8000')
+	print('Book written to', book_path)
+
+if __name__ == '__main__':
+	main()
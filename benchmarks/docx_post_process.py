@@ -0,0 +1,125 @@
+"""
+	Time the post-processing of a large docx file: separators, page breaks, alignment and images.
+	The paragraphs of word/document.xml are rewritten in one pass, compared to the previous implementation
+	that loaded the whole document with python-docx, walked its paragraphs and saved it again.
+
+	Usage: python benchmarks/docx_post_process.py [number of chapters] [number of runs]
+"""
+import sys, io, re, copy, time, struct, zlib, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import docx
+from docx.enum.text import WD_BREAK
+from docx.enum.style import WD_STYLE_TYPE
+
+from md2book.config import DEFAULT_TARGET
+from md2book.formats.mddocx import post_process_docx, ALIGMENTS, REGEX_IMAGES, SEP_MARGIN
+from md2book.util.common import get_file_local_path
+
+def make_png(width, height):
+	def chunk(kind, data):
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+	pixels = b''.join(b'\0' + b'\x80\x80\x80' * width for _ in range(height))
+	header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+	return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(pixels)) + chunk(b'IEND', b'')
+
+class DocxFile:
+	def __init__(self, data):
+		self.data = data
+
+	def get_bytes(self):
+		return self.data
+
+	def load_bytes(self, data):
+		self.data = data
+
+def legacy_post_process_docx(docx_file, target):
+	document = docx.Document(io.BytesIO(docx_file.get_bytes()))
+	sep_style = document.styles.add_style('SepStyle', WD_STYLE_TYPE.PARAGRAPH)
+	sep_style.base_style = document.styles['Body Text']
+
+	alignment = target['style']['align']
+	heading_sep = 'Heading ' + str(target['chapter-level'])
+	image_alignment = 'center' if target['style']['center-blocks'] else alignment
+	for i, p in enumerate(document.paragraphs):
+		txt = p.text.strip()
+		if txt == '[[SEP-ITEM]]':
+			p.text = target['sep']
+			p.style = document.styles['SepStyle']
+			p.alignment = ALIGMENTS['center']
+			p.paragraph_format.space_before = SEP_MARGIN
+			p.paragraph_format.space_after = SEP_MARGIN
+		elif txt == '[[SKIP-ITEM]]':
+			p.text = ''
+			p.add_run().add_break(WD_BREAK.PAGE)
+		else:
+			if p.style.name == heading_sep and i > 0:
+				p.paragraph_format.page_break_before = True
+			if alignment in ALIGMENTS:
+				p.alignment = ALIGMENTS[alignment]
+
+		images = []
+		if "[[IMAGE-ITEM]]" in p.text:
+			p.text = re.sub(REGEX_IMAGES, lambda m: images.append(m.group(2)) or '', p.text)
+			r = p.add_run()
+			for url in images:
+				url = get_file_local_path(url)
+				if url:
+					r.add_picture(url)
+			if image_alignment in ALIGMENTS:
+				p.alignment = ALIGMENTS[image_alignment]
+	output = io.BytesIO()
+	document.save(output)
+	docx_file.load_bytes(output.getvalue())
+
+def make_document(n, image_path):
+	document = docx.Document()
+	for i in range(n):
+		document.add_heading('Chapter {}'.format(i), 1)
+		document.add_paragraph('Some text, ').add_run('in bold').bold = True
+		document.add_paragraph('[[SEP-ITEM]]')
+		document.add_heading('Section', 2)
+		document.add_paragraph('A figure [[IMAGE-ITEM]][[figure]][[{}]] in the text.'.format(image_path))
+		document.add_paragraph('[[SKIP-ITEM]]')
+		document.add_paragraph('A paragraph of plain text, that is only aligned. ' * 10)
+	output = io.BytesIO()
+	document.save(output)
+	return output.getvalue()
+
+def describe(data):
+	document = docx.Document(io.BytesIO(data))
+	return [
+		(p.text, p.style.name, p.alignment, p.paragraph_format.page_break_before, len(p._p.xpath('.//a:blip')))
+		for p in document.paragraphs
+	]
+
+def timed(function, data, target, runs):
+	start = time.perf_counter()
+	for _ in range(runs):
+		docx_file = DocxFile(data)
+		function(docx_file, target)
+	return (time.perf_counter() - start) / runs, docx_file.get_bytes()
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+	runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+	target = copy.deepcopy(DEFAULT_TARGET)
+	target['style']['align'] = 'justify'
+
+	with tempfile.TemporaryDirectory() as dir_path:
+		image_path = Path(dir_path) / 'image.png'
+		image_path.write_bytes(make_png(64, 48))
+		data = make_document(n, image_path)
+		print('{} chapters, {} bytes of docx'.format(n, len(data)))
+
+		legacy_time, legacy_result = timed(legacy_post_process_docx, data, target, runs)
+		pass_time, pass_result = timed(post_process_docx, data, target, runs)
+
+	assert describe(legacy_result) == describe(pass_result), "The rewritten document is different"
+	print('python-docx walk       : {:8.4f} s'.format(legacy_time))
+	print('one pass on the xml    : {:8.4f} s'.format(pass_time))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,83 @@
+"""
+	Time the alteration of the html code of a large book by the modules: one regex substitution
+	per change on the whole code (alter_html), compared to the tree parsed once with lxml (alter_dom).
+
+	Usage: python benchmarks/html_tree.py [number of chapters] [number of runs]
+"""
+import sys, copy, time, tempfile
+from types import SimpleNamespace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from md2book.config import DEFAULT_TARGET, MD_CONFIG
+from md2book.convert.forms_text import HtmlCode
+from md2book.convert.pipelines import get_markdown_converter
+from md2book.formats.htmltree import parse_html, serialize_html
+from md2book.modules.mdfilemods import ImagesModule, HtmlBlocksModule
+
+SVG = '<?xml version="1.0" standalone="no" ?>\n\
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n\
+<svg xmlns="http://www.w3.org/2000/svg" width="2.3ex" height="1.7ex" viewBox="0 -750 1000 800"></svg>\n'
+
+def make_chapter(i, dir_path):
+	return '\n\n'.join([
+		'# Chapter {}'.format(i),
+		'Some *text* with a [link](http://example.com/{}) and <!-- a comment --> in it.'.format(i),
+		'An image ![figure](image.png) and <img src="image.png"> without alt.',
+		'A vector image ![vector]({}).'.format(dir_path / 'image.svg'),
+		'A line<br>break, and a paragraph of plain text that is not changed by any module. ' * 3,
+		'- item\n- other item\n- last item',
+		'```\ncode <!-- kept --> in a block\n```',
+	] + ['A paragraph of plain text, with *some* emphasis and nothing to alter in it. ' * 4] * 10)
+
+def alter_html(html, modules):
+	code = HtmlCode(html, 'Benchmark')
+	for mod in modules:
+		mod.alter_html(code)
+	return code.code
+
+def alter_dom(html, modules):
+	code = HtmlCode(html, 'Benchmark')
+	code.tree = parse_html(code.code)
+	for mod in modules:
+		mod.alter_dom(code)
+	return serialize_html(code.tree)
+
+def timed(function, runs):
+	start = time.perf_counter()
+	for _ in range(runs):
+		function()
+	return (time.perf_counter() - start) / runs
+
+class BenchTarget(SimpleNamespace):
+	""" The parts of a target read by the modules """
+	def __getitem__(self, key):
+		return self.conf[key]
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+	runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+	with tempfile.TemporaryDirectory() as dir_path:
+		dir_path = Path(dir_path)
+		(dir_path / 'image.svg').write_text(SVG)
+		md_code = '\n\n'.join(make_chapter(i, dir_path) for i in range(n))
+		html = get_markdown_converter(copy.deepcopy(MD_CONFIG)).convert(md_code)
+		print('{} chapters, {} characters of html'.format(n, len(html)))
+
+		target = BenchTarget(format='html', path=dir_path / 'book.yml', conf=copy.deepcopy(DEFAULT_TARGET))
+		modules = [
+			ImagesModule(copy.deepcopy(DEFAULT_TARGET['images']), target),
+			HtmlBlocksModule({}, target),
+		]
+		regex_time = timed(lambda: alter_html(html, modules), runs)
+		tree_time = timed(lambda: alter_dom(html, modules), runs)
+		parse_time = timed(lambda: alter_dom(html, []), runs)
+
+	print('regex per change (alter_html) : {:8.4f} s'.format(regex_time))
+	print('tree parsed once (alter_dom)  : {:8.4f} s'.format(tree_time))
+	print('  of which parse and serialize: {:8.4f} s'.format(parse_time))
+
+if __name__ == '__main__':
+	main()
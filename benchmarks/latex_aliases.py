@@ -0,0 +1,61 @@
+"""
+	Time the replacement of the default LaTeX aliases, compared to the previous implementation
+	that loaded the alias files and applied one regex per alias for every equation.
+
+	Usage: python benchmarks/latex_aliases.py [number of equations] [number of distinct equations]
+"""
+import sys, re, time, random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from md2book.config import DATA_PATH
+from md2book.util.common import load_yaml_file
+from md2book.formats.latex import AliasesReplacer
+
+ALIASES_FILE = DATA_PATH / 'default_aliases.yml'
+# Names that overlap: the aliases must be applied in order, \R first
+OVERLAPPING_ALIASES = [('\\R', '\\mathbb{R}'), ('\\R_+', '\\mathbb{R}^+'), ('\\mathbb', '\\mathbf')]
+
+def legacy_preprocess(texcode, aliases=None):
+	if aliases is None:
+		aliases = list(load_yaml_file(ALIASES_FILE).items())
+	for alias_from, alias_to in aliases:
+		alias_from = alias_from.replace('\\', '\\\\')
+		alias_to = alias_to.replace('\\', '\\\\')
+		texcode = re.sub(alias_from + r'(?=([^a-zA-Z\d]|$))', alias_to, texcode)
+	return texcode
+
+def make_equations(n, distinct):
+	random.seed(0)
+	tokens = ['\\R', '\\N', '\\Z', '\\Q', '\\C', 'x', '^2', '+', '\\in', '\\frac{a}{b}', ' ', '\\Rn', '_{i}']
+	pool = [''.join(random.choice(tokens) for _ in range(20)) for _ in range(distinct)]
+	return [random.choice(pool) for _ in range(n)]
+
+def timed(function, equations):
+	start = time.perf_counter()
+	results = [function(eq) for eq in equations]
+	return time.perf_counter() - start, results
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	distinct = int(sys.argv[2]) if len(sys.argv) > 2 else n // 4
+	equations = make_equations(n, distinct)
+	print('{} equations ({} distinct), {} default aliases'.format(n, distinct, len(load_yaml_file(ALIASES_FILE))))
+
+	legacy_time, legacy_results = timed(legacy_preprocess, equations)
+
+	start = time.perf_counter()
+	replacer = AliasesReplacer(list(load_yaml_file(ALIASES_FILE).items()))
+	setup_time = time.perf_counter() - start
+	compiled_time, compiled_results = timed(replacer.replace, equations)
+
+	assert legacy_results == compiled_results, "The compiled aliases give a different result"
+	overlapping = AliasesReplacer(OVERLAPPING_ALIASES)
+	for eq in equations[:100]:
+		assert legacy_preprocess(eq, OVERLAPPING_ALIASES) == overlapping.replace(eq), "The overlapping aliases give a different result"
+	print('legacy   : {:8.4f} s'.format(legacy_time))
+	print('compiled : {:8.4f} s (+ {:.4f} s to load and compile)'.format(compiled_time, setup_time))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,88 @@
+"""
+	Time the LaTeX renderers on a document with many equations.
+	The http renderer uses a local server answering after a simulated network latency,
+	and the user cache is in a temporary directory, so the benchmark never uses the network.
+
+	Usage: python benchmarks/latex_renderers.py [number of equations] [latency in ms]
+"""
+import sys, os, time, tempfile, threading, copy
+import http.server, socketserver
+from types import SimpleNamespace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['HOME'] = tempfile.mkdtemp() # Empty user cache, must be set before importing md2book
+
+from md2book.config import DEFAULT_TARGET
+from md2book.convert.forms_text import MarkdownCode
+from md2book.formats.mdrewrite import MarkdownRewriter
+from md2book.modules.mdfilemods import LatexModule
+
+SVG = '<?xml version="1.0" standalone="no" ?>\n\
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n\
+<svg xmlns="http://www.w3.org/2000/svg" width="2.3ex" height="1.7ex" viewBox="0 -750 1000 800"></svg>\n'
+
+def start_server(latency):
+	class Handler(http.server.BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+		wbufsize = 1 << 16 # Send the headers and the body together, to avoid delayed ACKs
+
+		def do_GET(self):
+			time.sleep(latency)
+			body = SVG.encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		def log_message(self, *args):
+			pass
+
+	class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+		daemon_threads = True
+
+	server = Server(('127.0.0.1', 0), Handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+def make_document(n):
+	lines = []
+	for i in range(n):
+		if i % 5 == 0:
+			lines.append('$$\n\\sum_{{k=0}}^{{{0}}} \\frac{{k^2}}{{{0}+1}}\n$$'.format(i))
+		else:
+			lines.append('The value $x_{{{0}}} = \\sqrt{{{0}}} + \\alpha$ is defined.'.format(i))
+	return '\n\n'.join(lines)
+
+def run(renderer, document, server, compile_dir):
+	conf = copy.deepcopy(DEFAULT_TARGET['latex'])
+	conf.update({'renderer' : renderer, 'server' : server})
+	target = SimpleNamespace(format='html', compile_dir=compile_dir)
+	code = MarkdownCode(document)
+
+	start = time.perf_counter()
+	module = LatexModule(conf, target)
+	rewriter = MarkdownRewriter()
+	module.rewrite_md(rewriter)
+	code.code = rewriter.rewrite(code.code)
+	module.alter_md(code)
+	return time.perf_counter() - start
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+	document = make_document(n)
+	server = start_server(latency)
+	print('{} equations, {:.0f} ms of latency for the http renderer'.format(n, latency * 1000))
+
+	for renderer in ['http', 'svg', 'mathml']:
+		with tempfile.TemporaryDirectory() as compile_dir:
+			try:
+				cold = run(renderer, document, server, Path(compile_dir))
+				warm = run(renderer, document, server, Path(compile_dir))
+			except Exception as e:
+				print('{:<8} unavailable: {}'.format(renderer, e))
+				continue
+		print('{:<8} cold: {:8.3f} s   warm: {:8.3f} s'.format(renderer, cold, warm))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,82 @@
+"""
+	Time the rewriting of the markdown code of a txt book with the images removed, compared to
+	the previous implementation that applied one re.sub per transformation on the whole document.
+
+	Usage: python benchmarks/markdown_rewrite.py [number of paragraphs] [part of paragraphs to rewrite] [number of runs]
+"""
+import sys, re, time, random, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from md2book.util.common import track_dependency
+from md2book.formats.mdrewrite import MarkdownRewriter
+from md2book.formats.mdtext import md_make_paths_absolute
+from md2book.formats.mdtxt import add_purify_txt_handlers
+from md2book.modules.mdfilemods import ImagesModule
+
+def legacy_make_paths_absolute(content, dir_path):
+	def complete_path(path):
+		if not Path(path).is_absolute() and (dir_path / path).exists():
+			track_dependency(dir_path / path)
+			return str(dir_path / path)
+		if Path(path).is_absolute():
+			track_dependency(path)
+		return path
+	content = re.sub(r'!\[(.*?)\]\((.*?)\)', lambda m: "![{}]({})".format(m.group(1), complete_path(m.group(2))), content)
+	content = re.sub(r'<img(.*?)src="(.*?)"', lambda m: '<img{}src="{}"'.format(m.group(1), complete_path(m.group(2))), content)
+	content = re.sub(r"<img(.*?)src='(.*?)'", lambda m: '<img{}src="{}"'.format(m.group(1), complete_path(m.group(2))), content)
+	return content
+
+def legacy_alter_md(code):
+	code = re.sub(r"<img(.*?)src=['\"](.*?)['\"](.*?)>", lambda m: '![]({})'.format(m.group(2)), code)
+	code = re.sub(r"==(.*?)==", lambda m: m.group(1), code)
+	code = re.sub(r"<!--([\s\S]*?)-->", '', code)
+	code = re.sub(r"<style.*?>([\s\S]*?)</style.*?>", '', code)
+	code = re.sub(r'<a.*?href=([\'"])(.*?)\1.*?>(.*?)</.*?a.*?>', lambda m: '[{}]({})'.format(m.group(3), m.group(2)), code)
+	code = re.sub(r'</?[a-zA-Z].*?>', '', code)
+	code = re.sub(r"<img.*?>|!\[.*?\]\(.*?\)", '', code)
+	return code
+
+def alter_md(code):
+	rewriter = MarkdownRewriter()
+	add_purify_txt_handlers(rewriter)
+	for regex in ImagesModule.REGEX_RM_IMG:
+		rewriter.add(regex, '')
+	return rewriter.rewrite(code)
+
+def make_document(n, density):
+	random.seed(0)
+	items = [
+		'Some *text* with a ==highlight== and a <a href="http://example.com">link</a>.',
+		'An image ![caption](image.png) and <img src="image.png" alt="other"> in the text.',
+		'<!-- A comment -->', '<span class="small">Small</span> text, <br> and more text.',
+	]
+	text = 'A paragraph of plain text, with *some* emphasis and nothing to rewrite in it. ' * 4
+	return '\n\n'.join(random.choice(items) if random.random() < density else text for _ in range(n))
+
+def timed(function, runs):
+	start = time.perf_counter()
+	for _ in range(runs):
+		result = function()
+	return (time.perf_counter() - start) / runs, result
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	density = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+	runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+	document = make_document(n, density)
+	print('{} paragraphs, {} characters, {:.0%} of the paragraphs to rewrite'.format(n, len(document), density))
+
+	with tempfile.TemporaryDirectory() as dir_path:
+		dir_path = Path(dir_path)
+		(dir_path / 'image.png').write_bytes(b'')
+		legacy_time, legacy_result = timed(lambda: legacy_alter_md(legacy_make_paths_absolute(document, dir_path)), runs)
+		single_time, single_result = timed(lambda: alter_md(md_make_paths_absolute(document, dir_path)), runs)
+
+	assert legacy_result == single_result, "The single pass gives a different result"
+	print('one re.sub per transformation : {:8.4f} s'.format(legacy_time))
+	print('single pass                   : {:8.4f} s'.format(single_time))
+
+if __name__ == '__main__':
+	main()
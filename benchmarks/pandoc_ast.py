@@ -0,0 +1,81 @@
+"""
+	Time the builds of a synthetic book (see bookgen.py) to the formats written by pandoc, sharing the
+	stages like `md2book -a`: the markdown changed for each format and parsed again by pandoc, compared to
+	the markdown parsed once into the AST of pandoc, that each format changes and writes (build.pandoc-ast).
+	The texts of the documents given by both builds are compared.
+
+	Usage: python benchmarks/pandoc_ast.py [number of chapters] [number of runs]
+"""
+import sys, os, io, re, time, zipfile, tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['HOME'] = tempfile.mkdtemp() # Empty user cache, must be set before importing md2book
+
+from md2book.config import PANDOC_AST_FORMATS, TMP_DIRS
+from md2book.main import get_target_md_code
+from md2book.util.common import load_yaml_file
+from md2book.util.settings import Target, load_settings
+from md2book.convert.convert import convertBook
+from md2book.convert.stages import StageCache
+from md2book.formats.pandocast import PARSED_ASTS
+from bookgen import BookGenerator, start_latex_server
+
+TEXT_PARTS = r'^word/document\.xml$|^content\.xml$|\.xhtml$' # Of the docx, odt and epub files
+
+def build_all(book_path, output_dir):
+	""" Build the book to all the formats, return the output files """
+	stages = StageCache()
+	PARSED_ASTS.clear()
+	files = []
+	with tempfile.TemporaryDirectory() as tmp_dir, redirect_stdout(io.StringIO()):
+		TMP_DIRS.insert(0, Path(tmp_dir).resolve())
+		try:
+			for form in PANDOC_AST_FORMATS:
+				target = Target(path=book_path, compile_dir=output_dir, conf={})
+				target.load_from_settings(load_yaml_file(book_path)['targets'], form)
+				target.complete()
+				files.append(convertBook(get_target_md_code(target), target, stages))
+		finally:
+			TMP_DIRS.pop(0)
+	return files
+
+def get_text(path):
+	if not zipfile.is_zipfile(path):
+		return Path(path).read_bytes()
+	with zipfile.ZipFile(path) as package:
+		return [package.read(name) for name in sorted(package.namelist()) if re.search(TEXT_PARTS, name)]
+
+def timed_builds(book_path, output_dir, runs):
+	build_all(book_path, output_dir) # The LaTeX images are then in the cache
+	start = time.perf_counter()
+	for _ in range(runs):
+		files = build_all(book_path, output_dir)
+	return (time.perf_counter() - start) / runs, files
+
+def main():
+	chapters = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+	load_settings()
+
+	server = start_latex_server()
+	with tempfile.TemporaryDirectory() as book_dir:
+		book_path = BookGenerator(chapters).generate(book_dir, server)
+		config = book_path.read_text(encoding='utf-8')
+		output_dir = Path(book_dir) / 'generated' # The same paths in both documents
+		output_dir.mkdir()
+		results = {}
+		for ast_mode in [False, True]:
+			book_path.write_text(config + '    build:\n      pandoc-ast: {}\n'.format(str(ast_mode).lower()), encoding='utf-8')
+			build_time, files = timed_builds(book_path, output_dir, runs)
+			results[ast_mode] = (build_time, len(PARSED_ASTS), [get_text(path) for path in files])
+
+	print('{} chapters, formats: {}'.format(chapters, ', '.join(PANDOC_AST_FORMATS)))
+	print('markdown parsed by each format  : {:8.4f} s'.format(results[False][0]))
+	print('AST parsed once (pandoc-ast)    : {:8.4f} s, {} parse(s)'.format(results[True][0], results[True][1]))
+	for form, regex_text, ast_text in zip(PANDOC_AST_FORMATS, results[False][2], results[True][2]):
+		print('{:<5} documents: {}'.format(form, 'same text' if regex_text == ast_text else 'DIFFERENT'))
+
+if __name__ == '__main__':
+	main()
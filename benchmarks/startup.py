@@ -0,0 +1,68 @@
+"""
+	Time the startup of md2book: "md2book --help", and the build of a small book to markdown,
+	which should not load the html, pdf and docx dependencies.
+	Each command is executed in a new python process, and the median time is displayed.
+
+	Usage: python benchmarks/startup.py [number of runs] [other md2book source directories to compare...]
+"""
+import sys, os, time, tempfile, subprocess, statistics
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+BOOK = """targets:
+  main:
+    title: Startup
+    name: startup
+    format: markdown
+    chapters: [chapter.md]
+"""
+
+# The external commands are not needed to measure the startup, and may be missing
+COMMAND = """
+import sys
+import md2book.start as start
+start.dependencies = []
+sys.argv = ['md2book'] + sys.argv[1:]
+try:
+	start.main()
+finally:
+	heavy = [m for m in ('markdown', 'pdfkit', 'docx', 'lxml', 'ssl') if m in sys.modules]
+	sys.stderr.write('HEAVY ' + ' '.join(heavy) + '\\n')
+"""
+
+def make_book(path):
+	(path / 'book.yml').write_text(BOOK)
+	(path / 'chapter.md').write_text('# Chapter\n\nSome *text*.\n')
+
+def run(source, args, cwd):
+	env = {**os.environ, 'PYTHONPATH' : str(source)}
+	start = time.perf_counter()
+	r = subprocess.run([sys.executable, '-c', COMMAND] + args, cwd=str(cwd), env=env, capture_output=True, text=True)
+	duration = time.perf_counter() - start
+	heavy = [l[6:] for l in r.stderr.split('\n') if l.startswith('HEAVY')]
+	return duration, (heavy[0] if heavy else '?')
+
+def bench(source, runs, book_dir):
+	results = {}
+	for name, args in [('--help', ['--help']), ('markdown build', ['-f', '.'])]:
+		times = []
+		for _ in range(runs):
+			duration, heavy = run(source, args, book_dir)
+			times.append(duration)
+		results[name] = (statistics.median(times), heavy)
+	return results
+
+def main():
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	sources = [REPO] + [Path(p).resolve() for p in sys.argv[2:]]
+
+	with tempfile.TemporaryDirectory() as book_dir:
+		make_book(Path(book_dir))
+		for source in sources:
+			print('== {}'.format(source))
+			for name, (duration, heavy) in bench(source, runs, Path(book_dir)).items():
+				print('{:<16} {:7.1f} ms   heavy modules loaded: {}'.format(name, duration * 1000, heavy or '-'))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,192 @@
+"""
+	Build a synthetic book (see bookgen.py) to every format of BASE_FORMATS, and time each build end to end
+	and per conversion stage: template filling, markdown alterations, conversion to html, and the output
+	(pandoc, wkhtmltopdf, post-processing and writing). The sizes of the outputs are recorded.
+
+	The results can be saved as a baseline, and are compared to the baseline of the previous run:
+	the formats slower, or larger, than the baseline by more than the threshold are reported as
+	regressions, and the exit code is 1. The user caches are in a temporary directory, so the first
+	build of each format is a cold build, and the others reuse the caches like an incremental build.
+
+	Usage: python benchmarks/suite.py [--help] [options]
+"""
+import sys, os, io, json, time, argparse, tempfile, statistics, platform
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['HOME'] = tempfile.mkdtemp() # Empty user cache, must be set before importing md2book
+
+from md2book.config import BASE_FORMATS, TMP_DIRS
+from md2book.main import get_target_md_code
+from md2book.util.common import load_yaml_file
+from md2book.util.settings import Target, load_settings
+from md2book.util.exceptions import BaseError
+from md2book.convert.convert import convertBook
+from md2book.convert.stages import StageCache
+from bookgen import BookGenerator, start_latex_server
+
+BENCHMARKS_PATH = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCHMARKS_PATH / 'baseline.json'
+STAGES = ['fill', 'markdown', 'html', 'output']
+
+class TimedStages(StageCache):
+	""" Stage cache that records the time spent computing each stage, without reusing the results """
+	def __init__(self):
+		super().__init__(max_size=0)
+		self.times = {}
+
+	def run(self, stage, text, target, compute):
+		start = time.perf_counter()
+		result = super().run(stage, text, target, compute)
+		self.times[stage] = self.times.get(stage, 0) + time.perf_counter() - start
+		return result
+
+def get_cmd_args():
+	parser = argparse.ArgumentParser(description='Benchmark the builds of a synthetic book to all the formats')
+	parser.add_argument('--chapters', type=int, default=20, help='Number of chapters')
+	parser.add_argument('--paragraphs', type=int, default=50, help='Paragraphs per chapter')
+	parser.add_argument('--images', type=float, default=0.02, help='Part of the paragraphs followed by an image')
+	parser.add_argument('--latex', type=float, default=0.05, help='Part of the paragraphs containing an equation')
+	parser.add_argument('--templates', type=float, default=0.05, help='Part of the paragraphs containing a template directive')
+	parser.add_argument('--latency', type=float, default=5, help='Latency (in ms) of the local LaTeX server')
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the generated text')
+	parser.add_argument('--runs', type=int, default=3, help='Builds of each format, the first one is cold')
+	parser.add_argument('--formats', nargs='+', default=BASE_FORMATS, choices=BASE_FORMATS, help='Formats to build')
+	parser.add_argument('--baseline', type=str, default=str(DEFAULT_BASELINE), help='Baseline file (json)')
+	parser.add_argument('--save', action='store_true', default=False, help='Save the results as the new baseline')
+	parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown compared to the baseline (0.2 for 20%%)')
+	parser.add_argument('--format-threshold', action='append', default=[], metavar='FORMAT=THRESHOLD',
+		help='Allowed slowdown of one format, pdf=0.5 for instance')
+	parser.add_argument('--min-slowdown', type=float, default=0.01, help='Slowdowns shorter than this (in seconds) are measurement noise')
+	parser.add_argument('--size-threshold', type=float, default=0.05, help='Allowed growth of the outputs')
+	return parser.parse_args()
+
+def get_thresholds(args):
+	thresholds = {form : args.threshold for form in BASE_FORMATS}
+	for item in args.format_threshold:
+		form, _, value = item.partition('=')
+		if form not in BASE_FORMATS or not value:
+			sys.exit('Invalid threshold {}, it should be FORMAT=THRESHOLD'.format(item))
+		thresholds[form] = float(value)
+	return thresholds
+
+# -------------------- BUILDS -------------------- #
+
+def build(book_path, form, output_dir):
+	""" Build the book to one format, return (total time, time of each stage, output file) """
+	stages = TimedStages()
+	log = io.StringIO()
+	with tempfile.TemporaryDirectory() as tmp_dir, redirect_stdout(log):
+		TMP_DIRS.insert(0, Path(tmp_dir).resolve())
+		try:
+			start = time.perf_counter()
+			target = Target(path=book_path, compile_dir=output_dir, conf={})
+			target.load_from_settings(load_yaml_file(book_path)['targets'], form)
+			target.complete()
+			out_file = convertBook(get_target_md_code(target), target, stages)
+			total = time.perf_counter() - start
+		finally:
+			TMP_DIRS.pop(0)
+	times = dict(stages.times)
+	times['output'] = max(0, total - sum(times.values()))
+	return total, times, out_file
+
+def bench_format(book_path, form, output_dir, runs):
+	""" Results of the builds of a format, or None if its dependencies are not installed """
+	builds = []
+	try:
+		for _ in range(runs):
+			builds.append(build(book_path, form, output_dir))
+	except BaseError as e:
+		print('{:<9} unavailable: {}'.format(form, str(e).strip()))
+		return None
+
+	warm = builds[1:] or builds
+	return {
+		'cold' : builds[0][0],
+		'time' : statistics.median(total for total, _, _ in warm),
+		'stages' : {stage : statistics.median(times.get(stage, 0) for _, times, _ in warm) for stage in STAGES},
+		'size' : os.path.getsize(builds[-1][2]),
+	}
+
+# -------------------- BASELINE -------------------- #
+
+def load_baseline(path, params):
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			baseline = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if baseline.get('params') != params:
+		print('The baseline {} was made with other parameters, it is not used'.format(path))
+		return None
+	return baseline
+
+def compare(results, baseline, thresholds, size_threshold, min_slowdown):
+	""" Descriptions of the regressions compared to the baseline """
+	regressions = []
+	for form, result in results.items():
+		base = baseline['results'].get(form)
+		if not result or not base:
+			continue
+		slowdown = result['time'] - base['time']
+		if slowdown > base['time'] * thresholds[form] and slowdown > min_slowdown:
+			regressions.append('{}: {:.3f} s instead of {:.3f} s (+{:.0%}, threshold {:.0%})'.format(
+				form, result['time'], base['time'], result['time'] / base['time'] - 1, thresholds[form]))
+		if result['size'] > base['size'] * (1 + size_threshold):
+			regressions.append('{}: {} bytes instead of {} bytes (+{:.0%}, threshold {:.0%})'.format(
+				form, result['size'], base['size'], result['size'] / base['size'] - 1, size_threshold))
+	return regressions
+
+def format_change(value, base):
+	if not base:
+		return ''
+	return '{:+.0%}'.format(value / base - 1)
+
+def print_results(results, baseline):
+	print('{:<9} {:>9} {:>9} {:>7} {}  {:>10} {:>7}'.format(
+		'format', 'cold (s)', 'warm (s)', 'change', ''.join('{:>10}'.format(stage) for stage in STAGES), 'size', 'change'))
+	for form, result in results.items():
+		if not result:
+			continue
+		base = (baseline or {}).get('results', {}).get(form) or {}
+		print('{:<9} {:9.3f} {:9.3f} {:>7} {}  {:>10} {:>7}'.format(
+			form, result['cold'], result['time'], format_change(result['time'], base.get('time')),
+			''.join('{:10.3f}'.format(result['stages'][stage]) for stage in STAGES),
+			result['size'], format_change(result['size'], base.get('size')),
+		))
+
+def main():
+	args = get_cmd_args()
+	load_settings()
+	generator = BookGenerator(args.chapters, args.paragraphs, args.images, args.latex, args.templates, args.seed)
+	params = generator.get_params()
+	params['latency'] = args.latency
+
+	server = start_latex_server(args.latency / 1000)
+	results = {}
+	with tempfile.TemporaryDirectory() as book_dir:
+		book_path = generator.generate(book_dir, server)
+		output_dir = Path(book_dir) / 'generated'
+		output_dir.mkdir()
+		print('{chapters} chapters of {paragraphs} paragraphs, images: {images}, LaTeX: {latex}, templates: {templates}'.format(**params))
+		for form in args.formats:
+			results[form] = bench_format(book_path, form, output_dir, args.runs)
+
+	baseline = load_baseline(args.baseline, params)
+	print_results(results, baseline)
+
+	regressions = compare(results, baseline, get_thresholds(args), args.size_threshold, args.min_slowdown) if baseline else []
+	if args.save:
+		with open(args.baseline, 'w', encoding='utf-8') as f:
+			json.dump({'params' : params, 'python' : platform.python_version(), 'results' : results}, f, indent=1)
+		print('Baseline saved to', args.baseline)
+	if regressions:
+		print('Regressions compared to the baseline:')
+		for regression in regressions:
+			print('  ' + regression)
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,52 @@
+"""
+	Time the filling of a book that uses many template directives: counters, conditionals and
+	expressions in each section. The expressions are compiled once, compared to the previous
+	implementation that called eval on the text of the expression at each directive.
+
+	Usage: python benchmarks/templates.py [number of sections] [number of runs]
+"""
+import sys, time, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from md2book.templates import TemplateEngine
+
+SECTION = """
+## Section {%section:counter%}
+
+{%level:eval:section % 3%}
+{%:if:level == "0":This section starts a new part.:else:This section continues the part.%}
+{%:if:show_notes:*Note {%note:counter%} of the section.*%}
+The ratio is {%:eval:round(int(section) / 7, 2)%}, and the author is {%author%}.
+{%:if:int(section) > 10 and int(section) < 20:A section of the second series.%}
+"""
+
+VALUES = {'author' : 'Someone', 'show_notes' : True}
+
+class LegacyEngine(TemplateEngine):
+	def eval_expression(self, expr):
+		return eval(expr, {}, self.values)
+
+def timed(engine_class, book, path, runs):
+	start = time.perf_counter()
+	for _ in range(runs):
+		result = engine_class(VALUES, path).format(book)
+	return (time.perf_counter() - start) / runs, result
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+	book = SECTION * n
+	print('{} sections, {} directives'.format(n, book.count('{%')))
+
+	with tempfile.TemporaryDirectory() as path:
+		legacy_time, legacy_result = timed(LegacyEngine, book, Path(path), runs)
+		compiled_time, compiled_result = timed(TemplateEngine, book, Path(path), runs)
+
+	assert legacy_result == compiled_result, "The compiled expressions give a different result"
+	print('eval of the text       : {:8.4f} s'.format(legacy_time))
+	print('compiled expressions   : {:8.4f} s'.format(compiled_time))
+
+if __name__ == '__main__':
+	main()
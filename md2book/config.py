@@ -14,6 +14,13 @@ EMBED_FONTS_PATH = DATA_PATH / 'fonts'
 
 CONFIG_PATH = (Path.home() / '.md2book').resolve()
 DEFAULT_SETTINGS = CONFIG_PATH / 'settings.yml'
+CACHE_PATH = CONFIG_PATH / 'cache'
+LATEX_CACHE_PATH = CACHE_PATH / 'latex'
+DAEMON_SOCKET = CONFIG_PATH / 'daemon.sock' # Unix socket of "md2book serve"
+COMMANDS_CACHE_FILE = CACHE_PATH / 'commands.json' # Paths of pandoc and wkhtmltopdf, for each PATH
+REMOTE_CACHE_PATH = CACHE_PATH / 'remote' # Stylesheets, scripts and images downloaded by the builds
+IMAGES_CACHE_PATH = CACHE_PATH / 'images' # Resized and compressed images, named by the hash of the image and the options
+FONTS_CACHE_PATH = CACHE_PATH / 'fonts' # Subsets of the fonts, named by the hash of the font and the characters
 
 try:
 	CONFIG_PATH.mkdir(parents=True, exist_ok=True)
@@ -39,6 +46,8 @@ M2B_EPILOG = 'Settings : {}\
 
 BOOK_FILE_NAMES = "*book.yml"
 DEFAULT_GEN_DIR = "generated"
+MANIFEST_FILE = ".{}.md2book.json" # Inputs of an output file, for incremental builds
+WATCH_INTERVAL = 0.5 # Delay in seconds between two checks for changes, in watch mode
 
 BASE_STYLES = {
 	"default" : ["default.css"],
@@ -65,6 +74,12 @@ DEFAULT_TARGET = {
 	'js' : [],
 	'between-chapters' : '\n\n',
 	'chapter-level' : 1, # or 2, 3 : level where to split into chapters
+	'build' : {
+		'parallel' : False, # Convert the chapters of html and pdf books in parallel: true, or a number of processes
+		'html-tree' : False, # Parse the html once, for all the modules, instead of a regex per change (requires lxml). About 5 times slower with the current modules: 0.15 s against 0.03 s for 2 MB of html (benchmarks/html_tree.py)
+		'pandoc-ast' : False, # Parse the markdown with pandoc once for all the formats that use it, and write them from the AST
+		'svg-symbols' : False, # Define once each svg image used several times in html and pdf documents, and reference it at each occurrence
+	},
 
 	# Modules : 
 	'sep' : '✶   ✶   ✶',
@@ -72,6 +87,10 @@ DEFAULT_TARGET = {
 		'enable': True,
 		'aliases_file': None,
 		'default_aliases': True,
+		'renderer': 'http', # http (download from the server), svg (ziamath) or mathml (latex2mathml)
+		'clean_cache': True, # Remove the unused images from the LaTeX directory
+		'server': 'https://math.vercel.app', # Server rendering LaTeX to svg
+		'cache_size': 100, # Maximum size (in MB) of the images cached in the user directory
 	},
 	'titlepage' : {
 		'enable' : True,
@@ -80,11 +99,18 @@ DEFAULT_TARGET = {
 	'images' : {
 		'remove' : False,
 		'cover' : None,
+		# Resize and compress the images (requires Pillow). The images are kept as they are if all the options are null
+		'max-width' : None, # In pixels, for the larger images
+		'dpi' : None, # Resolution stored in the images, which sets their printed size in the docx and odt files
+		'quality' : None, # From 1 to 100, for the jpeg and webp images
+		'format' : None, # Convert the images to jpeg, png or webp
 	},
 	'font': {
 		'default' : 'opensans',
 		'include' : [], # Additional fonts
 		'size' : None,
+		'subset' : False, # Embed only the characters used by the book, in html, pdf and epub (requires fontTools)
+		'woff2' : True, # Compress the subsets to WOFF2, in html and epub (requires brotli)
 	},
 	'toc' : {
 		'enable' : True, # Generate a TOC at the begening of the file
@@ -156,6 +182,23 @@ FORMAT_ALIASES = {
 }
 ALLOWED_FORMATS = list(BASE_FORMATS) + list(FORMAT_ALIASES)
 
+PANDOC_AST_FORMATS = ['docx', 'odt', 'epub', 'txt'] # Written from the same AST, with the option build.pandoc-ast
+
+# Formats for which a conversion stage gives the same result, given the same configuration.
+# A format that is not listed is in its own group.
+STAGE_FORMAT_GROUPS = {
+	'fill' : { # Templates : only the values of 'sep' and 'skip' depend on the format
+		'markdown' : 'default', 'html' : 'default', 'pdf' : 'default', 'odt' : 'default',
+		'docx' : 'items', 'txt' : 'items',
+	},
+	'markdown' : { # Alterations of the markdown by the modules
+		'markdown' : 'html', 'html' : 'html', 'pdf' : 'html',
+	},
+	'html' : { # Conversion to html
+		'html' : 'html', 'pdf' : 'html',
+	},
+}
+
 def get_markdown_default_extensions():
 	# Import is done here to keep minimal depencies for this file
 	from md2book.formats.mdhtml import MarkdownExtended, TasklistExtension
@@ -171,6 +214,18 @@ MD_CONFIG = {
 	}
 }
 
+LATEX_DOWNLOAD_WORKERS = 8 # Concurrent downloads of LaTeX images
+
+REMOTE_FETCH_WORKERS = 8 # Concurrent downloads of the remote files of a target
+REMOTE_CACHE_SIZE = 200 * 1024 * 1024 # In bytes
+REMOTE_FRESH_TIME = 3600 # Delay in seconds before a cached file is revalidated with the server
+REMOTE_NEGATIVE_TTL = 60 # Delay in seconds before an url that can't be downloaded is tried again
+
+IMAGES_WORKERS = None # Images processed in parallel, None to use all the CPUs
+IMAGES_CACHE_SIZE = 500 * 1024 * 1024 # In bytes
+FONTS_CACHE_SIZE = 100 * 1024 * 1024 # In bytes
+LATEX_SVG_SIZE = 16 # Font size (in px) of the equations rendered locally, converted to em
+
 PDF_OPTIONS = { # https://wkhtmltopdf.org/usage/wkhtmltopdf.txt
 	'margin-top': '0.75in',
 	'margin-right': '0.7in',
@@ -0,0 +1,3 @@
+from .convert import convert_markdown
+
+__all__ = ['convert_markdown']
@@ -1,4 +1,8 @@
+import tempfile
+from copy import deepcopy
+
 from md2book.config import *
+from md2book.util.fetch import prefetch_remote_files
 from .pipelines import *
 
 # -------------------- EXTERNAL FUNCTIONS -------------------- #
@@ -13,13 +17,53 @@ FORMATS_PIPELINE = {
 	'txt' : PipeMd2txtPandoc,
 }
 
-def convertBook(code, target):
+def get_output_file(target):
+	ext = FORMATS_PIPELINE[target.format].DEST_FORMAT.EXT
+	return target.compile_dir / (target['name'] + '.' + ext)
+
+def convertBook(code, target, stages=None):
+	prefetch_remote_files(code, target)
 	code = MarkdownCode(code)
 	pipeline = FORMATS_PIPELINE[target.format]
-	code = pipeline(code).execute(target)
+	code = pipeline(code, stages).execute(target)
 
-	file_name = target['name'] + '.' + code.EXT
-	out_file = target.compile_dir / file_name
+	out_file = get_output_file(target)
 	code.output(out_file)
 
-	return out_file
\ No newline at end of file
+	return out_file
+
+API_STAGES = StageCache() # Shared by the conversions of the process
+
+def convert_markdown(markdown, target=None, base_path='.'):
+	"""
+		Convert markdown code with the configuration of a target (a dict, like the targets of a book file),
+		and return the content of the document, as bytes. The relative paths are relative to base_path.
+		The intermediate results are kept in memory, only a temporary directory is created for the tools
+		that need files (LaTeX images, stylesheets of epub books)
+	"""
+	from md2book.main import check_targets_validity
+	from md2book.formats.mdtext import md_make_paths_absolute
+	from md2book.util.settings import Target, load_settings
+
+	load_settings()
+	base_path = Path(base_path).resolve()
+	targets = {'main' : deepcopy(target or {})}
+	targets['main'].setdefault('name', 'document')
+	if targets['main'].get('title') is None:
+		targets['main']['title'] = targets['main']['name']
+	check_targets_validity(targets, 'main')
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		TMP_DIRS.insert(0, Path(tmp_dir).resolve())
+		try:
+			book_target = Target(path=base_path / 'book.yml', compile_dir=TMP_DIRS[0], conf={})
+			book_target.load_from_settings(targets, 'main')
+			book_target.complete()
+
+			markdown = md_make_paths_absolute(markdown, base_path)
+			prefetch_remote_files(markdown, book_target)
+			code = MarkdownCode(markdown)
+			code = FORMATS_PIPELINE[book_target.format](code, API_STAGES).execute(book_target)
+			return code.get_bytes()
+		finally:
+			TMP_DIRS.pop(0)
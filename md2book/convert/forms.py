@@ -1,5 +1,3 @@
-import shutil
-
 from md2book.util.common import rand_str
 from md2book.templates import TemplateFiller
 from md2book.config import *
@@ -8,6 +6,7 @@ from md2book.config import *
 
 class CodeData:
 	EXT = "txt"
+	PANDOC_FORMAT = None # Name of the format for the reader or the writer of pandoc
 	REF_DOC = False
 
 	def assertLang(self, *langsCls):
@@ -34,6 +33,13 @@ class CodeData:
 	def load_from(self, path):
 		raise Exception("Not implemented")
 
+	def load_bytes(self, data):
+		raise Exception("Not implemented")
+
+	def get_bytes(self):
+		""" Content of the output file """
+		raise Exception("Not implemented")
+
 	def output(self, dest=None):
 		raise Exception("Not implemented")
 
@@ -63,26 +69,38 @@ class PureCodeData(CodeData):
 		with open(str(path)) as f:
 			self.code = f.read()
 
+	def load_bytes(self, data):
+		self.code = data.decode('utf-8')
+
+	def get_bytes(self):
+		return self.get().encode('utf-8')
+
 # ----- File-based
 
 class OutFileCode(CodeData):
+	""" Binary document, kept in memory until it is written to the output file """
 	def __init__(self):
-		self.filepath = self.getStorageFile()
+		self.data = b''
 
 	def get(self):
-		return self.filepath
-
-	def getStrPath(self):
-		return str(self.filepath.resolve())
+		return self.data
 
 	def output(self, dest=None):
-		if dest:
-			shutil.copy(str(self.filepath), str(dest))
-			return dest
-		return self.filepath
+		if not dest:
+			dest = self.getStorageFile()
+		with open(str(dest), 'wb') as f:
+			f.write(self.data)
+		return dest
 
 	def load_from(self, path):
-		self.filepath = path
+		with open(str(path), 'rb') as f:
+			self.data = f.read()
+
+	def load_bytes(self, data):
+		self.data = data
+
+	def get_bytes(self):
+		return self.data
 
 	def getPandocOutputOptions(self):
 		params = super().getPandocOutputOptions()
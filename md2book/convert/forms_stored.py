@@ -6,11 +6,14 @@ class PdfFileCode(OutFileCode):
 
 class DocxFileCode(OutFileCode):
 	EXT = "docx"
+	PANDOC_FORMAT = "docx"
 	REF_DOC = True
 
 class OdtFileCode(OutFileCode):
 	EXT = "odt"
+	PANDOC_FORMAT = "odt"
 	REF_DOC = True
 
 class EpubFileCode(OutFileCode):
-	EXT = "epub"
\ No newline at end of file
+	EXT = "epub"
+	PANDOC_FORMAT = "epub"
\ No newline at end of file
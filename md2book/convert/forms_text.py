@@ -1,33 +1,33 @@
 import re
 from pathlib import Path
-from urllib.request import urlopen
 
 from .forms import PureCodeData
 from md2book.util.exceptions import ParsingError
-from md2book.util.common import get_file_local_path
+from md2book.util.common import get_file_local_path, load_text_file
+from md2book.util.style import InlineStylesheet
 from md2book.config import *
-from md2book.formats.mddocx import purify_for_docx
-from md2book.formats.mdtxt import purify_for_txt
+from md2book.formats.mdtxt import add_purify_txt_handlers
 
 class MarkdownCode(PureCodeData):
 	EXT = "md"
+	PANDOC_FORMAT = "markdown"
 	
 	def __init__(self, code=""):
 		self.code = code
 		self.meta_code = ""
 
 	def set_conf(self, target):
-		self.fill_template(target)
 		if target.mods['metadata']:
 			self.meta_code = target.mods['metadata'].get_yaml_intro()
 		super().set_conf(target)
 
-	def clear_for(self, target_format):
+	def clear_for(self, target_format, rewriter):
 		""" Remove parts that are not needed in some documents """
 		if target_format in ['docx']:
-			self.code = purify_for_docx(self.code)
+			from md2book.formats.mddocx import add_purify_docx_handlers
+			add_purify_docx_handlers(rewriter)
 		elif target_format in ['txt']:
-			self.code = purify_for_txt(self.code)
+			add_purify_txt_handlers(rewriter)
 
 	def get(self):
 		return self.meta_code + self.code
@@ -37,13 +37,17 @@ class MarkdownCode(PureCodeData):
 
 class TxtCode(PureCodeData):
 	EXT = "txt"
+	PANDOC_FORMAT = "markdown" # Written by pandoc for the .txt files
 
 class HtmlCode(PureCodeData):
 	EXT = "html"
+	PANDOC_FORMAT = "html"
 	def __init__(self, code, title, headers=None):
 		self.code = code
 		self.title = title
 		self.headers = headers or []
+		self.first_part = True # False for the parts of a book converted separately, except the first one
+		self.tree = None # Element containing the parsed code, while the modules alter it with alter_dom
 
 	def set_conf(self, target):
 		super().set_conf(target)
@@ -65,13 +69,15 @@ class HtmlCode(PureCodeData):
 		self.headers.append(self.getHtmlTag(tag, content, **keys_vals))
 
 	def addStyle(self, path, base_path=""):
+		if isinstance(path, InlineStylesheet):
+			self.addHeader('style', path.content)
+			return
 		base_path = Path(base_path or self.target.path.parent)
 		real_path = get_file_local_path(path, base_path=base_path)
 		
 		if real_path is None:
 			raise ParsingError('Can\'t find the stylesheet {}'.format(str(path)))
-		with open(real_path) as f:
-			self.addHeader('style', f.read())
+		self.addHeader('style', load_text_file(real_path))
 
 	def addScript(self, path, base_path=""):
 		base_path = Path(base_path or self.target.path.parent)
@@ -79,12 +85,10 @@ class HtmlCode(PureCodeData):
 
 		if real_path is None:
 			raise ParsingError('Can\'t find the script {}'.format(str(path)))
-		with open(real_path) as f:
-			self.addHeader('script', f.read())
+		self.addHeader('script', load_text_file(real_path))
 
 	def get(self):
-		with open(HTML_TEMPLATE) as f:
-			html_struct = f.read()
+		html_struct = load_text_file(HTML_TEMPLATE)
 		code = html_struct.format(
 			headers="\n".join(self.headers),
 			title=self.title,
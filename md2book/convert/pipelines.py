@@ -1,31 +1,121 @@
-import pdfkit, markdown, subprocess
+import os, re, json
 from copy import deepcopy
 
 from md2book.config import *
-from md2book.util.exceptions import ParsingError
-from md2book.formats.mddocx import post_process_docx
-from md2book.formats.mdtxt import post_process_txt
-from md2book.formats.mdebook import preparse_ebook_markdown
+from md2book.util.dependencies import check_module, require_command
+from md2book.util.svg import insert_svg_symbols
+from md2book.util.fetch import localize_html_images
+from md2book.formats.mdtxt import post_process_txt, add_purify_txt_ast_handlers
+from md2book.formats.mdebook import add_ebook_handlers, add_ebook_ast_handlers
+from md2book.formats.mdrewrite import MarkdownRewriter
+from md2book.formats.pandocpipe import run_pandoc
+from md2book.formats.pandocast import parse_markdown, write_ast, uses_pandoc_ast, add_ast_handlers, AstRewriter, \
+	add_raw_html_handler, add_paragraph_handler, add_mark_handler, element, attr, text_inlines
+from md2book.formats.mdtext import MarkdownChapters, set_heading_ids, RE_HTML_HEADING, TOC_PLACEHOLDER
+from md2book.templates import TemplateFiller
 from .forms_text import *
 from .forms_stored import *
+from .stages import StageCache
+
+# -------------------- MARKDOWN TO HTML -------------------- #
+
+def get_processes_count(parallel):
+	if parallel is True:
+		return os.cpu_count() or 1
+	return int(parallel or 1)
+
+MARKDOWN_CONVERTERS = {} # Markdown instances, reused by all the conversions of the process
+
+def get_markdown_converter(extensions_conf):
+	import markdown
+	key = json.dumps(extensions_conf, sort_keys=True)
+	if key not in MARKDOWN_CONVERTERS:
+		MARKDOWN_CONVERTERS[key] = markdown.Markdown(
+			extensions=get_markdown_default_extensions(),
+			extension_configs=extensions_conf)
+	return MARKDOWN_CONVERTERS[key].reset()
+
+def md2html_part(md_code, target, extensions_conf, first_part=True, heading_ids=None):
+	""" Convert markdown to html, and apply the modules. Executed in other processes for the parts of a book """
+	html = get_markdown_converter(extensions_conf).convert(md_code)
+	if heading_ids is not None:
+		html = set_heading_ids(html, heading_ids)
+		if html is None:
+			return None
+
+	html_code = HtmlCode(html, target['title'])
+	html_code.first_part = first_part
+	if target['build']['html-tree']:
+		from md2book.formats.htmltree import parse_html, serialize_html
+		html_code.tree = parse_html(html_code.code)
+		for mod in target.modules:
+			mod.alter_dom(html_code)
+		html_code.code = serialize_html(html_code.tree)
+		html_code.tree = None
+	else:
+		for mod in target.modules:
+			mod.alter_html(html_code)
+	return html_code.code
 
 # -------------------- META-PIPELINES -------------------- #
 
 class ConvertPipeline:
 	BASE_LANG = MarkdownCode
-	def __init__(self, code):
+	DEST_FORMAT = MarkdownCode
+	# Dependencies are checked, and imported, only for the pipeline of the target
+	REQUIRED_MODULES = {} # Package name -> python module
+	REQUIRED_COMMANDS = []
+
+	def __init__(self, code, stages=None):
 		self.code = code
+		self.stages = stages or StageCache()
+		self.commands = {} # Command name -> path of the executable
+
+	def check_dependencies(self):
+		for name, module in self.REQUIRED_MODULES.items():
+			check_module(name, module)
+		for name in self.REQUIRED_COMMANDS:
+			self.commands[name] = require_command(name)
+
+	def run_stage(self, stage, target, compute):
+		""" Execute compute(target), that alters the code, or reuse the result from another target """
+		def run():
+			compute(target)
+			return self.code.code
+		self.code.code = self.stages.run(stage, self.code.code, target, run)
+
+	def fill_template(self, target):
+		self.code.code = TemplateFiller(target).fill(self.code.code)
+
+	def rewrite_md(self, rewriter):
+		pass
 
 	def alter_code(self, target):
-		self.code.clear_for(target.format)
+		# The handlers of the formats and the modules are applied in one scan of the code
+		# With build.pandoc-ast, the markdown is shared by the formats, that are changed on the AST
+		rewriter = MarkdownRewriter()
+		ast_mode = uses_pandoc_ast(target)
+		if ast_mode:
+			add_ast_handlers(rewriter)
+		else:
+			self.code.clear_for(target.format, rewriter)
+		for mod in target.modules:
+			mod.rewrite_md(rewriter)
+		if not ast_mode:
+			self.rewrite_md(rewriter)
+		self.code.code = rewriter.rewrite(self.code.code)
+
 		for mod in target.modules:
 			mod.alter_md(self.code)
 
 	def execute(self, target):
+		self.check_dependencies()
 		if self.BASE_LANG:
 			self.code.assertLang(self.BASE_LANG)
+		if isinstance(self.code, MarkdownCode):
+			self.run_stage('fill', target, self.fill_template)
 		self.code.set_conf(target)
-		self.alter_code(target)
+		self.run_stage('markdown', target, self.alter_code)
 
 		self.prepare_config(target)
 		self.convert_steps(target)
@@ -46,27 +136,70 @@ class PipeMd(ConvertPipeline):
 	pass
 
 class PipeMd2Html(ConvertPipeline):
+	DEST_FORMAT = HtmlCode
+	REQUIRED_MODULES = {'markdown' : 'markdown'}
+
 	def prepare_config(self, target):
+		if target['build']['html-tree']:
+			check_module('lxml', 'lxml')
 		self.md_extensions_conf = deepcopy(MD_CONFIG)
-		self.md_extensions = get_markdown_default_extensions()
 		self.md_extensions_conf['toc']['toc_depth'] = target['toc']['level']
 
+	def convert_md2html(self, md_code, target):
+		html = None
+		processes = get_processes_count(target['build']['parallel'])
+		if processes > 1:
+			html = self.convert_md2html_parallel(md_code, target, processes)
+		if html is None:
+			html = md2html_part(md_code, target, self.md_extensions_conf)
+		if target['build']['svg-symbols']: # Once for all the parts
+			html = insert_svg_symbols(html)
+		return html
+
+	def convert_md2html_parallel(self, md_code, target, processes):
+		""" Convert the chapters in parallel, or return None if the book can't be split """
+		chapters = MarkdownChapters(md_code, target['chapter-level'])
+		if len(chapters.parts) < 2 or chapters.footnotes:
+			return None
+
+		# The ids and the table of contents must be the same as for the whole book
+		headings_md = get_markdown_converter(self.md_extensions_conf)
+		ids = re.findall(RE_HTML_HEADING, headings_md.convert(chapters.get_headings_code()))
+		toc = headings_md.toc.strip()
+		if len(ids) != sum(len(headings) for headings in chapters.headings):
+			return None
+
+		from concurrent.futures import ProcessPoolExecutor
+		parts_ids = chapters.split_heading_ids(ids)
+		with ProcessPoolExecutor(max_workers=min(processes, len(chapters.parts))) as executor:
+			parts = [executor.submit(md2html_part, chapters.get_part_code(i), target,
+					self.md_extensions_conf, i == 0, parts_ids[i])
+				for i in range(len(chapters.parts))]
+			parts = [part.result() for part in parts]
+		if None in parts:
+			return None
+
+		html = '\n'.join(parts)
+		html = html.replace('<p>{}</p>'.format(TOC_PLACEHOLDER), toc)
+		return html.replace(TOC_PLACEHOLDER, '[TOC]')
+
 	def md2html(self, target):
-		# First we transform the markdown into html
-		html = markdown.markdown(self.code.get_base_code_only(),
-			extensions=self.md_extensions,
-			extension_configs=self.md_extensions_conf)
+		md_code = self.code.get_base_code_only()
+		html = self.stages.run('html', md_code, target, lambda: self.convert_md2html(md_code, target))
 
 		self.code = HtmlCode(html, target['title'])
-
-		for mod in target.modules:
-			mod.alter_html(self.code)
 		self.code.set_conf(target)
+		for mod in target.modules:
+			mod.alter_document(self.code)
 
 	def convert_steps(self, target):
 		self.md2html(target)
 
 class PipeMd2Html2Pdf(PipeMd2Html):
+	DEST_FORMAT = PdfFileCode
+	REQUIRED_MODULES = {'markdown' : 'markdown', 'pdfkit' : 'pdfkit'}
+	REQUIRED_COMMANDS = ['wkhtmltopdf']
+
 	def prepare_config(self, target):
 		super().prepare_config(target)
 
@@ -74,14 +207,18 @@ class PipeMd2Html2Pdf(PipeMd2Html):
 		self.pdfkit_options['title'] = target['title']
 
 	def html2pdf(self, target):
+		import pdfkit
 		self.code.assertLang(HtmlCode)
+		self.code.code = localize_html_images(self.code.code) # Instead of a download by wkhtmltopdf
 		pdf_code = PdfFileCode()
 
-		pdfkit.from_string(
+		# Without an output path, wkhtmltopdf writes the document to its standard output
+		pdf_code.load_bytes(pdfkit.from_string(
 			self.code.get(),
-			pdf_code.getStrPath(),
-			options=self.pdfkit_options
-		)
+			False,
+			options=self.pdfkit_options,
+			configuration=pdfkit.configuration(wkhtmltopdf=self.commands['wkhtmltopdf'])
+		))
 		self.code = pdf_code
 
 	def convert_steps(self, target):
@@ -92,20 +229,47 @@ class PipeMd2Html2Pdf(PipeMd2Html):
 
 class PandocPipeline(ConvertPipeline):
 	DEST_FORMAT = MarkdownCode
+	REQUIRED_COMMANDS = ['pandoc']
 
-	def pandoc(self, dest, *add_params):
-		origin_out = self.code.output()
-		dest_out = dest.output()
-		add_params = dest.getPandocOutputOptions() + list(add_params)
+	def rewrite_ast(self, rewriter, target):
+		""" Changes of the format, made on the markdown by the other targets """
+		pass
 
-		r = subprocess.run(['pandoc', origin_out, '-o', dest_out] + add_params)
-		if r.returncode:
-			raise ParsingError("Error while converting with pandoc : {}".format(r.stderr))
+	def add_html_separators_handlers(self, rewriter, target):
+		""" The blocks of the separators and page breaks that the templates insert in html """
+		sep = target['sep']
+		if target.format == 'epub' and ('*' in sep or '_' in sep):
+			content = element('Span', [attr('sepcontent'), []])
+		else:
+			content = element('Span', [attr(), text_inlines(sep)])
+		add_paragraph_handler(rewriter, '[[SEP-ITEM]]', lambda: [element('Div', [attr('sep'), [element('Plain', [content])]])])
+		add_paragraph_handler(rewriter, '[[SKIP-ITEM]]', lambda: [element('Div', [attr('pageBreak'), []])])
+
+	def pandoc_from_ast(self, dest, target, add_params):
+		""" Write the markdown parsed once for all the formats, after the changes of the modules and of the format """
+		ast = parse_markdown(self.commands['pandoc'], self.code.get())
+		# The handlers of the modules and of the format are applied in one walk of the AST
+		rewriter = AstRewriter()
+		for mod in target.modules:
+			mod.rewrite_ast(rewriter, self.code)
+		self.rewrite_ast(rewriter, target)
+		rewriter.rewrite(ast)
+		options = dest.getPandocOutputOptions() + list(add_params) # After the hooks, that can change them
+		return write_ast(self.commands['pandoc'], ast, dest.PANDOC_FORMAT, options)
 
-		dest.load_from(dest_out)
+	def pandoc(self, dest, *add_params):
+		if uses_pandoc_ast(dest.target) and isinstance(self.code, MarkdownCode):
+			data = self.pandoc_from_ast(dest, dest.target, add_params)
+		else:
+			options = dest.getPandocOutputOptions() + list(add_params)
+			args = ['-f', self.code.PANDOC_FORMAT, '-t', dest.PANDOC_FORMAT, '-o', '-'] + options
+			data = run_pandoc(self.commands['pandoc'], args, self.code.get_bytes())
+		dest.load_bytes(data)
 		self.code = dest
 
 	def convert_steps(self, target):
+		for mod in target.modules:
+			mod.alter_document(self.code)
 		dest = self.DEST_FORMAT()
 		dest.set_conf(target)
 		self.pandoc(dest)
@@ -116,37 +280,66 @@ class PipeAny2txtPandoc(PandocPipeline):
 
 class PipeMd2DocxPandoc(PandocPipeline):
 	DEST_FORMAT = DocxFileCode
+	REQUIRED_MODULES = {'python-docx' : 'docx'}
+
+	def rewrite_ast(self, rewriter, target):
+		from md2book.formats.mddocx import add_purify_docx_ast_handlers
+		add_purify_docx_ast_handlers(rewriter)
 
 	def convert_steps(self, target):
+		from md2book.formats.mddocx import post_process_docx
 		super().convert_steps(target)
 		post_process_docx(self.code, target)
 
 class PipeMd2OdtPandoc(PandocPipeline):
 	DEST_FORMAT = OdtFileCode
 
+	def rewrite_ast(self, rewriter, target):
+		# The marks are not converted in the odt files
+		add_mark_handler(rewriter, [element('Str', '==')], [element('Str', '==')])
+		self.add_html_separators_handlers(rewriter, target)
+
 class PipeMd2EpubPandoc(PandocPipeline):
 	DEST_FORMAT = EpubFileCode
+	REQUIRED_MODULES = {'markdown' : 'markdown'} # For the table of contents
+
+	def rewrite_md(self, rewriter):
+		add_ebook_handlers(rewriter)
 
 	def alter_code(self, target):
 		super().alter_code(target)
-		# For markdown not supported by pandoc
-		self.code.code = preparse_ebook_markdown(self.code.code)
-
 		# The markdown can contains some HTML that needs to be altered
+		if not uses_pandoc_ast(target): # Otherwise the raw html of the AST is altered
+			for mod in target.modules:
+				mod.alter_html(self.code)
+
+	def alter_html_code(self, code, target):
+		html_code = HtmlCode(code, target['title'])
 		for mod in target.modules:
-			mod.alter_html(self.code)
+			mod.alter_html(html_code)
+		return html_code.code
+
+	def rewrite_ast(self, rewriter, target):
+		add_raw_html_handler(rewriter, lambda code: self.alter_html_code(code, target)) # Before the html inserted
+		add_ebook_ast_handlers(rewriter)
+		self.add_html_separators_handlers(rewriter, target)
 
 class PipeMd2txtPandoc(PandocPipeline):
 	DEST_FORMAT = TxtCode
 
+	def rewrite_ast(self, rewriter, target):
+		add_purify_txt_ast_handlers(rewriter)
+
 	def convert_steps(self, target):
 		super().convert_steps(target)
 		self.code.code = post_process_txt(self.code.code, target)
 
 class PipeMd2htmlPandoc(PandocPipeline):
 	DEST_FORMAT = HtmlCode
+	REQUIRED_MODULES = {'markdown' : 'markdown'}
 
 	def md2html(self, target):
+		import markdown
 		# First we transform the markdown into html
 		html = markdown.markdown(self.code.get_base_code_only(),
 			extensions=self.md_extensions,
@@ -0,0 +1,81 @@
+import hashlib, json, re
+from collections import OrderedDict
+from copy import deepcopy
+
+from md2book.config import *
+from md2book.util.common import merge_dicts_recur, track_dependency, tracking_dependencies, tracking_incomplete
+from md2book.util.manifest import get_file_state
+from md2book.formats.pandocast import uses_pandoc_ast
+
+# Templates that read the format (or include a file that may) can't be shared between formats
+RE_FORMAT_DEPENDANT = r'\{%[^%]*?(format|include)'
+
+class StageCache:
+	"""
+		Results of the intermediate conversion stages (template filling, markdown
+		alterations, conversion to html...), keyed by a hash of the stage input and
+		of the target configuration. Targets for which a stage gives the same result
+		(html and pdf for instance) compute it only once.
+
+		A stage may change the target configuration (fonts added by the templates...):
+		the configuration obtained after the stage is stored and restored on reuse.
+		The files read by a stage (included templates, svg images, aliases...) are recorded
+		with their state: a result is reused only if none of them changed, and its files are
+		then tracked again as dependencies of the current build. The incomplete results (missing
+		equations or remote files) are not kept.
+	"""
+	def __init__(self, max_size=32):
+		self.results = OrderedDict()
+		self.max_size = max_size
+
+	def get_format_group(self, stage, text, target):
+		if re.search(RE_FORMAT_DEPENDANT, text):
+			return target.format + '/' + str(target.conf['format'])
+		if stage in ['fill', 'markdown'] and uses_pandoc_ast(target): # The formats are changed on the AST
+			return 'pandoc-ast'
+		return STAGE_FORMAT_GROUPS.get(stage, {}).get(target.format, target.format)
+
+	def get_conf(self, target):
+		return {key : val for key, val in target.conf.items() if key != 'format'}
+
+	def get_key(self, stage, text, target):
+		conf = json.dumps(self.get_conf(target), sort_keys=True, default=str)
+		group = self.get_format_group(stage, text, target)
+
+		h = hashlib.sha1()
+		for part in [stage, group, conf, text]:
+			h.update(part.encode('utf-8'))
+			h.update(b'\0')
+		return h.hexdigest()
+
+	def clear(self):
+		self.results.clear()
+
+	def is_valid(self, files):
+		return all(get_file_state(path) == state for path, state in files.items())
+
+	def run(self, stage, text, target, compute):
+		"""
+			Return the result of compute() for this stage, or the result
+			of a previous execution with the same input and unchanged files
+		"""
+		key = self.get_key(stage, text, target)
+		if key in self.results:
+			result, conf, files = self.results[key]
+			if self.is_valid(files):
+				self.results.move_to_end(key)
+				merge_dicts_recur(target.conf, conf)
+				for path in files:
+					track_dependency(path)
+				return result
+			del self.results[key]
+
+		with tracking_dependencies() as dependencies, tracking_incomplete() as incomplete:
+			result = compute()
+		if incomplete: # Computed again by the next build
+			return result
+		files = {path : get_file_state(path) for path in dependencies}
+		self.results[key] = (result, deepcopy(self.get_conf(target)), files)
+		while len(self.results) > self.max_size:
+			self.results.popitem(last=False)
+		return result
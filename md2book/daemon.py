@@ -0,0 +1,142 @@
+"""
+	"md2book serve" keeps a process running, with the python modules imported and the settings,
+	themes, fonts and Markdown instances loaded. "md2book --daemon ..." sends the command to this
+	process through a Unix socket, and prints its output.
+	This module is imported by the client, and must stay fast to import.
+"""
+import socket, socketserver, json, os, sys, io, importlib
+from contextlib import redirect_stdout, redirect_stderr
+
+from md2book.config import DAEMON_SOCKET
+
+# Imported by the formats only when needed, but loaded once by the daemon
+PRELOADED_MODULES = ['markdown', 'pdfkit', 'docx', 'md2book.formats.mdhtml', 'md2book.formats.mddocx']
+STATUS_MARKER = '\0md2book-status:' # Followed by the exit status of the command, at the end of the output
+
+# -------------------- CLIENT -------------------- #
+
+def connect(socket_path=DAEMON_SOCKET):
+	""" Socket connected to the daemon, or None if it is not running """
+	if not hasattr(socket, 'AF_UNIX'):
+		return None
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		client.connect(str(socket_path))
+	except OSError:
+		client.close()
+		return None
+	return client
+
+def send_to_daemon(argv, socket_path=DAEMON_SOCKET):
+	"""
+		Execute the command in the daemon, with the environment and the directory of the client,
+		and print its output. Return the exit status of the command, or None if the daemon is not running
+	"""
+	client = connect(socket_path)
+	if client is None:
+		return None
+
+	status = 1 # If the daemon stops before the end of the command
+	with client:
+		request = {'argv' : list(argv), 'cwd' : os.getcwd(), 'env' : dict(os.environ)}
+		client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+		with client.makefile('r', encoding='utf-8', errors='replace') as output:
+			for line in output:
+				if STATUS_MARKER in line:
+					line, _, value = line.partition(STATUS_MARKER)
+					status = int(value.strip() or 1)
+				sys.stdout.write(line)
+				sys.stdout.flush()
+	return status
+
+# -------------------- SERVER -------------------- #
+
+class ClientOutput(io.TextIOBase):
+	""" Text stream sending everything written to the client """
+	def __init__(self, wfile):
+		self.wfile = wfile
+		self.connected = True
+
+	def writable(self):
+		return True
+
+	def write(self, text):
+		if self.connected:
+			try:
+				self.wfile.write(text.encode('utf-8'))
+				self.wfile.flush()
+			except OSError: # The client is gone, but the build continues
+				self.connected = False
+		return len(text)
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		from md2book.start import report_errors
+		from md2book.main import main, get_cmd_args, BUILD_STAGES
+		from md2book.util.exceptions import SimpleWarning
+
+		try:
+			request = json.loads(self.rfile.readline().decode('utf-8'))
+			argv, cwd, env = list(request['argv']), request['cwd'], dict(request['env'])
+		except (ValueError, KeyError, TypeError):
+			return
+
+		output = ClientOutput(self.wfile)
+		previous_cwd, previous_env = os.getcwd(), dict(os.environ)
+		status = 1
+		with redirect_stdout(output), redirect_stderr(output):
+			try:
+				os.chdir(cwd)
+				os.environ.clear()
+				os.environ.update(env)
+				BUILD_STAGES.clear() # The files may have changed since the previous command
+				if get_cmd_args(argv).watch:
+					SimpleWarning("The watch mode can't be used with --daemon").show()
+				else:
+					status = 0 if report_errors(main, argv) else 1
+			except SystemExit as e: # Invalid arguments, or --help
+				status = e.code if isinstance(e.code, int) else int(e.code is not None)
+			except OSError as e:
+				print(e)
+			finally:
+				os.chdir(previous_cwd)
+				os.environ.clear()
+				os.environ.update(previous_env)
+		output.write('{}{}\n'.format(STATUS_MARKER, status))
+
+def serve(socket_path=DAEMON_SOCKET):
+	""" Execute the commands sent by the clients, one at a time, until interrupted """
+	from md2book.start import check_dependencies
+	from md2book.util.exceptions import DaemonError
+
+	if not hasattr(socket, 'AF_UNIX'):
+		raise DaemonError("The daemon requires Unix sockets, which are not available on this system")
+	check_dependencies()
+
+	# Load everything once, before the first build
+	from md2book.util.settings import load_settings
+	load_settings()
+	for module in PRELOADED_MODULES:
+		try:
+			importlib.import_module(module)
+		except ImportError: # Checked when a format needs it
+			pass
+
+	socket_path = str(socket_path)
+	client = connect(socket_path)
+	if client is not None:
+		client.close()
+		raise DaemonError("A daemon is already running on {}".format(socket_path))
+	if os.path.exists(socket_path): # Left by a daemon that was killed
+		os.unlink(socket_path)
+
+	server = socketserver.UnixStreamServer(socket_path, BuildRequestHandler)
+	os.chmod(socket_path, 0o600)
+	print('md2book daemon listening on {} (Ctrl+C to stop)'.format(socket_path))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.unlink(socket_path)
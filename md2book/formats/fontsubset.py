@@ -0,0 +1,95 @@
+"""
+	Fonts reduced to the characters used by a book, with fontTools, and compressed to WOFF2 for the
+	formats that support it. The subsets are stored in a cache shared by all the builds of the user,
+	named by the hash of the font, of the characters and of the format.
+"""
+import io, os, re, html, string, hashlib, importlib.util
+from pathlib import Path
+
+from md2book.config import *
+from md2book.util.cache import FileCache
+from md2book.util.common import track_dependency
+from md2book.util.exceptions import SimpleWarning
+
+FONT_HASHES = {} # Path -> (modification time, size, hash of the content)
+RE_HTML_TAG = r'<[^>]*>'
+BASE_CHARACTERS = string.printable # Always kept, for the text added by the stylesheets
+
+def hash_font(path):
+	stat = os.stat(path)
+	state = (stat.st_mtime_ns, stat.st_size)
+	if FONT_HASHES.get(path, (None,))[:2] != state:
+		with open(path, 'rb') as f:
+			FONT_HASHES[path] = state + (hashlib.sha1(f.read()).hexdigest(),)
+	return FONT_HASHES[path][2]
+
+def has_woff2_support():
+	""" fontTools needs brotli to write WOFF2 fonts """
+	return importlib.util.find_spec('brotli') is not None
+
+def get_html_text(code):
+	""" Characters displayed by the html code, and a few more """
+	return html.unescape(re.sub(RE_HTML_TAG, '', code))
+
+def get_markdown_text(code):
+	return html.unescape(code)
+
+def get_characters(text):
+	return ''.join(sorted(set(text) | set(BASE_CHARACTERS)))
+
+class FontSubsetter:
+	def __init__(self, characters, flavor=None):
+		self.characters = characters
+		self.flavor = flavor # 'woff2', or None to keep the format of the font
+		self.cache = FileCache(FONTS_CACHE_PATH, FONTS_CACHE_SIZE)
+
+	def get_name(self, path):
+		h = hashlib.sha1(hash_font(path).encode('utf-8'))
+		h.update(str(self.flavor).encode('utf-8'))
+		h.update(self.characters.encode('utf-8'))
+		return h.hexdigest() + ('.' + self.flavor if self.flavor else Path(path).suffix)
+
+	def create_subset(self, path):
+		from fontTools import subset
+		options = subset.Options()
+		options.flavor = self.flavor
+		font = subset.load_font(str(path), options)
+		subsetter = subset.Subsetter(options)
+		subsetter.populate(unicodes=[ord(c) for c in self.characters])
+		subsetter.subset(font)
+		output = io.BytesIO()
+		subset.save_font(font, output, options)
+		return output.getvalue()
+
+	def subset(self, path):
+		""" Path of the subset of the font, or of the font itself if it can't be reduced """
+		path = str(path)
+		try:
+			name = self.get_name(path)
+			cached = self.cache.get(name)
+			if cached is None:
+				cached = self.cache.put(name, self.create_subset(path))
+			return cached
+		except Exception as e:
+			SimpleWarning('Can\'t reduce the font {} : {}'.format(path, str(e) or type(e).__name__)).show()
+			return Path(path)
+
+	def copy_subset(self, subset, output_dir):
+		""" Copy of the subset in output_dir, the files of the cache can be evicted by the next builds """
+		dest = output_dir / subset.name
+		if not dest.is_file():
+			output_dir.mkdir(parents=True, exist_ok=True)
+			self.cache.copy_to(subset.name, dest)
+		track_dependency(dest) # Part of the output: the build is done again if the font is removed
+		return dest
+
+	def subset_all(self, paths, output_dir=None):
+		""" Dict path -> path of the subset, copied to output_dir if given """
+		subsets = {path : self.subset(path) for path in paths}
+		if output_dir is not None:
+			output_dir = Path(output_dir).resolve()
+			for path, subset in subsets.items():
+				if subset != Path(path):
+					subsets[path] = self.copy_subset(subset, output_dir)
+		self.cache.evict()
+		return subsets
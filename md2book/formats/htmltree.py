@@ -0,0 +1,80 @@
+"""
+	Tree of the html code of a book, parsed once with lxml, altered by the alter_dom hooks
+	of all the modules, and serialized once.
+	This module is imported only when the option build.html-tree is enabled.
+"""
+import re
+
+from lxml import etree, html as lxml_html
+
+# The html parser lowercases the names, which the browsers restore in the inline svg images
+SVG_NAMES = ' '.join([
+	'attributeName attributeType baseFrequency baseProfile calcMode clipPathUnits diffuseConstant edgeMode',
+	'filterUnits glyphRef gradientTransform gradientUnits kernelMatrix kernelUnitLength keyPoints keySplines',
+	'keyTimes lengthAdjust limitingConeAngle markerHeight markerUnits markerWidth maskContentUnits maskUnits',
+	'numOctaves pathLength patternContentUnits patternTransform patternUnits pointsAtX pointsAtY pointsAtZ',
+	'preserveAlpha preserveAspectRatio primitiveUnits refX refY repeatCount repeatDur requiredExtensions',
+	'requiredFeatures specularConstant specularExponent spreadMethod startOffset stdDeviation stitchTiles',
+	'surfaceScale systemLanguage tableValues targetX targetY textLength viewBox viewTarget xChannelSelector',
+	'yChannelSelector zoomAndPan altGlyph altGlyphDef altGlyphItem animateColor animateMotion animateTransform',
+	'clipPath feBlend feColorMatrix feComponentTransfer feComposite feConvolveMatrix feDiffuseLighting',
+	'feDisplacementMap feDistantLight feDropShadow feFlood feFuncA feFuncB feFuncG feFuncR feGaussianBlur',
+	'feImage feMerge feMergeNode feMorphology feOffset fePointLight feSpecularLighting feSpotLight feTile',
+	'feTurbulence foreignObject linearGradient radialGradient textPath',
+]).split()
+SVG_CASE = {name.lower() : name for name in SVG_NAMES}
+
+PARENT_TAG = 'div'
+# The code is serialized like the markdown converter writes it : void elements closed as in xhtml, and the
+# entities (e-mails obfuscated...) kept, by hiding them from the parser
+VOID_TAGS = 'area|base|br|col|embed|hr|img|input|link|meta|param|source|track|wbr'
+RE_VOID_TAG = r'<({})((?:\s+[^\s"\'>/=]+(?:="[^"]*"|=\'[^\']*\'|=[^\s"\'>]+)?)*)\s*/?>'.format(VOID_TAGS)
+RE_ENTITY = r'&(#?[a-zA-Z0-9]+;)'
+ENTITY_MARK = '_md2book_amp_' # Instead of '&', in ascii not to be escaped in the urls
+
+def fix_svg_case(root):
+	for svg in root.iter('svg'):
+		for element in svg.iter(etree.Element):
+			if element.tag in SVG_CASE:
+				element.tag = SVG_CASE[element.tag]
+			if any(name in SVG_CASE for name in element.attrib): # Rebuilt to keep the order
+				attributes = list(element.attrib.items())
+				element.attrib.clear()
+				for name, value in attributes:
+					element.set(SVG_CASE.get(name, name), value)
+
+def parse_html(code):
+	""" Element containing the html code, parsed as the body of a page """
+	code = re.sub(RE_ENTITY, ENTITY_MARK + r'\1', code)
+	document = lxml_html.document_fromstring('<{0}>{1}</{0}>'.format(PARENT_TAG, code))
+	root = document.body[0]
+	fix_svg_case(root)
+	return root
+
+def serialize_html(root):
+	""" Html code of the content of the root element """
+	code = etree.tostring(root, method='html', encoding='unicode', with_tail=False)
+	code = code[len(PARENT_TAG) + 2:-len(PARENT_TAG) - 3]
+	return re.sub(RE_VOID_TAG, r'<\1\2 />', code).replace(ENTITY_MARK, '&')
+
+def insert_html_start(root, code):
+	""" Insert the html code at the start of the content of root """
+	fragment = parse_html(code)
+	children = list(fragment)
+	if children:
+		children[-1].tail = (children[-1].tail or '') + (root.text or '')
+		root.text = fragment.text
+	else:
+		root.text = (fragment.text or '') + (root.text or '')
+	for i, child in enumerate(children):
+		root.insert(i, child)
+
+def parse_svg(code):
+	""" Root element of a svg image, parsed as xml to keep the case of the names """
+	parser = etree.XMLParser(resolve_entities=False, no_network=True)
+	return etree.fromstring(code.encode('utf-8'), parser)
+
+def replace_element(element, new_element):
+	""" Replace element, keeping the text after it """
+	new_element.tail = element.tail
+	element.getparent().replace(element, new_element)
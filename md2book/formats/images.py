@@ -0,0 +1,140 @@
+"""
+	Images of a book resized and compressed for a target, with Pillow. The results are stored in a cache
+	shared by all the builds of the user, named by the hash of the image and of the options: an image
+	is processed only once, until it or the options change.
+"""
+import io, os, json, hashlib
+from pathlib import Path
+
+from md2book.config import *
+from md2book.util.cache import FileCache
+from md2book.util.common import track_dependency
+from md2book.util.dependencies import import_module
+from md2book.util.exceptions import ConfigError, SimpleWarning
+
+IMAGE_OPTIONS = ['max-width', 'dpi', 'quality', 'format']
+IMAGE_FORMATS = {'jpeg' : 'jpg', 'png' : 'png', 'webp' : 'webp'} # Pillow format -> extension
+OPTIMIZED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'] # Not the svg and (animated) gif
+IMAGE_HASHES = {} # Path -> (modification time, size, hash of the content)
+
+def hash_image(path):
+	stat = os.stat(path)
+	state = (stat.st_mtime_ns, stat.st_size)
+	if IMAGE_HASHES.get(path, (None,))[:2] != state:
+		h = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				h.update(block)
+		IMAGE_HASHES[path] = state + (h.hexdigest(),)
+	return IMAGE_HASHES[path][2]
+
+class ImageOptimizer:
+	"""
+		The paths of the optimized images are known as soon as the images are found in the code,
+		and the images that are not in the cache are processed in parallel, at the end of the scan.
+		They are copied from the cache to output_dir, next to the output of the build.
+	"""
+	def __init__(self, conf, output_dir):
+		self.options = {key : conf[key] for key in IMAGE_OPTIONS}
+		if self.options['format'] is not None:
+			self.options['format'] = str(self.options['format']).lower().replace('jpg', 'jpeg')
+			if self.options['format'] not in IMAGE_FORMATS:
+				raise ConfigError("The images format should be one of: {}".format(', '.join(IMAGE_FORMATS)))
+		for key in ['max-width', 'dpi', 'quality']:
+			if self.options[key] is not None:
+				try:
+					self.options[key] = int(self.options[key])
+				except ValueError:
+					raise ConfigError("The images option {} should be a number".format(key))
+
+		import_module('Pillow', 'PIL.Image') # Not kept, the target is sent to the processes of the parallel builds
+		self.cache = FileCache(IMAGES_CACHE_PATH, IMAGES_CACHE_SIZE)
+		self.options_key = json.dumps(self.options, sort_keys=True).encode('utf-8')
+		self.output_dir = Path(output_dir).resolve()
+		self.pending = {} # Name in the cache -> path of the image
+		self.renamed = {} # Path returned by get_path -> path of the original image copied instead
+
+	def get_path(self, path):
+		""" Path of the optimized image, created by process_pending, or the path itself if it is not optimized """
+		ext = Path(path).suffix.lower()
+		if ext not in OPTIMIZED_EXTENSIONS or not os.path.isfile(path):
+			return path
+		try:
+			h = hashlib.sha1(self.options_key)
+			h.update(hash_image(path).encode('utf-8'))
+		except OSError:
+			return path
+		if self.options['format']:
+			ext = '.' + IMAGE_FORMATS[self.options['format']]
+		name = h.hexdigest() + ext
+		self.pending[name] = path
+		return str(self.output_dir / name)
+
+	def optimize(self, path):
+		""" Content of the optimized image, or of the image itself if it can't be improved """
+		from PIL import Image, ImageOps
+		with open(path, 'rb') as f:
+			original = f.read()
+		with Image.open(io.BytesIO(original)) as image:
+			image_format = self.options['format'] or image.format.lower()
+			changed = image_format != image.format.lower()
+			image = ImageOps.exif_transpose(image)
+
+			width = self.options['max-width']
+			if width and image.width > width:
+				image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+				changed = True
+
+			if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+				image = image.convert('RGBA')
+				background = Image.new('RGB', image.size, 'white')
+				background.paste(image, mask=image.getchannel('A'))
+				image = background
+
+			options = {'optimize' : True}
+			if self.options['quality'] and image_format in ['jpeg', 'webp']:
+				options['quality'] = self.options['quality']
+			if self.options['dpi']:
+				options['dpi'] = (self.options['dpi'], self.options['dpi'])
+				changed = True
+			elif 'dpi' in image.info:
+				options['dpi'] = image.info['dpi']
+
+			output = io.BytesIO()
+			image.save(output, image_format, **options)
+		content = output.getvalue()
+		return content if changed or len(content) < len(original) else original
+
+	def process(self, name, path):
+		# An image that can't be optimized is kept as it is, with its own extension
+		fallback = Path(name).stem + Path(path).suffix.lower()
+		if self.cache.get(name) is None and (fallback == name or self.cache.get(fallback) is None):
+			try:
+				self.cache.put(name, self.optimize(path))
+			except Exception as e:
+				SimpleWarning('Can\'t optimize the image {} : {}'.format(path, str(e) or type(e).__name__)).show()
+				with open(path, 'rb') as f:
+					self.cache.put(fallback, f.read())
+		if self.cache.get(name) is None:
+			self.renamed[str(self.output_dir / name)] = str(self.output_dir / fallback)
+			name = fallback
+		dest = self.output_dir / name
+		if not dest.is_file():
+			self.cache.copy_to(name, dest)
+		track_dependency(dest) # Part of the output: the build is done again if the image is removed
+
+	def process_pending(self):
+		""" Create the optimized images that are not in the cache, in parallel, and copy them to output_dir """
+		from concurrent.futures import ThreadPoolExecutor
+		pending, self.pending = self.pending, {}
+		if pending:
+			self.output_dir.mkdir(parents=True, exist_ok=True)
+			with ThreadPoolExecutor(max_workers=IMAGES_WORKERS) as executor:
+				list(executor.map(lambda item: self.process(*item), pending.items()))
+			self.cache.evict()
+
+	def replace_renamed(self, code):
+		""" Refer to the original images copied instead of the images that couldn't be optimized """
+		for path, fallback in self.renamed.items():
+			code = code.replace(path, fallback)
+		return code
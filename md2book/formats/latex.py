@@ -0,0 +1,238 @@
+import os, re, hashlib
+import urllib.parse
+
+from md2book.config import *
+from md2book.util.cache import FileCache
+from md2book.util.dependencies import import_module
+from md2book.util.exceptions import SimpleWarning
+from md2book.util.common import mark_incomplete, rand_str
+
+SVG_HEADER = '<?xml version="1.0" standalone="no" ?>\n\
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+
+# -------------------- ALIASES -------------------- #
+
+class AliasesReplacer:
+	"""
+		Replace the aliases of LaTeX equations, in the order they are given, as if they were applied
+		one after the other. When no alias can overlap another one in the code (one name containing
+		another, like \\R and \\R^+...), they are replaced in a single pass with one compiled regex:
+		a replacement is then expanded with the aliases after it.
+	"""
+	RE_END = r'(?=([^a-zA-Z\d]|$))' # An alias is not followed by a letter or a digit
+
+	def __init__(self, aliases):
+		aliases = [(alias_from, alias_to) for alias_from, alias_to in aliases if alias_from]
+		self.processed = {} # Equation -> equation with the aliases replaced
+		self.regex = None
+		self.sequence = [] # (regex, name, replacement), applied one after the other
+
+		if self.has_overlaps(aliases):
+			self.sequence = [(re.compile(re.escape(name) + self.RE_END), name, to) for name, to in aliases]
+		elif aliases:
+			self.replacements = {}
+			for i, (alias_from, alias_to) in enumerate(aliases):
+				self.replacements[alias_from] = self.expand(alias_to, aliases[i+1:])
+			names = sorted(self.replacements, key=len, reverse=True) # Longest match first
+			self.regex = re.compile('(' + '|'.join(re.escape(name) for name in names) + ')' + self.RE_END)
+
+	@staticmethod
+	def overlap(x, y):
+		""" True if x and y can share characters in a code: one contains the other, or the end of one starts the other """
+		if x in y or y in x:
+			return True
+		return any(x.endswith(y[:k]) or y.endswith(x[:k]) for k in range(1, min(len(x), len(y))))
+
+	def has_overlaps(self, aliases):
+		""" True if the single pass could give another result than the aliases applied in order """
+		for i, (alias_from, alias_to) in enumerate(aliases):
+			for other, _ in aliases[i+1:]:
+				if self.overlap(alias_from, other) or self.overlap(alias_to, other):
+					return True
+		return False
+
+	def expand(self, texcode, aliases):
+		for alias_from, alias_to in aliases:
+			texcode = re.sub(re.escape(alias_from) + self.RE_END, lambda m: alias_to, texcode)
+		return texcode
+
+	def replace_in_order(self, texcode):
+		for regex, name, alias_to in self.sequence:
+			if name in texcode:
+				texcode = regex.sub(lambda m: alias_to, texcode)
+		return texcode
+
+	def replace(self, texcode):
+		if self.regex is None and not self.sequence:
+			return texcode
+		if texcode not in self.processed:
+			if self.regex is None:
+				self.processed[texcode] = self.replace_in_order(texcode)
+			else:
+				self.processed[texcode] = self.regex.sub(lambda m: self.replacements[m.group(1)], texcode)
+		return self.processed[texcode]
+
+# -------------------- RENDERERS -------------------- #
+
+class LatexRenderer:
+	"""
+		Convert equations to html code inserted in the markdown.
+		render_all receives a set of (inline, texcode), and returns a dict (inline, texcode) -> code,
+		with an empty code for the equations that could not be rendered.
+	"""
+	def __init__(self, module):
+		self.module = module
+		self.conf = module.conf
+		self.status = None # 'offline' if some equations are missing
+
+	def render_all(self, equations):
+		raise NotImplementedError()
+
+class FileRenderer(LatexRenderer):
+	""" Renderers creating an svg image per equation, stored in the user cache and linked in the LaTeX directory """
+	def __init__(self, module):
+		super().__init__(module)
+		self.download_dir = module.download_dir
+		try: # Images shared by all the books
+			self.cache = FileCache(LATEX_CACHE_PATH, int(float(self.conf['cache_size']) * 1024 * 1024))
+		except OSError:
+			self.cache = None
+
+	def get_key(self, texcode, inline):
+		""" Unique string for an equation, used to name the image """
+		raise NotImplementedError()
+
+	def create_files(self, equations):
+		"""
+			Create the images of a list of (key, path, inline, texcode).
+			Return the list of keys that could not be rendered
+		"""
+		raise NotImplementedError()
+
+	def render_all(self, equations):
+		files = {}
+		to_create = []
+		for inline, texcode in equations:
+			key = self.get_key(texcode, inline)
+			filename = hashlib.md5(key.encode('utf-8')).hexdigest() + '.svg'
+			path = self.download_dir / filename
+			files[(inline, texcode)] = (key, path)
+
+			if self.cache and self.cache.get(filename) and not path.resolve().is_file():
+				self.cache.copy_to(filename, path)
+			if not path.resolve().is_file():
+				dest = self.cache.get_path(filename) if self.cache else path
+				to_create.append((key, dest, inline, texcode))
+
+		failed = set(self.create_files(to_create)) if to_create else set()
+		if failed:
+			self.status = 'offline'
+
+		codes = {}
+		for eq, (key, path) in files.items():
+			if key in failed:
+				codes[eq] = ''
+				continue
+			if not path.resolve().is_file():
+				self.cache.copy_to(path.name, path)
+			codes[eq] = self.module.get_latex_image_code(path.resolve(), inline=eq[0])
+
+		if self.cache and to_create:
+			self.cache.evict()
+		return codes
+
+class HttpRenderer(FileRenderer):
+	""" Download the equations from a server (math.vercel.app by default) """
+	def get_key(self, texcode, inline):
+		args = urllib.parse.urlencode({'color' : 'black', ('inline' if inline else 'from') : texcode})
+		return self.conf['server'].rstrip('/') + '?' + args
+
+	def create_files(self, equations):
+		import shutil
+		from md2book.util.fetch import get_fetcher # With the mirrors and the failed urls of the remote files
+		print("Download {} LaTeX images from {}...".format(len(equations), self.conf['server']))
+		found = get_fetcher().find_all([url for url, _, _, _ in equations], LATEX_DOWNLOAD_WORKERS)
+		for url, dest, _, _ in equations:
+			if found[url]:
+				tmp_path = '{}.{}.part'.format(dest, rand_str(8)) # A partial file is never visible
+				shutil.copyfile(found[url], tmp_path)
+				os.replace(tmp_path, str(dest))
+
+		failed = [url for url, _, _, _ in equations if not found[url]]
+		if failed:
+			SimpleWarning('The LaTeX server {} is not accessible, LaTeX may not be rendered'.format(self.conf['server'])).show()
+			mark_incomplete('LaTeX server {} not accessible'.format(self.conf['server']))
+		else:
+			print("LaTeX download complete")
+		return failed
+
+class SvgRenderer(FileRenderer):
+	""" Render the equations to svg locally, with the ziamath package """
+	RE_SVG_SIZE = r'<svg([^>]*?) width="([\d.]+)" height="([\d.]+)" viewBox="([-\d. ]+)"'
+
+	def __init__(self, module):
+		super().__init__(module)
+		import_module('ziamath', 'ziamath') # The modules are not kept, the target is sent to the processes of the parallel builds
+
+	def get_key(self, texcode, inline):
+		return 'ziamath:{}:{}:{}'.format(LATEX_SVG_SIZE, 'inline' if inline else 'block', texcode)
+
+	def to_em(self, px):
+		return '{:.3f}em'.format(float(px) / LATEX_SVG_SIZE)
+
+	def render(self, texcode, inline):
+		ziamath = import_module('ziamath', 'ziamath')
+		svg = ziamath.Latex(texcode, size=LATEX_SVG_SIZE, inline=inline).svg()
+
+		# Sizes relative to the font, and alignment on the baseline of the text
+		def set_size(match):
+			attrs, width, height, viewbox = match.groups()
+			min_y, view_height = [float(v) for v in viewbox.split()[1::2]]
+			depth = max(0, min_y + view_height)
+			return '<svg{} style="vertical-align: -{};" width="{}" height="{}" viewBox="{}"'.format(
+				attrs, self.to_em(depth), self.to_em(width), self.to_em(height), viewbox)
+
+		return SVG_HEADER + re.sub(self.RE_SVG_SIZE, set_size, svg, count=1)
+
+	def create_files(self, equations):
+		failed = []
+		for key, path, inline, texcode in equations:
+			try:
+				svg = self.render(texcode, inline)
+			except Exception as e:
+				SimpleWarning('Can\'t render the equation {} : {}'.format(texcode, str(e) or type(e).__name__)).show()
+				failed.append(key)
+				continue
+			if self.cache:
+				self.cache.put(path.name, svg.encode('utf-8'))
+			else:
+				with open(str(path), 'w', encoding='utf-8') as f:
+					f.write(svg)
+		return failed
+
+class MathMLRenderer(LatexRenderer):
+	""" Convert the equations to MathML locally, with the latex2mathml package. No image is created """
+	BLOCK = '<p class="centerblock">{}</p>'
+
+	def __init__(self, module):
+		super().__init__(module)
+		import_module('latex2mathml', 'latex2mathml.converter')
+
+	def render_all(self, equations):
+		converter = import_module('latex2mathml', 'latex2mathml.converter')
+		codes = {}
+		for inline, texcode in equations:
+			try:
+				mathml = converter.convert(texcode, display=('inline' if inline else 'block'))
+				codes[(inline, texcode)] = mathml if inline else self.BLOCK.format(mathml)
+			except Exception as e:
+				SimpleWarning('Can\'t render the equation {} : {}'.format(texcode, str(e) or type(e).__name__)).show()
+				codes[(inline, texcode)] = ''
+				self.status = 'offline'
+		return codes
+
+LATEX_RENDERERS = {
+	'http' : HttpRenderer,
+	'svg' : SvgRenderer,
+	'mathml' : MathMLRenderer,
+}
@@ -1,12 +1,19 @@
-import re
-
-import docx
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
-from docx.enum.style import WD_STYLE_TYPE
-from docx.shared import Pt, Cm
+import re, io, zipfile
+
+from lxml import etree
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.image.image import Image
+from docx.image.exceptions import UnrecognizedImageError
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.opc.constants import RELATIONSHIP_TYPE
+from docx.shared import Pt
+from docx.styles import BabelFish
 
 from md2book.util.common import get_file_local_path
-from .mdhtml import purify_remove_html
+from .mdtext import add_purify_html_handlers
+from .pandocast import add_purify_html_ast_handlers, element, stringify
 
 ALIGMENTS = {
 	'left' : WD_ALIGN_PARAGRAPH.LEFT,
@@ -17,72 +24,180 @@ ALIGMENTS = {
 REGEX_IMAGES = r'\[\[IMAGE-ITEM\]\]\[\[(.*?)\]\]\[\[(.*?)\]\]'
 SEP_MARGIN = Pt(20)
 
-def create_document_styles(document):
-	sep_style = document.styles.add_style('SepStyle', WD_STYLE_TYPE.PARAGRAPH)
-	sep_style.base_style = document.styles['Body Text']
-	# sep_style.font.size = docx.shared.Pt(14)
-
-def post_process_docx(docx_file, target):
-	docx_path = docx_file.getStrPath()
-	document = docx.Document(docx_path)
-	create_document_styles(document)
-
-	alignment = target['style']['align']
+DOCUMENT_PART = 'word/document.xml'
+DOCUMENT_RELS_PART = 'word/_rels/document.xml.rels'
+STYLES_PART = 'word/styles.xml'
+CONTENT_TYPES_PART = '[Content_Types].xml'
+RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+
+# -------------------- PACKAGE PARTS -------------------- #
+
+def get_style_ids(styles):
+	""" Name of the paragraph styles, as displayed by Word -> id """
+	ids = {}
+	for style in styles.iterchildren(qn('w:style')):
+		name = style.find(qn('w:name'))
+		if style.get(qn('w:type')) == 'paragraph' and name is not None:
+			ids[BabelFish.internal2ui(name.get(qn('w:val')))] = style.get(qn('w:styleId'))
+	return ids
+
+def add_sep_style(styles, style_ids):
+	style = etree.SubElement(styles, qn('w:style'), {qn('w:type') : 'paragraph', qn('w:customStyle') : '1', qn('w:styleId') : 'SepStyle'})
+	etree.SubElement(style, qn('w:name'), {qn('w:val') : 'SepStyle'})
+	if 'Body Text' in style_ids:
+		etree.SubElement(style, qn('w:basedOn'), {qn('w:val') : style_ids['Body Text']})
+	return style.get(qn('w:styleId'))
+
+class DocxImages:
+	"""
+		Images added to the document. Each path is resolved, and each image is stored in the package,
+		only once for the build
+	"""
+	def __init__(self, names, rels, content_types, next_id):
+		self.names = set(names) # Files of the package
+		self.rels = rels
+		self.content_types = content_types
+		self.next_id = next_id
+		self.rel_ids = {rel.get('Id') for rel in rels}
+		self.images = {} # Path in the markdown -> (relationship id, image), or None if not found
+		self.media = {} # Name in the package -> content
+
+	def new_name(self, pattern, used):
+		i = 1
+		while pattern.format(i) in used:
+			i += 1
+		return pattern.format(i)
+
+	def add(self, url):
+		if url not in self.images:
+			path = get_file_local_path(url)
+			try:
+				image = Image.from_file(path) if path else None
+			except UnrecognizedImageError: # The svg images (LaTeX equations...) can't be embedded
+				image = None
+			if image is None:
+				self.images[url] = None
+				return None
+			name = self.new_name('word/media/image{}.' + image.ext, self.names)
+			self.names.add(name)
+			self.media[name] = image.blob
+
+			rel_id = self.new_name('rId{}', self.rel_ids)
+			self.rel_ids.add(rel_id)
+			etree.SubElement(self.rels, '{%s}Relationship' % RELS_NS,
+				{'Id' : rel_id, 'Type' : RELATIONSHIP_TYPE.IMAGE, 'Target' : name[len('word/'):]})
+			etree.SubElement(self.content_types, '{%s}Override' % CONTENT_TYPES_NS,
+				{'PartName' : '/' + name, 'ContentType' : image.content_type})
+			self.images[url] = (rel_id, image)
+
+		if self.images[url] is None:
+			return None
+		rel_id, image = self.images[url]
+		cx, cy = image.scaled_dimensions()
+		self.next_id += 1
+		return CT_Inline.new_pic_inline(self.next_id - 1, rel_id, image.filename, cx, cy)
+
+def get_next_id(document):
+	""" Next id, unique in the document, for the images """
+	used_ids = [int(i) for i in document.xpath('//@id') if i.isdigit()]
+	return max(used_ids) + 1 if used_ids else 1
+
+# -------------------- DOCUMENT -------------------- #
+
+def set_paragraph_text(p, text):
+	p.clear_content()
+	if text:
+		p.add_r().text = text
+
+def post_process_paragraphs(document, target, style_ids, sep_style, images):
+	alignment = ALIGMENTS.get(target['style']['align'])
 	sep = target['sep']
-	heading_sep = 'Heading ' + str(target['chapter-level'])
-	image_alignment = 'center' if target['style']['center-blocks'] else alignment
+	heading_style = style_ids.get('Heading ' + str(target['chapter-level']))
+	image_alignment = ALIGMENTS['center'] if target['style']['center-blocks'] else alignment
+
+	for i, p in enumerate(document.find(qn('w:body')).iterchildren(qn('w:p'))):
+		text = ''.join(t.text or '' for t in p.iter(qn('w:t')))
+		txt = text.strip()
 
-	for i, p in enumerate(document.paragraphs):
 		# Special blocks, alignment
-		txt = p.text.strip()
 		if txt == '[[SEP-ITEM]]':
-			p.text = sep
-			p.style = document.styles['SepStyle']
+			set_paragraph_text(p, sep)
+			p.style = sep_style
 			p.alignment = ALIGMENTS['center']
-
-
-			p.paragraph_format.space_before = SEP_MARGIN
-			p.paragraph_format.space_after = SEP_MARGIN
+			p_pr = p.get_or_add_pPr()
+			p_pr.spacing_before = SEP_MARGIN
+			p_pr.spacing_after = SEP_MARGIN
+			text = sep
 		elif txt == '[[SKIP-ITEM]]':
-			p.text = ''
-			p.add_run().add_break(WD_BREAK.PAGE)
+			set_paragraph_text(p, '')
+			p.add_r().add_br().type = 'page'
+			text = ''
 		else:
-			if p.style.name == heading_sep and i > 0:
-				# document.paragraphs[i-1].add_run().add_break(WD_BREAK.PAGE)
-				p.paragraph_format.page_break_before = True
-
-			if alignment in ALIGMENTS:
-				p.alignment = ALIGMENTS[alignment]
+			if i > 0 and heading_style is not None and p.style == heading_style:
+				p.get_or_add_pPr().pageBreakBefore_val = True
+			if alignment is not None:
+				p.alignment = alignment
 
 		# Images
-		images = []
-		def detect_image(match):
-			txt, url = match.group(1), match.group(2)
-			images.append(url)
-			return ''
-
-		if "[[IMAGE-ITEM]]" in p.text:
-			p.text = re.sub(REGEX_IMAGES, detect_image, p.text)
-			r = p.add_run()
-			for url in images:
-				url = get_file_local_path(url)
-				if url:
-					img = r.add_picture(url)
-			if image_alignment in ALIGMENTS:
-				p.alignment = ALIGMENTS[image_alignment]
-
-	document.save(docx_path)
+		if "[[IMAGE-ITEM]]" in text:
+			urls = []
+			set_paragraph_text(p, re.sub(REGEX_IMAGES, lambda m: urls.append(m.group(2)) or '', text))
+			r = p.add_r()
+			for url in urls:
+				inline = images.add(url)
+				if inline is not None:
+					r.add_drawing(inline)
+			if image_alignment is not None:
+				p.alignment = image_alignment
+
+def post_process_docx(docx_file, target):
+	"""
+		Rewrite word/document.xml in one pass over its paragraphs : separators, page breaks,
+		alignment and images. The other parts of the package are copied, or completed
+	"""
+	with zipfile.ZipFile(io.BytesIO(docx_file.get_bytes())) as package:
+		infos = package.infolist()
+		parts = {info.filename : package.read(info) for info in infos}
+
+	document = parse_xml(parts[DOCUMENT_PART])
+	styles = parse_xml(parts[STYLES_PART])
+	rels = etree.fromstring(parts[DOCUMENT_RELS_PART])
+	content_types = etree.fromstring(parts[CONTENT_TYPES_PART])
+
+	style_ids = get_style_ids(styles)
+	sep_style = add_sep_style(styles, style_ids)
+	images = DocxImages(parts, rels, content_types, get_next_id(document))
+	post_process_paragraphs(document, target, style_ids, sep_style, images)
+
+	parts[DOCUMENT_PART] = etree.tostring(document, xml_declaration=True, encoding='UTF-8', standalone=True)
+	parts[STYLES_PART] = etree.tostring(styles, xml_declaration=True, encoding='UTF-8', standalone=True)
+	parts[DOCUMENT_RELS_PART] = etree.tostring(rels, xml_declaration=True, encoding='UTF-8', standalone=True)
+	parts[CONTENT_TYPES_PART] = etree.tostring(content_types, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+	output = io.BytesIO()
+	with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as package:
+		for info in infos:
+			package.writestr(info, parts[info.filename])
+		for name, content in images.media.items():
+			package.writestr(name, content)
+	docx_file.load_bytes(output.getvalue())
 
 # -------------------- MAKE MARDOWN-HTML CONVERTABLE -------------------- #
 
-def purify_for_docx(code):
+def add_purify_docx_handlers(rewriter):
 	REGEX_MD_IMAGE = r"!\[(.*?)\]\((.*?)\)"
 
-	def store_html_image(match):
-		txt, url = match.group(1), match.group(2)
-		template = '[[IMAGE-ITEM]][[{}]][[{}]]'
-		return template.format(txt, url)
+	add_purify_html_handlers(rewriter)
+	rewriter.add(REGEX_MD_IMAGE, r'[[IMAGE-ITEM]][[\1]][[\2]]')
+
+def add_purify_docx_ast_handlers(rewriter):
+	""" Same as add_purify_docx_handlers, on the pandoc AST """
+	def replace_image(elem):
+		return [element('Str', '[[IMAGE-ITEM]][[{}]][[{}]]'.format(stringify(elem['c'][1]), elem['c'][2][0]))]
+	def replace_figure(elem): # Its images, without the caption
+		return [element('Para', block['c']) if block['t'] == 'Plain' else block for block in elem['c'][2]]
 
-	code = purify_remove_html(code)
-	code = re.sub(REGEX_MD_IMAGE, store_html_image, code)
-	return code
\ No newline at end of file
+	add_purify_html_ast_handlers(rewriter)
+	rewriter.add(['Image'], replace_image)
+	rewriter.add(['Figure'], replace_figure)
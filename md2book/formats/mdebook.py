@@ -1,10 +1,11 @@
-import re
+from .pandocast import add_mark_handler, element
 
-def preparse_ebook_markdown(code):
-	RREGEX_MARK = r'(==)(.*?)=='
+def add_ebook_handlers(rewriter):
+	""" Markdown not supported by pandoc """
+	RREGEX_MARK = r'==(.*?)=='
 
-	def replace_mark(match):
-		return '<mark>{}</mark>'.format(match.group(1))
+	rewriter.add(RREGEX_MARK, r'<mark>\1</mark>')
 
-	code = re.sub(RREGEX_MARK, replace_mark, code)
-	return code
\ No newline at end of file
+def add_ebook_ast_handlers(rewriter):
+	""" Same as add_ebook_handlers, on the pandoc AST """
+	add_mark_handler(rewriter, [element('RawInline', ['html', '<mark>'])], [element('RawInline', ['html', '</mark>'])])
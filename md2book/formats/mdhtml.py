@@ -1,6 +1,3 @@
-from pathlib import Path
-import re
-
 import markdown
 from markdown.treeprocessors import Treeprocessor
 from markdown.inlinepatterns import SimpleTagPattern
@@ -45,48 +42,3 @@ def extract_toc(code, depth, dest):
 	lines[0] = '<div class="toc toc-in-{dest}">'.format(dest=dest)
 	html = '\n'.join(lines)
 	return html
-
-# -------------------- PRE-PROCESS MARKDOWN -------------------- #
-
-REGEX_IMG_MD = r'!\[(.*?)\]\((.*?)\)'
-REGEX_IMG_HTML1 = r'<img(.*?)src="(.*?)"'
-REGEX_IMG_HTML2 = r"<img(.*?)src='(.*?)'"
-
-def md_make_paths_absolute(content, dir_path):
-	def complete_path(path):
-		if not Path(path).is_absolute() and (dir_path / path).exists():
-			return str(dir_path / path)
-		return path
-		
-	def replace_md_images(match):
-		return "![{}]({})".format(match.group(1), complete_path(match.group(2)))
-	def replace_html_images1(match):
-		return '<img{}src="{}"'.format(match.group(1), complete_path(match.group(2)))
-	def replace_html_images2(match):
-		return '<img{}src="{}"'.format(match.group(1), complete_path(match.group(2)))
-
-	content = re.sub(REGEX_IMG_MD, replace_md_images, content)
-	content = re.sub(REGEX_IMG_HTML1, replace_html_images1, content)
-	content = re.sub(REGEX_IMG_HTML2, replace_html_images2, content)
-	return content
-
-# -------------------- MAKE MARDOWN-HTML CONVERTABLE -------------------- #
-
-def purify_remove_html(code):
-	REGEX_IMG_HTML = r"<img(.*?)src=['\"](.*?)['\"](.*?)>"
-	REGEX_U = r"==(.*?)=="
-	REGEX_COMMENTS = r"<!--([\s\S]*?)-->"
-	REGEX_STYLE = r"<style.*?>([\s\S]*?)</style.*?>"
-
-	def replace_html_image(match):
-		attributes = match.group(1) + " " + match.group(3)
-		return '![]({})'.format(match.group(2))
-
-	def replace_u(match):
-		return match.group(1)
-
-	code = re.sub(REGEX_IMG_HTML, replace_html_image, code)
-	code = re.sub(REGEX_U, replace_u, code)
-	code = re.sub(REGEX_COMMENTS, '', code)
-	code = re.sub(REGEX_STYLE, '', code)
-	return code
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+	Rewriting of the markdown code in a single pass. The formats and the modules register handlers,
+	that are combined in one regex with the fenced code blocks and the code spans, which are left untouched.
+"""
+import re
+
+CODE_PATTERNS = [
+	r'`(?<![^\n]`)(``+)[^\n`]*\n(?:[\s\S]*?\n)?`\1[ \t]*(?m:$)', # Fenced code blocks
+	r'~(?<![^\n]~)(~~+)[^\n]*\n(?:[\s\S]*?\n)?~\1[ \t]*(?m:$)',
+	r'`(?<![\\`]`)(`*)(?!`)(?:.|\n(?![ \t]*\n))+?(?<!`)`\1(?!`)', # Code spans, inside a paragraph
+]
+RE_BACKREFERENCE = r'\\(?:([1-9]\d?)|.)'
+RE_TEMPLATE_GROUP = r'\\(\d+)'
+RE_PATTERN_TOKEN = r'\\.|\[\^?\]?(?:\\.|[^\]])*\]|.'
+SPECIAL_CHARS = '.^$*+?{}[]|()'
+OPTIONAL_QUANTIFIERS = ['?', '*', '{']
+MIN_TRIED_PREFIXES = 100
+MAX_PREFIXES_FREQUENCY = 200 # Prefixes found more than once every 200 characters are searched with the regex
+
+# -------------------- REGEX ANALYSIS -------------------- #
+
+def shift_backreferences(pattern, offset):
+	""" Renumber the backreferences of a pattern inserted after offset groups """
+	def shift(match):
+		if match.group(1):
+			return '\\{}'.format(int(match.group(1)) + offset)
+		return match.group(0)
+	return re.sub(RE_BACKREFERENCE, shift, pattern, flags=re.DOTALL)
+
+def get_literal_prefix(pattern):
+	""" Text at the start of all the matches of a regex, or '' """
+	tokens = re.findall(RE_PATTERN_TOKEN, pattern, flags=re.DOTALL)
+	depth = 0
+	for token in tokens:
+		depth += {'(' : 1, ')' : -1}.get(token, 0)
+		if token == '|' and depth == 0:
+			return ''
+
+	prefix = ''
+	for i, token in enumerate(tokens):
+		if len(token) == 1 and token not in SPECIAL_CHARS:
+			char = token
+		elif len(token) == 2 and token[0] == '\\' and not token[1].isalnum():
+			char = token[1]
+		else:
+			break
+		if tokens[i+1:i+2] and tokens[i+1] in OPTIONAL_QUANTIFIERS:
+			break
+		prefix += char
+	return prefix
+
+def compile_template(template):
+	"""
+		Function(match, offset) returning a string with the groups \\1, \\2... replaced,
+		parsed once. The groups of the handler are after offset groups of the match
+	"""
+	parts = re.split(RE_TEMPLATE_GROUP, template)
+	if len(parts) == 1:
+		return lambda match, offset: template
+	groups = [(part, int(group)) for part, group in zip(parts[::2], parts[1::2])]
+	end = parts[-1]
+	return lambda match, offset: ''.join(part + (match.group(offset + group) or '') for part, group in groups) + end
+
+# -------------------- REWRITER -------------------- #
+
+COMBINED_PATTERNS = {} # Patterns -> (combined regex, index of the last group of each alternative, prefixes)
+
+def combine_patterns(patterns):
+	"""
+		Regex matching one of the patterns, with an empty group at the end of each alternative
+		to identify the one that matched. The prefixes are None if a pattern can start with anything
+	"""
+	if patterns not in COMBINED_PATTERNS:
+		alternatives, last_groups, groups = [], [], 0
+		for pattern in patterns:
+			alternatives.append('(?:{})()'.format(shift_backreferences(pattern, groups)))
+			groups += re.compile(pattern).groups + 1
+			last_groups.append(groups)
+
+		prefixes = {get_literal_prefix(pattern) for pattern in patterns}
+		if '' in prefixes:
+			prefixes = None
+		else: # '<img' is found with '<'
+			prefixes = [p for p in prefixes if not any(p != q and p.startswith(q) for q in prefixes)]
+		COMBINED_PATTERNS[patterns] = (re.compile('|'.join(alternatives)), last_groups, prefixes)
+	return COMBINED_PATTERNS[patterns]
+
+class CombinedPattern:
+	"""
+		Regex matching the code, or one of the handlers. It is only tried where the text starts with
+		the prefix of an alternative, found with str.find, which is much faster than the regex engine.
+	"""
+	def __init__(self, handlers):
+		patterns = tuple(CODE_PATTERNS + [handler[0].pattern for handler in handlers])
+		self.regex, last_groups, self.prefixes = combine_patterns(patterns)
+		if self.prefixes is not None:
+			self.prefixes_regex = re.compile('|'.join(re.escape(prefix) for prefix in self.prefixes))
+
+		# Index of the last group of an alternative -> (handler, offset of its groups), or None for code
+		self.handlers = {group : None for group in last_groups[:len(CODE_PATTERNS)]}
+		offset = last_groups[len(CODE_PATTERNS) - 1]
+		for handler, last_group in zip(handlers, last_groups[len(CODE_PATTERNS):]):
+			self.handlers[last_group] = (handler, offset)
+			offset = last_group
+
+	def may_match(self, text):
+		return self.prefixes is None or self.prefixes_regex.search(text) is not None
+
+	def finditer(self, text):
+		"""
+			Matches in the text. When the prefixes are frequent, trying each of them
+			is slower than the regex engine, which is used for the rest of the text
+		"""
+		if self.prefixes is None:
+			yield from self.regex.finditer(text)
+			return
+
+		positions = {} # Prefix -> next position in the text
+		for prefix in self.prefixes:
+			position = text.find(prefix)
+			if position >= 0:
+				positions[prefix] = position
+		tried = 0
+		while positions:
+			start = min(positions.values())
+			tried += 1
+			if tried > MIN_TRIED_PREFIXES and tried * MAX_PREFIXES_FREQUENCY > start:
+				yield from self.regex.finditer(text, start)
+				return
+
+			match = self.regex.match(text, start)
+			end = start + 1
+			if match:
+				yield match
+				end = match.end()
+			for prefix, position in list(positions.items()):
+				if position < end:
+					position = text.find(prefix, end)
+					if position >= 0:
+						positions[prefix] = position
+					else:
+						del positions[prefix]
+
+class MarkdownRewriter:
+	"""
+		Handlers (regex, replacement) applied to the markdown code in one scan.
+		At each position, the first registered handler that matches is applied, and its replacement
+		is rewritten by the other handlers, but never again by a handler that produced it.
+		The replacement is a string with groups \\1, \\2..., or a function(match) returning a string.
+		The function can also return a function without arguments, called at the end to get the text
+		to insert, once the final steps are done (for example, rendering all the equations at once).
+		The regex of a handler uses numbered groups only, and should start with a literal text.
+	"""
+	def __init__(self):
+		self.handlers = [] # (compiled regex, replace function, if it is a template)
+		self.final_steps = []
+		self.patterns = {} # Handlers already applied -> CombinedPattern of the others
+		self.delayed = False # If some pieces are functions
+
+	def add(self, regex, replacement):
+		if callable(replacement):
+			self.handlers.append((re.compile(regex), replacement, False))
+		else:
+			self.handlers.append((re.compile(regex), compile_template(replacement), True))
+
+	def add_final_step(self, function):
+		""" Call function after the scan, before the insertion of the delayed replacements """
+		self.final_steps.append(function)
+
+	def get_pattern(self, applied):
+		if applied not in self.patterns:
+			handlers = [handler + (applied | {i},) for i, handler in enumerate(self.handlers) if i not in applied]
+			self.patterns[applied] = CombinedPattern(handlers)
+		return self.patterns[applied]
+
+	def scan(self, text, applied, pieces):
+		""" Append to pieces the rewritten text, as strings or delayed replacements """
+		pattern = self.get_pattern(applied)
+		position = 0
+		for match in pattern.finditer(text):
+			handler = pattern.handlers[match.lastindex]
+			if handler is None: # Code, kept as it is
+				continue
+			(regex, replace, is_template, replacement_applied), offset = handler
+			if is_template:
+				replacement = replace(match, offset)
+			else:
+				replacement = replace(regex.match(text, match.start()))
+
+			pieces.append(text[position:match.start()])
+			if callable(replacement):
+				pieces.append(replacement)
+				self.delayed = True
+			elif len(replacement_applied) < len(self.handlers) and self.get_pattern(replacement_applied).may_match(replacement):
+				self.scan(replacement, replacement_applied, pieces)
+			else:
+				pieces.append(replacement)
+			position = match.end()
+		pieces.append(text[position:])
+
+	def rewrite(self, code):
+		pieces = []
+		self.delayed = False
+		if self.handlers:
+			self.scan(code, frozenset(), pieces)
+		else:
+			pieces.append(code)
+		for step in self.final_steps:
+			step()
+		if self.delayed:
+			return ''.join(piece if isinstance(piece, str) else piece() for piece in pieces)
+		return ''.join(pieces)
@@ -0,0 +1,126 @@
+"""
+	Processing of the markdown code as text. The markdown package is not needed,
+	so that the formats that don't convert to html don't import it.
+"""
+from pathlib import Path
+import re
+
+from md2book.util.common import track_dependency
+from .mdrewrite import MarkdownRewriter
+
+# -------------------- SPLIT MARKDOWN IN CHAPTERS -------------------- #
+
+RE_FENCE = r'(~{3,}|`{3,})'
+RE_HEADING_LEVEL = r'#{1,6}'
+RE_DEFINITION = r' {0,3}\*?\[[^\]^][^\]]*\]:' # Reference links and abbreviations
+RE_FOOTNOTE = r' {0,3}\[\^[^\]]*\]:'
+RE_HTML_HEADING = r'<h([1-6]) id="([^"]*)"'
+RE_HTML_BLOCK = r'<(/?)(div|section|article|aside|details|figure|table|blockquote|ul|ol|dl)[\s>]'
+TOC_PLACEHOLDER = 'MD2BOOKTOCPLACEHOLDER'
+
+class MarkdownChapters:
+	"""
+		Markdown code split before the chapter headings, outside of fenced code blocks,
+		so that the chapters can be converted independently.
+		The definitions of reference links and abbreviations are copied in every part.
+	"""
+	def __init__(self, code, level):
+		self.parts = [[]] # Lines of each part
+		self.headings = [[]] # Heading lines of each part
+		self.definitions = []
+		self.footnotes = False # Footnotes are numbered in the whole book, and can't be split
+		self.split(code, level)
+
+	def split(self, code, level):
+		fence = None
+		previous = ''
+		html_depth = 0 # Number of open html blocks, which can't be split
+		for line in code.split('\n'):
+			if fence:
+				if line.rstrip(' ') == fence:
+					fence = None
+			elif re.match(RE_FENCE, line):
+				fence = re.match(RE_FENCE, line).group(1)
+			elif line.startswith('#'):
+				heading_level = len(re.match(RE_HEADING_LEVEL, line).group(0))
+				if heading_level <= level and not previous.strip() and not html_depth and any(self.parts[-1]):
+					self.parts.append([])
+					self.headings.append([])
+				self.headings[-1].append(line)
+			elif re.match(RE_FOOTNOTE, line):
+				self.footnotes = True
+			elif re.match(RE_DEFINITION, line):
+				self.definitions.append(line)
+			else:
+				for closing, _ in re.findall(RE_HTML_BLOCK, line):
+					html_depth = max(0, html_depth + (-1 if closing else 1))
+			self.parts[-1].append(line)
+			previous = line
+
+	def with_definitions(self, code):
+		return '\n\n'.join([code] + self.definitions)
+
+	def get_headings_code(self):
+		""" Markdown code with only the headings of the book, to compute their ids and the table of contents """
+		return self.with_definitions('\n\n'.join(line for part in self.headings for line in part))
+
+	def get_part_code(self, i):
+		code = '\n'.join(self.parts[i])
+		code = re.sub(r'^\[TOC\]$', TOC_PLACEHOLDER, code, flags=re.MULTILINE)
+		return self.with_definitions(code)
+
+	def split_heading_ids(self, ids):
+		""" Split the list of ids of all the headings between the parts """
+		parts_ids = []
+		for headings in self.headings:
+			parts_ids.append(ids[:len(headings)])
+			ids = ids[len(headings):]
+		return parts_ids
+
+def set_heading_ids(html, ids):
+	""" Replace the ids of the headings by the ids computed for the whole book, or return None if they don't match """
+	found = re.findall(RE_HTML_HEADING, html)
+	if [level for level, _ in found] != [level for level, _ in ids]:
+		return None
+	ids = iter(ids)
+	return re.sub(RE_HTML_HEADING, lambda m: '<h{} id="{}"'.format(*next(ids)), html)
+
+# -------------------- PRE-PROCESS MARKDOWN -------------------- #
+
+REGEX_IMG_MD = r'!\[(.*?)\]\((.*?)\)'
+REGEX_IMG_HTML1 = r'<img(.*?)src="(.*?)"'
+REGEX_IMG_HTML2 = r"<img(.*?)src='(.*?)'"
+REGEX_IMG_HTML = r"<img(.*?)src=['\"](.*?)['\"](.*?)>"
+REGEX_HTML_COMMENTS = r"<!--([\s\S]*?)-->"
+REGEX_HTML_STYLE = r"<style.*?>([\s\S]*?)</style.*?>"
+
+def md_make_paths_absolute(content, dir_path):
+	def complete_path(path):
+		if not Path(path).is_absolute() and (dir_path / path).exists():
+			track_dependency(dir_path / path)
+			return str(dir_path / path)
+		if Path(path).is_absolute():
+			track_dependency(path)
+		return path
+		
+	def replace_md_images(match):
+		return "![{}]({})".format(match.group(1), complete_path(match.group(2)))
+	def replace_html_images(match):
+		return '<img{}src="{}"'.format(match.group(1), complete_path(match.group(2)))
+
+	rewriter = MarkdownRewriter()
+	rewriter.add(REGEX_IMG_MD, replace_md_images)
+	rewriter.add(REGEX_IMG_HTML1, replace_html_images)
+	rewriter.add(REGEX_IMG_HTML2, replace_html_images)
+	return rewriter.rewrite(content)
+
+# -------------------- MAKE MARDOWN-HTML CONVERTABLE -------------------- #
+
+def add_purify_html_handlers(rewriter):
+	""" Remove the html that can't be converted, the images are converted to markdown """
+	REGEX_U = r"==(.*?)=="
+
+	rewriter.add(REGEX_IMG_HTML, r'![](\2)')
+	rewriter.add(REGEX_U, r'\1')
+	rewriter.add(REGEX_HTML_COMMENTS, '')
+	rewriter.add(REGEX_HTML_STYLE, '')
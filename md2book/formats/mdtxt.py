@@ -1,28 +1,53 @@
 import re
 
-from .mdhtml import purify_remove_html
+from .mdtext import add_purify_html_handlers
+from .pandocast import add_purify_html_ast_handlers, add_raw_html_handler, element, attr
 
 TXT_LARG = 72
 SKIP = '\n' * 25
 
+REGEX_HTML_LINK_START = r'<a.*?href=([\'"])(.*?)\1.*?>'
+REGEX_HTML_LINK_END = r'</\s*a\s*>'
+REGEX_HTML_ELEM = r'</?[a-zA-Z].*?>'
+
 def center_txt(text):
 	if isinstance(text, list):
 		return [center_txt(l) for l in text]
 	left = max(0, TXT_LARG - len(text)) // 2
 	return ' ' * left + text
 
-def purify_for_txt(code):
+def add_purify_txt_handlers(rewriter):
 	REGEX_HTML_LINK = r'<a.*?href=([\'"])(.*?)\1.*?>(.*?)</.*?a.*?>'
-	REGEX_HTML_ELEM = r'</?[a-zA-Z].*?>'
 
-	def convert_link(match):
-		return '[{text}]({url})'.format(text=match.group(3), url=match.group(2))
+	add_purify_html_handlers(rewriter)
+	rewriter.add(REGEX_HTML_LINK, r'[\3](\2)')
+	rewriter.add(REGEX_HTML_ELEM, '')
 
-	code = purify_remove_html(code)
-	code = re.sub(REGEX_HTML_LINK, convert_link, code)
-	code = re.sub(REGEX_HTML_ELEM, '', code)
+def html_links_to_markdown(elements):
+	""" Replace the inlines between the raw html tags <a href> and </a> by a link """
+	result = []
+	starts = [] # (Index in result, url) of the open links
+	for elem in elements:
+		if elem['t'] != 'RawInline' or elem['c'][0] != 'html':
+			result.append(elem)
+			continue
+		code = elem['c'][1].strip()
+		start = re.fullmatch(REGEX_HTML_LINK_START, code)
+		if start:
+			starts.append((len(result), start.group(2)))
+		elif starts and re.fullmatch(REGEX_HTML_LINK_END, code):
+			i, url = starts.pop()
+			result[i:] = [element('Link', [attr(), result[i+1:], [url, '']])]
+			continue
+		result.append(elem)
+	return result
 
-	return code
+def add_purify_txt_ast_handlers(rewriter):
+	""" Same as add_purify_txt_handlers, on the pandoc AST """
+	add_purify_html_ast_handlers(rewriter)
+	rewriter.add_list_step(html_links_to_markdown)
+	add_raw_html_handler(rewriter, lambda code: re.sub(REGEX_HTML_ELEM, '', code))
+	rewriter.add(['Div', 'Span'], lambda elem: elem['c'][1]) # Read from the html tags
 
 def post_process_txt(code, target):
 	sep = center_txt(target['sep'])
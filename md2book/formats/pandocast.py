@@ -0,0 +1,230 @@
+"""
+	Markdown parsed once by pandoc into its JSON AST, that the pandoc writers of all the formats
+	read instead of parsing the same markdown again.
+"""
+import hashlib, json, re
+from collections import OrderedDict
+
+from md2book.config import PANDOC_AST_FORMATS
+from md2book.formats.pandocpipe import run_pandoc
+from md2book.formats.mdtext import REGEX_IMG_HTML, REGEX_IMG_HTML1, REGEX_IMG_HTML2, REGEX_HTML_COMMENTS, REGEX_HTML_STYLE
+
+PARSED_ASTS = OrderedDict() # Hash of (pandoc, markdown) -> JSON AST, kept by the process for the other targets
+PARSED_ASTS_MAX = 8
+
+class PandocAst:
+	""" JSON AST of a document, decoded only if a hook reads or alters it """
+	def __init__(self, ast_json):
+		self.ast_json = ast_json
+		self.decoded = None
+
+	@property
+	def data(self):
+		""" The AST as python objects, that can be altered : {'pandoc-api-version', 'meta', 'blocks'} """
+		if self.decoded is None:
+			self.decoded = json.loads(self.ast_json)
+		return self.decoded
+
+	def get_json(self):
+		if self.decoded is None:
+			return self.ast_json
+		return json.dumps(self.decoded, separators=(',', ':'), check_circular=False) # Faster
+
+	def replace_strings(self, replacements):
+		""" Replace some strings of the AST (paths...) wherever they are """
+		if not replacements:
+			return
+		ast_json = self.get_json()
+		for old, new in replacements.items():
+			ast_json = ast_json.replace(json.dumps(old)[1:-1], json.dumps(new)[1:-1])
+		self.ast_json, self.decoded = ast_json, None
+
+def parse_markdown(pandoc, md_code):
+	""" JSON AST of the markdown code, computed once for all the targets with the same code """
+	h = hashlib.sha1()
+	for part in [pandoc, md_code]:
+		h.update(part.encode('utf-8'))
+		h.update(b'\0')
+	key = h.hexdigest()
+
+	if key in PARSED_ASTS:
+		PARSED_ASTS.move_to_end(key)
+	else:
+		ast_json = run_pandoc(pandoc, ['-f', 'markdown', '-t', 'json'], md_code.encode('utf-8'))
+		PARSED_ASTS[key] = ast_json.decode('utf-8')
+		while len(PARSED_ASTS) > PARSED_ASTS_MAX:
+			PARSED_ASTS.popitem(last=False)
+	return PandocAst(PARSED_ASTS[key])
+
+def write_ast(pandoc, ast, dest_format, options):
+	""" Content of the document written from the AST """
+	return run_pandoc(pandoc, ['-f', 'json', '-t', dest_format, '-o', '-'] + options, ast.get_json().encode('utf-8'))
+
+def uses_pandoc_ast(target):
+	""" True if the target is written from the shared AST : its markdown is then the same for all these formats """
+	return bool(target['build']['pandoc-ast']) and target.format in PANDOC_AST_FORMATS
+
+def add_ast_handlers(rewriter):
+	""" Markdown not supported by pandoc, kept in the AST for the changes of each format """
+	rewriter.add(r'==(.*?)==', r'[\1]{.mark}')
+
+# -------------------- ELEMENTS -------------------- #
+
+RAW_ELEMENTS = ['RawInline', 'RawBlock']
+LEAF_ELEMENTS = {'Str', 'Space', 'SoftBreak', 'LineBreak', 'Code', 'Math', 'CodeBlock', 'HorizontalRule', 'RawInline', 'RawBlock'} # Without elements inside
+
+def element(tag, content=None):
+	if content is None:
+		return {'t' : tag}
+	return {'t' : tag, 'c' : content}
+
+def attr(*classes):
+	return ['', list(classes), []]
+
+def text_inlines(text):
+	""" Inlines of a plain text : words and spaces """
+	inlines = []
+	for word in text.split():
+		if inlines:
+			inlines.append(element('Space'))
+		inlines.append(element('Str', word))
+	return inlines
+
+def stringify(value):
+	""" Text of an element, or of a list of elements, without the raw code """
+	if isinstance(value, list):
+		return ''.join(stringify(item) for item in value)
+	if not isinstance(value, dict):
+		return ''
+	tag = value['t']
+	if tag == 'Str':
+		return value['c']
+	if tag in ['Space', 'SoftBreak', 'LineBreak']:
+		return ' '
+	if tag in ['Code', 'Math']:
+		return value['c'][1]
+	if tag == 'Quoted':
+		quote = '"' if value['c'][0]['t'] == 'DoubleQuote' else "'"
+		return quote + stringify(value['c'][1]) + quote
+	if tag in RAW_ELEMENTS:
+		return ''
+	return stringify(value.get('c', []))
+
+# -------------------- REWRITING -------------------- #
+
+class AstRewriter:
+	"""
+		Handlers of the elements of the pandoc AST, applied in one walk of the blocks, from the innermost elements.
+		A handler is a function(element) that changes the element, and returns the list of elements that replace
+		it, or None to give it to the next handlers. The replacements are changed by the handlers added after the
+		one that returned them, except the element itself, that is kept as it is.
+		The list steps are functions(elements) returning the list of blocks or inlines that replaces it, applied
+		before the walk of its elements.
+	"""
+	def __init__(self):
+		self.handlers = {} # Element type -> [(order, function)]
+		self.count = 0
+		self.list_steps = []
+		self.final_steps = []
+
+	def add(self, tags, function):
+		for tag in tags:
+			self.handlers.setdefault(tag, []).append((self.count, function))
+		self.count += 1
+
+	def add_list_step(self, function):
+		self.list_steps.append(function)
+
+	def add_final_step(self, function):
+		""" Call function(ast) after the walk """
+		self.final_steps.append(function)
+
+	def apply(self, elem, after=-1):
+		for order, function in self.handlers.get(elem['t'], ()):
+			if order > after:
+				replacement = function(elem)
+				if replacement is not None:
+					return [result for item in replacement for result in ([item] if item is elem else self.apply(item, order))]
+		return [elem]
+
+	def walk(self, value):
+		""" The value (an element, or a list) with all its elements rewritten """
+		if isinstance(value, dict):
+			if value.get('t') not in LEAF_ELEMENTS and isinstance(value.get('c'), list):
+				value['c'] = self.walk(value['c'])
+			return value
+		if value and isinstance(value[0], dict) and isinstance(value[-1], dict): # Blocks or inlines, not [QuoteType, inlines]
+			for step in self.list_steps:
+				value = step(value)
+			result = []
+			for elem in value:
+				if elem['t'] not in LEAF_ELEMENTS and isinstance(elem.get('c'), list):
+					elem['c'] = self.walk(elem['c'])
+				if elem['t'] in self.handlers:
+					result += self.apply(elem)
+				else:
+					result.append(elem)
+			return result
+		for i, item in enumerate(value):
+			if isinstance(item, (list, dict)):
+				value[i] = self.walk(item)
+		return value
+
+	def rewrite(self, ast):
+		if self.handlers or self.list_steps: # Otherwise the AST is not decoded
+			ast.data['blocks'] = self.walk(ast.data['blocks'])
+		for step in self.final_steps:
+			step(ast)
+
+def add_raw_html_handler(rewriter, function):
+	""" Replace the code of the raw html elements by function(code), the empty elements are removed """
+	def replace(elem):
+		if elem['c'][0] == 'html':
+			elem['c'][1] = function(elem['c'][1])
+			if not elem['c'][1].strip():
+				return []
+	rewriter.add(RAW_ELEMENTS, replace)
+
+def add_paragraph_handler(rewriter, text, get_blocks):
+	""" Replace the paragraphs made only of the text by get_blocks(), return the list of the replaced paragraphs """
+	found = []
+	def replace(elem):
+		if len(elem['c']) == 1 and elem['c'][0]['t'] == 'Str' and elem['c'][0]['c'] == text:
+			found.append(elem)
+			return get_blocks()
+	rewriter.add(['Para', 'Plain'], replace)
+	return found
+
+def add_mark_handler(rewriter, before, after):
+	""" Replace the marked text (==text==) by the inlines before, its content, and the inlines after """
+	def replace(elem):
+		if 'mark' in elem['c'][0][1]:
+			return before + elem['c'][1] + after
+	rewriter.add(['Span'], replace)
+
+def add_image_path_handler(rewriter, function):
+	""" Replace the path of the images, markdown or html, by function(path) """
+	def replace_html(template):
+		return lambda match: template.format(match.group(1), function(match.group(2)))
+	def replace(elem):
+		if elem['t'] == 'Image':
+			elem['c'][2][0] = function(elem['c'][2][0])
+		elif elem['c'][0] == 'html' and '<img' in elem['c'][1]:
+			code = re.sub(REGEX_IMG_HTML1, replace_html('<img{}src="{}"'), elem['c'][1])
+			elem['c'][1] = re.sub(REGEX_IMG_HTML2, replace_html("<img{}src='{}'"), code)
+	rewriter.add(['Image'] + RAW_ELEMENTS, replace)
+
+def add_remove_images_handlers(rewriter):
+	""" Remove the images, markdown or html, and the figures made of a markdown image """
+	rewriter.add(['Image', 'Figure'], lambda elem: [])
+	add_raw_html_handler(rewriter, lambda code: re.sub(r'<img.*?>', '', code))
+
+def add_purify_html_ast_handlers(rewriter):
+	""" Same as add_purify_html_handlers, on the AST """
+	def replace_image(elem):
+		match = re.fullmatch(REGEX_IMG_HTML, elem['c'][1].strip()) if elem['c'][0] == 'html' else None
+		if match:
+			return [element('Image', [attr(), [], [match.group(2), '']])]
+	rewriter.add(['RawInline'], replace_image)
+	add_mark_handler(rewriter, [], [])
+	add_raw_html_handler(rewriter, lambda code: re.sub(REGEX_HTML_STYLE, '', re.sub(REGEX_HTML_COMMENTS, '', code)))
@@ -0,0 +1,15 @@
+"""
+	Conversions with pandoc, through pipes instead of temporary files
+"""
+import subprocess
+
+from md2book.util.exceptions import ParsingError
+
+def run_pandoc(pandoc, args, data):
+	""" Output of pandoc for the input data, both given through pipes """
+	r = subprocess.run([pandoc] + args, input=data, capture_output=True)
+	if r.returncode:
+		raise ParsingError("Error while converting with pandoc : {}".format(r.stderr.decode('utf-8', 'replace')))
+	if r.stderr: # Warnings
+		print(r.stderr.decode('utf-8', 'replace'), end='')
+	return r.stdout
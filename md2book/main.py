@@ -1,14 +1,31 @@
-import argparse, tempfile, glob
+import argparse, tempfile, glob, io, traceback, time
 from pathlib import Path
+from contextlib import redirect_stdout, redirect_stderr
 
 from md2book.config import *
-from md2book.formats.mdhtml import md_make_paths_absolute
-from md2book.util.common import sys_open, load_yaml_file, find_files_matching
+from md2book.formats.mdtext import md_make_paths_absolute
+from md2book.util.common import sys_open, load_yaml_file, find_files_matching, track_dependency, tracking_dependencies, tracking_incomplete
+from md2book.util.manifest import BuildManifest, hash_config, get_file_state, is_temporary_file
 from md2book.util.settings import Target, create_default_book_config, load_settings
-from md2book.util.exceptions import LocatedError, ConfigError, WarningNoBookFound, SimpleWarning
-from md2book.convert.convert import convertBook
+from md2book.util.fetch import REMOTE_MIRRORS
+from md2book.util.exceptions import BaseError, LocatedError, ConfigError, WarningNoBookFound, SimpleWarning
+from md2book.convert.convert import convertBook, get_output_file
+from md2book.convert.stages import StageCache
 
-def get_cmd_args():
+# Intermediate conversion results, shared by all the targets compiled in this process
+BUILD_STAGES = StageCache()
+
+def jobs_count(value):
+	""" Number of parallel jobs, 0 for all the CPUs """
+	try:
+		count = int(value)
+	except ValueError:
+		count = -1
+	if count < 0:
+		raise argparse.ArgumentTypeError('the number of jobs should be a positive integer, or 0 to use all the CPUs')
+	return count
+
+def get_cmd_args(argv=None):
 	parser = argparse.ArgumentParser(
 		prog=M2B_NAME,
 		description=M2B_SHORT_DESCRIPTION,
@@ -21,10 +38,15 @@ def get_cmd_args():
 	parser.add_argument('--open', help='Open newly created files', action='store_true', default=False)
 	parser.add_argument('--remove-images', help='Remove all images in the document', action='store_true', default=False)
 	parser.add_argument('-a', '--all', help='Build all targets defined in the "all" field in the configuration file', action='store_true', default=False)
+	parser.add_argument('-f', '--force', help='Compile the targets even if they are up to date', action='store_true', default=False)
+	parser.add_argument('-w', '--watch', help='Keep running, and compile again the targets whose files changed', action='store_true', default=False)
+	parser.add_argument('-j', '--jobs', type=jobs_count, help='Number of targets compiled in parallel (0 to use all the CPUs)', default=1)
+	parser.add_argument('--mirror', action='append', type=str, help='Read-only directory containing the remote files, as <mirror>/<host>/<path>, used before the network', default=[])
+	parser.add_argument('--daemon', help='Send the build to the daemon started with "md2book serve", if it is running', action='store_true', default=False)
 
 	parser.add_argument('path', nargs='?', type=str, help='Path from where to search for the books (optional, the default path is the current directory). Can also be a book.yml file or a markdown file.', default='.')
 
-	return parser.parse_args()
+	return parser.parse_args(argv)
 
 # -------------------- BOOKS -------------------- #
 
@@ -55,6 +77,7 @@ def get_target_md_code(target):
 			# TODO : sort
 
 		for file_path in files:
+			track_dependency(file_path)
 			with open(file_path, "r", encoding="utf-8") as f:
 				content = f.read().strip()
 
@@ -89,63 +112,215 @@ def check_targets_validity(targets_dict, target_name):
 	if target_name not in list(targets_dict) + ALLOWED_FORMATS:
 		raise ConfigError('The target {} is to be built but is not defined'.format(target_name))
 
-def compile_book(book_path, target_name='main', output_dir=None, overwrite_target={}):
-	config = load_yaml_file(book_path)
-	
-	# Extract informations from the config
+def compile_book(book_path, target_name='main', output_dir=None, overwrite_target={}, force=False, stages=None):
+	with tracking_dependencies() as dependencies, tracking_incomplete() as incomplete:
+		config = load_yaml_file(book_path)
 
-	if output_dir:
-		compile_dir = Path(output_dir)
-	else:
-		compile_dir = book_path.parent / config.get('compile_in', DEFAULT_GEN_DIR)
-	compile_dir.mkdir(parents=True, exist_ok=True)
+		# Extract informations from the config
+
+		if output_dir:
+			compile_dir = Path(output_dir)
+		else:
+			compile_dir = book_path.parent / config.get('compile_in', DEFAULT_GEN_DIR)
+		compile_dir.mkdir(parents=True, exist_ok=True)
+
+		targets_dict = config.get('targets', {})
+		check_targets_validity(targets_dict, target_name)
+
+		# Load the target
+		target = Target(path=book_path, compile_dir=compile_dir, conf={})
+		target.load_from_settings(targets_dict, target_name)
+		target.merge(overwrite_target)
+		target.complete()
+
+		print('========== Compile {} to {}'.format(str(book_path), target.format))
 
-	targets_dict = config.get('targets', {})
-	check_targets_validity(targets_dict, target_name)
+		code = get_target_md_code(target)
 
-	# Load the target
-	target = Target(path=book_path, compile_dir=compile_dir, conf={})
-	target.load_from_settings(targets_dict, target_name)
-	target.merge(overwrite_target)
-	target.complete()
+		# Skip the target if nothing changed since the last build
+		manifest = BuildManifest(get_output_file(target))
+		conf_hash = hash_config(str(book_path.resolve()), target.format, target.conf, sorted(dependencies))
+		if not force and manifest.is_up_to_date(conf_hash):
+			for path in manifest.files:
+				track_dependency(path)
+			print('Up to date, skipped : ', manifest.out_file)
+			return manifest.out_file
 
-	print('========== Compile {} to {}'.format(str(book_path), target.format))
-	
-	code = get_target_md_code(target)
-	out_file = convertBook(code, target)
+		out_file = convertBook(code, target, BUILD_STAGES if stages is None else stages)
 
+	if incomplete: # Built again by the next command, even if nothing changed
+		manifest.remove()
+		SimpleWarning('The document is incomplete ({}), it will be built again'.format(', '.join(incomplete))).show()
+	else:
+		manifest.update(conf_hash, dependencies)
 	print('Success : ', out_file)
 	return out_file
 
+# -------------------- PARALLEL BUILDS -------------------- #
+
+class BuildJob:
+	"""
+		A single (book, target) compilation, that can be executed in a worker process.
+		The output of the job is captured, to be displayed in order by the main process.
+	"""
+	def __init__(self, book, target, output_dir=None, overwrite_target={}, force=False):
+		self.book = book
+		self.target = target
+		self.output_dir = output_dir
+		self.overwrite_target = overwrite_target
+		self.force = force
+
+		self.out_file = None
+		self.error = None
+		self.log = ''
+
+	def run(self):
+		log = io.StringIO()
+		with tempfile.TemporaryDirectory() as tmpdirname, redirect_stdout(log), redirect_stderr(log):
+			TMP_DIRS.insert(0, Path(tmpdirname).resolve())
+			try:
+				self.out_file = compile_book(self.book, self.target, self.output_dir, self.overwrite_target, self.force)
+			except LocatedError as e:
+				e.set_location(self.book)
+				self.error = str(e)
+			except BaseError as e:
+				self.error = str(e)
+			except Exception:
+				self.error = traceback.format_exc()
+			finally:
+				TMP_DIRS.pop(0)
+		self.log = log.getvalue()
+		return self
+
+def run_job(job):
+	return job.run()
+
+def init_worker(mirrors):
+	load_settings()
+	REMOTE_MIRRORS[:] = mirrors
+
+def run_parallel_jobs(jobs, workers):
+	"""
+		Compile all the jobs in a process pool. Logs are printed in the order of the jobs,
+		and a summary is printed at the end
+	"""
+	from concurrent.futures import ProcessPoolExecutor
+	with ProcessPoolExecutor(max_workers=(workers or None), initializer=init_worker, initargs=(list(REMOTE_MIRRORS),)) as executor:
+		futures = [executor.submit(run_job, job) for job in jobs]
+		done_jobs = []
+		for future in futures: # Keep the order of the jobs
+			job = future.result()
+			print(job.log, end='')
+			if job.error:
+				print(job.error)
+			done_jobs.append(job)
+
+	failed = [job for job in done_jobs if job.error]
+	print('========== {} target(s) compiled, {} failed'.format(len(done_jobs) - len(failed), len(failed)))
+	for job in done_jobs:
+		status = 'FAILED ' if job.error else 'Success'
+		print('{} : {} [{}]'.format(status, str(job.out_file or job.book), job.target))
+	return done_jobs
+
+# -------------------- WATCH -------------------- #
+
+def watch_jobs(jobs, open_files=False):
+	"""
+		Compile all the jobs, then wait for changes in the files read by each target
+		and compile again only the targets that depend on the modified files.
+		The stages are shared by the targets compiled together, and computed again at each rebuild
+	"""
+	watched_files = {}
+
+	def compile_job(i, stages, open_file=False):
+		job = jobs[i]
+		with tracking_dependencies() as dependencies:
+			try:
+				filepath = compile_book(job.book, job.target, job.output_dir, job.overwrite_target, job.force, stages)
+				if open_file:
+					sys_open(filepath)
+			except LocatedError as e:
+				e.set_location(job.book)
+				print(e)
+			except BaseError as e:
+				print(e)
+			except Exception:
+				traceback.print_exc()
+		dependencies.add(str(job.book.resolve()))
+		watched_files[i] = {path : get_file_state(path) for path in dependencies if not is_temporary_file(path)}
+
+	stages = StageCache()
+	for i in range(len(jobs)):
+		compile_job(i, stages, open_files)
+
+	print('=> Watching for changes (Ctrl+C to stop)...')
+	try:
+		while True:
+			time.sleep(WATCH_INTERVAL)
+			stages = StageCache()
+			for i, files in list(watched_files.items()):
+				if any(get_file_state(path) != state for path, state in files.items()):
+					compile_job(i, stages)
+	except KeyboardInterrupt:
+		pass
+
 # -------------------- MAIN -------------------- #
 
-def main():
-	args = get_cmd_args()
+def main(argv=None):
+	""" Execute the command, return False if some targets failed """
+	args = get_cmd_args(argv)
 	with tempfile.TemporaryDirectory() as tmpdirname:
-		TMP_DIRS.append(Path(tmpdirname).resolve())
-
-		load_settings()
-		path = get_real_book_path(args.path)
-		books = find_all_books(path)
-		target_list = args.target or ['main']
-
-		if not books:
-			raise WarningNoBookFound(path)
-
-		overwrite_target = {}
-		if args.remove_images:
-			overwrite_target['remove-images'] = True
-
-		for book in books:
-			if args.all:
-				target_list = get_all_targets(book)
-				print('=> Compile all targets for {} : {}'.format(str(book), ', '.join(target_list)))
-
-			for target in target_list:
-				try:
-					filepath = compile_book(book, target, args.output, overwrite_target)
-					if args.open:
-						sys_open(filepath)
-				except LocatedError as e:
-					e.set_location(book)
-					raise e
\ No newline at end of file
+		TMP_DIRS.insert(0, Path(tmpdirname).resolve())
+		try:
+			return run_command(args)
+		finally:
+			TMP_DIRS.pop(0)
+
+def run_command(args):
+	load_settings()
+	REMOTE_MIRRORS[:] = [str(Path(mirror).resolve()) for mirror in args.mirror]
+	path = get_real_book_path(args.path)
+	books = find_all_books(path)
+	target_list = args.target or ['main']
+
+	if not books:
+		raise WarningNoBookFound(path)
+
+	overwrite_target = {}
+	if args.remove_images:
+		overwrite_target['remove-images'] = True
+
+	jobs = []
+	for book in books:
+		if args.all:
+			target_list = get_all_targets(book)
+			print('=> Compile all targets for {} : {}'.format(str(book), ', '.join(target_list)))
+
+		for target in target_list:
+			jobs.append(BuildJob(book, target, args.output, overwrite_target, args.force))
+
+	if args.watch or (args.jobs != 1 and len(jobs) > 1):
+		# Targets sharing a directory must not remove the LaTeX images used by the others
+		for job in jobs:
+			job.overwrite_target = {**job.overwrite_target, 'latex' : {'clean_cache' : False}}
+
+	if args.watch:
+		watch_jobs(jobs, args.open)
+		return True
+
+	if args.jobs != 1 and len(jobs) > 1:
+		done_jobs = run_parallel_jobs(jobs, args.jobs)
+		for job in done_jobs:
+			if args.open and job.out_file:
+				sys_open(job.out_file)
+		return not any(job.error for job in done_jobs)
+
+	for job in jobs:
+		try:
+			filepath = compile_book(job.book, job.target, job.output_dir, job.overwrite_target, job.force)
+			if args.open:
+				sys_open(filepath)
+		except LocatedError as e:
+			e.set_location(job.book)
+			raise e
+	return True
@@ -2,7 +2,9 @@ from copy import deepcopy
 
 from md2book.config import *
 from md2book.util.common import escapePath, get_file_in
+from md2book.util.style import InlineStylesheet
 from md2book.util.exceptions import ConfigError
+from md2book.util.fetch import prefetch_urls
 
 class BaseModule:
 	NAME = None # None for a module auto-loaded without configuration
@@ -30,12 +32,28 @@ class BaseModule:
 	def alter_html(self, code):
 		pass
 
+	def alter_dom(self, code):
+		""" Same as alter_html, on the lxml tree code.tree, when the option build.html-tree is enabled """
+		pass
+
 	def pandoc_options(self, dest_format):
 		return []
 
+	def rewrite_ast(self, rewriter, code):
+		""" Add the handlers of the module to the single walk of the pandoc AST of the markdown code, when the option build.pandoc-ast is enabled """
+		pass
+
+	def rewrite_md(self, rewriter):
+		""" Add the handlers of the module to the single scan of the markdown code """
+		pass
+
 	def alter_md(self, code):
 		pass
 
+	def alter_document(self, code):
+		""" Change the complete document (html code, or markdown code given to pandoc), before the conversion to the output format """
+		pass
+
 # -------------------- MODULE FOR ALL BASE DATAS -------------------- #
 
 class MainTargetDatasModule(BaseModule):
@@ -51,6 +69,7 @@ class MainTargetDatasModule(BaseModule):
 		# Stylesheets
 		conf_css = []
 		base_paths = ['/', self.target.path.parent, DATA_PATH / 'styles']
+		prefetch_urls(conf['css']) # Concurrently, before they are resolved one by one
 		for path in  conf['css']:
 			real_path = get_file_in(path, base_paths)
 			if real_path:
@@ -75,5 +94,7 @@ class MainTargetDatasModule(BaseModule):
 		options = super().pandoc_options(dest_format)
 		if dest_format == 'epub':
 			for path in self.target.stylesheets:
+				if isinstance(path, InlineStylesheet):
+					path = path.get_path()
 				options.append("--css=" + escapePath(path))
 		return options
\ No newline at end of file
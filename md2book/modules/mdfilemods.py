@@ -1,12 +1,17 @@
 import datetime, yaml, re
-import urllib, hashlib
 
 from .base import BaseModule
 from md2book.config import *
 from md2book.templates import TemplateFiller
-from md2book.formats.mdhtml import extract_toc
-from md2book.util.exceptions import SimpleWarning, ConfigError
-from md2book.util.common import download_url, load_yaml_file
+from md2book.util.exceptions import ConfigError
+from md2book.util.common import load_yaml_file, load_text_file, track_dependency
+from md2book.util.svg import load_svg_file
+from md2book.util.fetch import get_local_image
+from md2book.formats.latex import LATEX_RENDERERS, AliasesReplacer
+from md2book.formats.images import ImageOptimizer, IMAGE_OPTIONS
+from md2book.formats.mdtext import REGEX_IMG_MD, REGEX_IMG_HTML1, REGEX_IMG_HTML2
+from md2book.formats.pandocast import uses_pandoc_ast, add_image_path_handler, add_remove_images_handlers, \
+	add_paragraph_handler, element, RAW_ELEMENTS
 
 class MetadataModule(BaseModule):
 	NAME = 'metadata'
@@ -34,9 +39,12 @@ class MetadataModule(BaseModule):
 class ImagesModule(BaseModule):
 	NAME = 'images'
 
-	REGEX_RM_IMG = r"<img.*?>|!\[.*?\]\(.*?\)"
+	REGEX_RM_IMG = [r"<img.*?>", r"!\[.*?\]\(.*?\)"] # Separate handlers, that start with a literal character
 	RE_IMG_HTML = r'<img(.*?)/?>'
 	RE_EMPTY_ALT = r'alt=([\'"])\1'
+	RE_DOCX_IMAGE = r'\[\[IMAGE-ITEM\]\]\[\[(.*?)\]\]\[\[(.*?)\]\]' # Markdown images, for the docx files
+	OPTIMIZED_FORMATS = ['html', 'pdf', 'epub', 'docx', 'odt']
+	LOCAL_FORMATS = ['epub', 'odt'] # Given the local copies of the remote images, that pandoc would download
 
 	def __init__(self, conf, target):
 		super().__init__(conf, target)
@@ -45,32 +53,81 @@ class ImagesModule(BaseModule):
 
 		if conf['cover']:
 			conf['cover'] = str((target.path.parent / conf['cover']).resolve())
+			track_dependency(conf['cover'])
 			target.conf['metadata']['cover-image'] = conf['cover']
 
+		self.uses_ast = uses_pandoc_ast(target) # The images are then changed on the AST
+		self.optimizer = None
+		if self.format in self.OPTIMIZED_FORMATS and any(conf.get(key) is not None for key in IMAGE_OPTIONS):
+			self.optimizer = ImageOptimizer(conf, target.compile_dir / 'images')
+
 	def replace_html_images(self, match):
 		code = match.group(1)
 		if not " alt=" in code:
 			code = code + ' alt="Image" '
 		return '<img{}/>'.format(code)
 
+	def get_path(self, path):
+		""" Path of the image given to the output format """
+		if self.format in self.LOCAL_FORMATS:
+			path = get_local_image(path)
+		return self.optimizer.get_path(path) if self.optimizer else path
+
+	def rewrite_md(self, rewriter):
+		if self.uses_ast:
+			return
+		if self.conf['remove']:
+			for regex in self.REGEX_RM_IMG:
+				rewriter.add(regex, '')
+		elif self.optimizer or self.format in self.LOCAL_FORMATS:
+			# The paths are replaced during the scan, and the images are processed at the end
+			def replace_path(template):
+				return lambda match: template.format(match.group(1), self.get_path(match.group(2)))
+			rewriter.add(REGEX_IMG_MD, replace_path('![{}]({})'))
+			rewriter.add(REGEX_IMG_HTML1, replace_path('<img{}src="{}"'))
+			rewriter.add(REGEX_IMG_HTML2, replace_path("<img{}src='{}'"))
+			if self.format == 'docx':
+				rewriter.add(self.RE_DOCX_IMAGE, replace_path('[[IMAGE-ITEM]][[{}]][[{}]]'))
+			if self.optimizer:
+				rewriter.add_final_step(self.optimizer.process_pending)
+
 	def alter_md(self, code):
+		if self.optimizer and self.optimizer.renamed:
+			code.code = self.optimizer.replace_renamed(code.code)
+
+	def rewrite_ast(self, rewriter, code):
 		if self.conf['remove']:
-			code.code = re.sub(self.REGEX_RM_IMG, '', code.code)
+			add_remove_images_handlers(rewriter)
+		elif self.optimizer or self.format in self.LOCAL_FORMATS:
+			add_image_path_handler(rewriter, self.get_path)
+		if self.optimizer and not self.conf['remove']:
+			rewriter.add_final_step(lambda ast: self.optimizer.process_pending())
+			rewriter.add_final_step(lambda ast: ast.replace_strings(self.optimizer.renamed))
 
 	def alter_html(self, code):
 		code.code = re.sub(self.RE_IMG_HTML, self.replace_html_images, code.code)
 		code.code = re.sub(self.RE_EMPTY_ALT, 'alt="Image"', code.code)
 
+	def alter_dom(self, code):
+		for img in code.tree.iter('img'):
+			if not img.get('alt'):
+				img.set('alt', 'Image')
+
 class TitlePageModule(BaseModule):
 	NAME = 'titlepage'
 
 	def alter_html(self, code):
-		if self.format != 'epub':
-			with open(TITLE_PAGE_TEMPLATE, 'r') as f:
-				titlepage = f.read()
+		if self.format != 'epub' and code.first_part:
+			titlepage = load_text_file(TITLE_PAGE_TEMPLATE)
 			titlepage = TemplateFiller(self.target).fill(titlepage)
 			code.code = titlepage + code.code
 
+	def alter_dom(self, code):
+		from md2book.formats.htmltree import insert_html_start
+		if self.format != 'epub' and code.first_part:
+			titlepage = load_text_file(TITLE_PAGE_TEMPLATE)
+			insert_html_start(code.tree, TemplateFiller(self.target).fill(titlepage))
+
 class TocModule(BaseModule):
 	NAME = 'toc'
 
@@ -86,11 +143,19 @@ class TocModule(BaseModule):
 			options.append("--epub-chapter-level=" + str(chapter_level))
 		return options
 
+	def __init__(self, conf, target):
+		super().__init__(conf, target)
+		self.uses_ast = uses_pandoc_ast(target) # The table of contents is then inserted in the AST
+
 	def alter_md(self, code):
+		if self.uses_ast:
+			return
+
 		if self.format in ['html', 'pdf', 'markdown', 'txt'] and self.conf['enable']:
 			code.code = '[TOC]\n\n' + code.code
 
 		if self.format in ['epub'] and '[TOC]' in code.code:
+			from md2book.formats.mdhtml import extract_toc
 			toc_html = extract_toc(code.code, self.conf['level'], self.format)
 			code.code = code.code.replace('[TOC]', toc_html)
 
@@ -99,6 +164,23 @@ class TocModule(BaseModule):
 				self.conf['enable'] = '[TOC]' in code.code
 			code.code = code.code.replace('[TOC]', '')
 
+	def rewrite_ast(self, rewriter, code):
+		if self.format == 'txt' and self.conf['enable']:
+			rewriter.add_final_step(lambda ast: ast.data['blocks'].insert(0, element('Para', [element('Str', '[TOC]')])))
+
+		def get_toc_blocks():
+			if self.format != 'epub':
+				return []
+			from md2book.formats.mdhtml import extract_toc
+			return [element('RawBlock', ['html', extract_toc(code.code, self.conf['level'], self.format)])]
+
+		if self.format in ['odt', 'epub', 'docx']:
+			found = add_paragraph_handler(rewriter, '[TOC]', get_toc_blocks)
+			def set_enable(ast): # The table of contents of the epub files is already inserted
+				self.conf['enable'] = bool(found) and self.format != 'epub'
+			if self.conf['enable'] is None:
+				rewriter.add_final_step(set_enable)
+
 	def get_stylesheets(self):
 		styles = []
 		style = self.conf['style'].strip()
@@ -115,7 +197,8 @@ class HtmlBlocksModule(BaseModule):
 
 	def __init__(self, conf, target):
 		super().__init__(conf, target)
-		self.alter_svg = target.format in ['html', 'pdf']
+		# With build.svg-symbols, the svg images are inserted once the parts of the document are joined
+		self.alter_svg = target.format in ['html', 'pdf'] and not target['build']['svg-symbols']
 
 	def alter_html(self, code):
 		code.code = re.sub(self.REGEX_COMMENTS, '', code.code)
@@ -127,17 +210,24 @@ class HtmlBlocksModule(BaseModule):
 		path = match.group(2)
 		if path.startswith('http://') or path.startswith('https://'):
 			return match.group(1)
-		with open(str(path)) as f:
-			xml = f.readlines()[2:]
-		xml = ''.join(xml)
-		return xml
+		return load_svg_file(path).code
+
+	def alter_dom(self, code):
+		from lxml import etree
+		from md2book.formats.htmltree import parse_svg, replace_element
+		for comment in list(code.tree.iter(etree.Comment)):
+			comment.drop_tree()
+		if self.alter_svg:
+			for img in list(code.tree.iter('img')):
+				path = img.get('src', '')
+				if path.endswith('.svg') and not (path.startswith('http://') or path.startswith('https://')):
+					replace_element(img, parse_svg(load_svg_file(path).code))
 
 
 class LatexModule(BaseModule):
 	NAME = 'latex'
 	TEX_BLOCKS = r'\$\$([\s\S]*?)\$\$'
 	TEX_INLINE = r'\$(.*?)\$'
-	SVG_SIZE= r'width="(.*?)" height="(.*?)"'
 	# XML_PROP_RE = r'[\s\S]*?<svg.*?width="(.*?)".*?height="(.*?)".*?role="img"[\s\S]*?'
 	# IMAGE_TEMPLATE = '![]({url})'
 	IMAGE_INLINE = '<img src="{}" style="width:{}; height: {};" />'
@@ -146,23 +236,25 @@ class LatexModule(BaseModule):
 	def __init__(self, conf, target):
 		super().__init__(conf, target)
 		self.enabled = self.conf['enable']
-		self.download_status = None
 		self.equations_names = set()
+		self.equations_codes = {} # (inline, texcode) -> html code
 		self.relative_path = target.format in ['md']
 
 		if self.enabled:
+			if self.conf['renderer'] not in LATEX_RENDERERS:
+				raise ConfigError("The LaTeX renderer should be one of: {}".format(', '.join(LATEX_RENDERERS)))
 			self.download_dir = target.compile_dir / 'latex'
 			self.download_dir.mkdir(parents=True, exist_ok=True)
+			self.renderer = LATEX_RENDERERS[self.conf['renderer']](self)
+			self.aliases = AliasesReplacer(self.get_aliases())
 
 	def get_latex_image_code(self, path, inline=True):
-		with open(str(path)) as f:
-			xml = f.readlines()
-		xml = ''.join(xml)
-		sizes = re.search(self.SVG_SIZE, xml)
+		self.equations_names.add(path.name)
+		width, height = load_svg_file(path).size
 
 		template = self.IMAGE_INLINE if inline else self.IMAGE_BLOCK
 		path = ('latex/' + path.name) if self.relative_path else str(path)
-		return template.format(path, sizes.group(1), sizes.group(2))
+		return template.format(path, width, height)
 
 	def clean_cache(self):
 		for file in self.download_dir.iterdir():
@@ -179,57 +271,51 @@ class LatexModule(BaseModule):
 		
 		return list(aliases.items())
 
-	def preprocess_text(self, texcode):
-		a = texcode
+	def get_aliases(self):
 		aliases = []
 		if self.conf['aliases_file']:
 			aliases.extend(self.load_aliases(self.conf['aliases_file']))
 		if self.conf['default_aliases']:
 			aliases.extend(self.load_aliases(DATA_PATH / 'default_aliases.yml'))
-		
-		for alias_from, alias_to in aliases:
-			alias_from = alias_from.replace('\\', '\\\\')
-			alias_to = alias_to.replace('\\', '\\\\')
-			texcode = re.sub(alias_from + r'(?=([^a-zA-Z\d]|$))', alias_to, texcode)
-		return texcode
-
-	def get_inserter(self, argname):
-		def match_latex(match):
-			if self.download_status == 'offline':
-				return ''
-
-			texcode = match.group(1).strip()
-			texcode = self.preprocess_text(texcode)
-			args = urllib.parse.urlencode({'color' : 'black', argname : texcode})
-			url = 'https://math.vercel.app?' + args
-			filename = hashlib.md5(url.encode('utf-8')).hexdigest()
-
-			path = self.download_dir / (filename + '.svg')
-			if not path.resolve().is_file():
-				if self.download_status is None:
-					print("Download LaTeX images from math.vercel.app...")
-				result_path = download_url(url, path=str(path))
-				if result_path is None:
-					self.download_status = 'offline'
-					return ''
-				else:
-					self.download_status = 'ok'
-
-			# path = path.relative_to(self.target.compile_dir)
-			path = path.resolve()
-			self.equations_names.add(path.name)
-			return self.get_latex_image_code(path, inline=(argname == 'inline'))
-
-		return match_latex
+		return aliases
 
-	def alter_md(self, code):
+	def preprocess_text(self, texcode):
+		return self.aliases.replace(texcode)
+
+	def render_equations(self, equations):
+		""" Render at once a list of (inline, texcode) """
+		processed = {(inline, tex) : (inline, self.preprocess_text(tex.strip())) for inline, tex in set(equations)}
+		codes = self.renderer.render_all(set(processed.values()))
+		for eq, processed_eq in processed.items():
+			self.equations_codes[eq] = codes[processed_eq]
+
+	def insert_equation(self, texcode, inline):
+		return self.equations_codes.get((inline, texcode), '')
+
+	def rewrite_md(self, rewriter):
 		if self.enabled:
-			code.code = re.sub(self.TEX_BLOCKS, self.get_inserter('from'), code.code)
-			code.code = re.sub(self.TEX_INLINE, self.get_inserter('inline'), code.code)
-
-			if self.download_status == 'offline':
-				SimpleWarning('The math.vercel.app API is not accessible, LaTeX may not be rendered').show()
-			elif self.download_status == 'ok':
-				print("LaTeX download complete")
-			if self.download_status != 'offline':
-				self.clean_cache()
\ No newline at end of file
+			# Collect all the equations, render them at once, then insert them
+			equations = []
+			def store_equation(inline):
+				def store(match):
+					texcode = match.group(1)
+					equations.append((inline, texcode))
+					return lambda: self.insert_equation(texcode, inline)
+				return store
+
+			rewriter.add(self.TEX_BLOCKS, store_equation(False))
+			rewriter.add(self.TEX_INLINE, store_equation(True))
+			rewriter.add_final_step(lambda: self.render_equations(equations))
+
+	def rewrite_ast(self, rewriter, code):
+		# Not purified, like in the markdown of these formats, where they are inserted after the purification of the html
+		if self.enabled and self.format in ['docx', 'txt']:
+			download_dir = str(self.download_dir)
+			def keep_equation(elem):
+				if elem['c'][0] == 'html' and download_dir in elem['c'][1]:
+					return [elem]
+			rewriter.add(RAW_ELEMENTS, keep_equation)
+
+	def alter_md(self, code):
+		if self.enabled and self.renderer.status != 'offline' and self.conf['clean_cache']:
+			self.clean_cache()
@@ -1,6 +1,7 @@
 from .base import BaseModule
 from md2book.config import *
-from md2book.util.style import ensure_with_unit, FontFamily
+from md2book.util.style import ensure_with_unit, create_css_file, FontFamily, InlineStylesheet
+from md2book.util.dependencies import check_module
 from md2book.util.common import escapePath, load_yaml_file
 from md2book.util.exceptions import ConfigError
 
@@ -46,23 +47,37 @@ class SepModule(BaseModule):
 class FontModule(BaseModule):
 	NAME = 'font'
 	FONT_CSS = 'body {{ font-family: "{font}","Clear Sans","Helvetica Neue",Helvetica,Arial,sans-serif;}}'
+	SUBSET_FORMATS = ['html', 'pdf', 'epub']
+	WOFF2_FORMATS = ['html', 'epub'] # wkhtmltopdf can't read WOFF2 fonts
 
 	def __init__(self, conf, target):
 		super().__init__(conf, target)
 		self.try_add_font(self.conf['default'])
+		self.subsets = {} # Font file -> its subset, once the text of the document is known
+		if self.is_subset():
+			check_module('fonttools', 'fontTools')
 
 	def get_fonts(self):
-		return [FontFamily(font) for font in self.conf['include']]
+		return [FontFamily.load(font) for font in self.conf['include']]
 
 	def try_add_font(self, name):
 		base_font_dir = DATA_PATH / 'fonts' / str(name)
 		if name not in self.conf['include'] and base_font_dir.exists():
 			self.conf['include'].append(name)
 
-	def get_custom_css(self):
+	def is_subset(self):
+		return bool(self.conf['subset']) and self.format in self.SUBSET_FORMATS
+
+	def get_fonts_css(self):
 		css = []
 		for font in self.get_fonts():
-			css.extend(font.get_css(self.format))
+			css.extend(font.get_css(self.format, self.subsets))
+		return css
+
+	def get_custom_css(self):
+		css = []
+		if not self.is_subset(): # Added with the subsets, by alter_document
+			css.extend(self.get_fonts_css())
 		if self.conf['default']:
 			css.append(self.FONT_CSS.format(font=self.conf['default']))
 		if self.conf['size']:
@@ -70,9 +85,36 @@ class FontModule(BaseModule):
 			css.append('body { font-size: ' + size + ';}')
 		return css
 
+	def alter_document(self, code):
+		if not self.is_subset():
+			return
+		from md2book.formats.fontsubset import FontSubsetter, get_characters, get_html_text, get_markdown_text, has_woff2_support
+		if self.format == 'epub': # The markdown, and the generated stylesheets, given to pandoc
+			# The separators are inserted after, in the AST, with build.pandoc-ast
+			text = get_markdown_text(code.get()) + self.target['title'] + self.target['sep']
+			text += '\n'.join(style.content for style in self.target.stylesheets if isinstance(style, InlineStylesheet))
+		else:
+			text = get_html_text(code.code) + code.title + '\n'.join(code.headers)
+
+		flavor = None
+		if self.conf['woff2'] and self.format in self.WOFF2_FORMATS and has_woff2_support():
+			flavor = 'woff2'
+		subsetter = FontSubsetter(get_characters(text), flavor)
+		files = [file for font in self.get_fonts() for file, _, _ in font.font_files]
+		# The html and pdf documents refer to the files, pandoc embeds them in the epub files
+		output_dir = None if self.format == 'epub' else self.target.compile_dir / 'fonts'
+		self.subsets = subsetter.subset_all(files, output_dir)
+
+		if self.format != 'epub':
+			code.addHeader('style', '\n'.join(self.get_fonts_css()))
+
 	def pandoc_options(self, dest_format):
 		options = super().pandoc_options(dest_format)
-		if dest_format == 'epub':
+		if dest_format == 'epub' and self.is_subset():
+			options.append("--css=" + escapePath(create_css_file('\n'.join(self.get_fonts_css()))))
+			for path in self.subsets.values():
+				options.append("--epub-embed-font=" + escapePath(path))
+		elif dest_format == 'epub':
 			for font in self.get_fonts():
 				path = escapePath(font.font_path / (font.name + "*"))
 				options.append("--epub-embed-font=" + path)
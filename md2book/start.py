@@ -1,43 +1,50 @@
-import importlib, traceback
-# from shutil import which
-import distutils.spawn
+import sys
 
-def which(name):
-	return distutils.spawn.find_executable(name)
+from md2book.util.exceptions import BaseError
+from md2book.util.dependencies import check_module, require_command
 
-from md2book.util.exceptions import BaseError, ModuleImportError, MissingDependencyError
-
-dependencies = ['pandoc', 'wkhtmltopdf']
+# Required by all the formats. The dependencies of each format are checked by its pipeline
+dependencies = []
 python_modules = {
 	'pyyaml' : 'yaml',
-	'markdown' : 'markdown',
-	'pdfkit' : 'pdfkit',
-	'python-docx' : 'docx',
 }
 
-def check_dependency(name):
-	if which(name) is None:
-		raise MissingDependencyError(name=name)
-
-def check_module(name, module):
-	if not importlib.util.find_spec(module):
-		raise ModuleImportError(name=name)
+def check_dependencies():
+	for name in dependencies:
+		require_command(name)
+	for name, module in python_modules.items():
+		check_module(name, module)
 
-def main():
+def report_errors(function, *args):
+	""" Execute function, and print the errors for the user. Return False if it failed """
 	try:
-		for name in dependencies:
-			check_dependency(name)
-		for name, module in python_modules.items():
-			check_module(name, module)
-
-		# Import here to load modules AFTER checkin dependencies
-		from md2book.main import main
-		main()
+		return function(*args) is not False
 	except BaseError as e:
 		print(e)
 	except Exception as e:
+		import traceback
 		traceback.print_exc()
 		print("\u001b[31m[ERROR] An unexpected exception occured in md2book. If you can't solve the problem, please open an issue on https://github.com/webalorn/md2book/issues\nIf possible, copy the error message, the configuration file and the markdown code that created the problem.\u001b[0m")
+	return False
+
+def run(argv):
+	check_dependencies()
+
+	# Import here to load modules AFTER checkin dependencies
+	from md2book.main import main
+	return main(argv)
+
+def main():
+	argv = sys.argv[1:]
+	if argv[:1] == ['serve']:
+		from md2book.daemon import serve
+		sys.exit(0 if report_errors(serve) else 1)
+	if '--daemon' in argv:
+		from md2book.daemon import send_to_daemon
+		status = send_to_daemon(argv)
+		if status is not None:
+			sys.exit(status)
+	sys.exit(0 if report_errors(run, argv) else 1)
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
@@ -1,9 +1,10 @@
-import string
-from copy import deepcopy as copy
+import string, builtins, os
+from collections import ChainMap
 from datetime import datetime
 
 from md2book.util.exceptions import TemplateError
-from md2book.util.common import is_int, rand_str
+from md2book.util.common import is_int, rand_str, track_dependency
+from md2book.formats.pandocast import uses_pandoc_ast
 
 FONT_CSS_TEMPLATE = "\
 <style>\
@@ -17,6 +18,79 @@ CSS_FONT_PROPERTIES = {
 	'size' : 'font-size',
 }
 
+# -------------------- COMPILATION -------------------- #
+
+COMPILED_TEMPLATES = {} # Code -> list of nodes, the oldest removed first
+COMPILED_TEMPLATES_MAX = 64
+
+def compile_nodes(txt):
+	""" Nodes of a code where the directives are {...}, and the other braces are glyphs """
+	nodes = []
+	for literal, field_name, spec, conversion in string.Formatter().parse(txt):
+		if literal:
+			nodes.append(literal.replace("𓂴", "{").replace("𓂶", "}"))
+		if field_name is not None:
+			# Numbered or automatic fields have no name
+			field_name = '' if not field_name or is_int(field_name) else field_name.strip()
+			if '{' in spec:
+				spec = compile_nodes(spec)
+			else:
+				spec = spec.replace("𓂴", "{").replace("𓂶", "}")
+			nodes.append((field_name, conversion, spec))
+	return nodes
+
+def parse_template(txt):
+	"""
+		Parse a template : a list of literal strings, and of directives (name, conversion, spec),
+		where spec is a string, or a list of nodes if it contains other directives
+	"""
+	if '{%' not in txt and '%}' not in txt:
+		return [txt]
+	code = txt.replace("{", "𓂴").replace("}", "𓂶")
+	code = code.replace("𓂴%", "{").replace("%𓂶", "}")
+	return compile_nodes(code)
+
+def compile_template(txt):
+	""" Nodes of a template, parsed once """
+	if txt not in COMPILED_TEMPLATES:
+		if len(COMPILED_TEMPLATES) >= COMPILED_TEMPLATES_MAX:
+			del COMPILED_TEMPLATES[next(iter(COMPILED_TEMPLATES))]
+		COMPILED_TEMPLATES[txt] = parse_template(txt)
+	return COMPILED_TEMPLATES[txt]
+
+INCLUDED_TEMPLATES = {} # Path of an included file -> (modification time, size, nodes)
+
+def load_template_file(path):
+	""" Nodes of a template file, parsed again only when the file changes """
+	path = os.path.abspath(str(path))
+	track_dependency(path)
+	stat = os.stat(path)
+	state = (stat.st_mtime_ns, stat.st_size)
+	if INCLUDED_TEMPLATES.get(path, (None,))[:2] != state:
+		with open(path, 'r', encoding='utf-8') as f:
+			INCLUDED_TEMPLATES[path] = state + (parse_template(f.read()),)
+	return INCLUDED_TEMPLATES[path][2]
+
+COMPILED_EXPRESSIONS = {} # Expression of an eval or if directive -> code object
+
+# The only builtins available in the expressions, that can also use the variables
+SAFE_BUILTINS = {name : getattr(builtins, name) for name in [
+	'abs', 'all', 'any', 'bool', 'chr', 'dict', 'divmod', 'enumerate', 'filter', 'float', 'format', 'hex',
+	'int', 'isinstance', 'len', 'list', 'map', 'max', 'min', 'oct', 'ord', 'pow', 'range', 'repr',
+	'reversed', 'round', 'set', 'sorted', 'str', 'sum', 'tuple', 'zip',
+]}
+EXPRESSIONS_GLOBALS = {'__builtins__' : SAFE_BUILTINS}
+
+def compile_expression(expr):
+	if expr not in COMPILED_EXPRESSIONS:
+		try:
+			COMPILED_EXPRESSIONS[expr] = compile(expr.strip(), '<template>', 'eval')
+		except SyntaxError as e:
+			raise TemplateError("Invalid expression {} : {}".format(repr(expr), e.msg))
+	return COMPILED_EXPRESSIONS[expr]
+
+# -------------------- ENGINE -------------------- #
+
 class TemplateEngine(string.Formatter):
 	"""
 		Template engine : replace things like {% ... %}
@@ -42,20 +116,9 @@ class TemplateEngine(string.Formatter):
 	"""
 	def __init__(self, values, path):
 		super().__init__()
-		self.values = copy(values)
+		self.values = ChainMap({}, values) # The variables set by the templates hide the values, never changed
 		self.path = path.resolve()
-
-	def vformat(self, format_string, args, kwargs):
-		used_args = set()
-		result, _ = self._vformat(format_string, args, kwargs, used_args, 200)
-		self.check_unused_args(used_args, args, kwargs)
-		return result
-
-	def get_field(self, field_name, args, kwargs):
-		if is_int(field_name):
-			return '', ''
-		field_name = field_name.strip()
-		return field_name, field_name
+		self.included = [] # Files being included, to detect the cycles
 
 	def get_value_of(self, val):
 		d = self.values
@@ -70,13 +133,30 @@ class TemplateEngine(string.Formatter):
 		return d
 
 	def get_path_file_content(self, path):
-		sys_path = self.path / path
+		sys_path = (self.path / path).resolve()
+		if sys_path in self.included:
+			cycle = self.included[self.included.index(sys_path):] + [sys_path]
+			raise TemplateError("The file {} includes itself : {}".format(str(path), ' -> '.join(map(str, cycle))))
 		try:
-			content = open(str(sys_path), "r").read()
+			nodes = load_template_file(sys_path)
 		except FileNotFoundError:
 			raise TemplateError("The path {} doesn't exists".format(str(path)))
-		content = self.format(content)
-		return content
+		except (OSError, UnicodeDecodeError) as e:
+			raise TemplateError("Can't read the file {} : {}".format(str(path), e))
+
+		self.included.append(sys_path)
+		try:
+			return self.render(nodes)
+		finally:
+			self.included.pop()
+
+	def eval_expression(self, expr):
+		""" Value of a python expression, where the names are the variables """
+		code = compile_expression(expr)
+		try:
+			return eval(code, EXPRESSIONS_GLOBALS, self.values)
+		except Exception as e:
+			raise TemplateError("Can't evaluate {} : {}: {}".format(repr(expr), type(e).__name__, e))
 
 	def end_expr(self, val, result):
 		result = str(result)
@@ -172,17 +252,18 @@ class TemplateEngine(string.Formatter):
 			path = self.get_value_of(val)
 			if path is None:
 				return ''
+			track_dependency(self.path / path)
 			return str(self.path / path)
 
 		elif action == 'eval':
-			result = eval(':'.join(params))
+			result = self.eval_expression(':'.join(params))
 			return self.end_expr(val, result)
 
 		elif action == 'if':
 			condition = params.pop().strip()
 			if_expr, else_expr = self.split_delimiters(params, 'else', 2)
 
-			cond = eval(condition, self.values)
+			cond = self.eval_expression(condition)
 			if isinstance(cond, str):
 				cond = cond.strip()
 			return self.end_expr(val, if_expr if cond else else_expr)
@@ -197,26 +278,30 @@ class TemplateEngine(string.Formatter):
 			raise TemplateError("Invalid template : {{{}}}".format(val+":"+spec))
 		return ''
 
+	def render(self, nodes):
+		parts = []
+		for node in nodes:
+			if isinstance(node, str):
+				parts.append(node)
+			else:
+				field_name, conversion, spec = node
+				if not isinstance(spec, str): # The spec contains directives
+					spec = self.render(spec)
+				parts.append(self.format_field(self.convert_field(field_name, conversion), spec))
+		return ''.join(parts)
+
 	def format(self, txt):
-		txt = txt.replace("{%", "𓀀").replace("%}", "𓀁")
-		txt = txt.replace("{", "𓂴").replace("}", "𓂶")
-		txt = txt.replace("𓀀", "{").replace("𓀁", "}")
+		if '{%' not in txt and '%}' not in txt:
+			return txt
 		self.openedFont = None
-
-		txt = super().format(txt)
-
-		# if self.openedFont:
-		# 	txt += '\n\n</div>'
-
-		txt = txt.replace("𓂴", "{").replace("𓂶", "}")
-		return txt
+		return self.render(compile_template(txt))
 
 class TemplateFiller(TemplateEngine):
 	def add_font(self, font):
 		self.target.mods['font'].try_add_font(font)
 
 	def __init__(self, target):
-		values = copy(target.conf)
+		values = {} # Added to the configuration of the target, without copying it
 		self.target = target
 
 		now = datetime.now()
@@ -225,7 +310,7 @@ class TemplateFiller(TemplateEngine):
 		values['time'] = now.strftime("%H:%M:%S")
 		values['hour'] = now.strftime("%H:%M")
 
-		sep_string = values['sep']
+		sep_string = target.conf['sep']
 
 		values['skip'] = '<div class="pageBreak"></div>'
 		values['sep'] = '<div class="sep"><span>' + sep_string + '</span></div>'
@@ -234,11 +319,12 @@ class TemplateFiller(TemplateEngine):
 			if '*' in sep_string or '_' in sep_string:
 				values['sep'] = '<div class="sep"><span class="sepcontent"></span></div>'
 
-		if target.format in ['docx', 'txt']:
+		# With build.pandoc-ast, the items are replaced in the AST shared by the formats
+		if target.format in ['docx', 'txt'] or uses_pandoc_ast(target):
 			values['skip'] = '[[SKIP-ITEM]]'
 			values['sep'] = '[[SEP-ITEM]]'
 
-		super().__init__(values, target.path.parent)
+		super().__init__(ChainMap(values, target.conf), target.path.parent)
 
 	def fill(self, code):
 		return self.format(code)
\ No newline at end of file
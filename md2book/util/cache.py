@@ -0,0 +1,74 @@
+import os, shutil
+from pathlib import Path
+
+from .common import rand_str
+
+class FileCache:
+	"""
+		Directory of files identified by their name, shared by all the builds of the user.
+		Files are written atomically, and the least recently used ones are removed
+		when the total size of the cache exceeds max_size (in bytes).
+	"""
+	def __init__(self, path, max_size=None):
+		self.path = Path(path)
+		self.max_size = max_size
+		self.path.mkdir(parents=True, exist_ok=True)
+
+	def get_path(self, name):
+		return self.path / name
+
+	def get(self, name):
+		""" Path of the cached file, or None. The file is marked as recently used """
+		path = self.get_path(name)
+		try:
+			os.utime(str(path))
+		except OSError:
+			return None
+		return path
+
+	def get_tmp_path(self, dest):
+		return Path('{}.{}.part'.format(str(dest), rand_str(8)))
+
+	def copy_to(self, name, dest):
+		""" Hard-link (or copy, if impossible) the cached file to dest """
+		path = self.get(name)
+		if path is None:
+			return None
+		tmp_path = self.get_tmp_path(dest)
+		try:
+			os.link(str(path), str(tmp_path))
+		except OSError:
+			shutil.copyfile(str(path), str(tmp_path))
+		os.replace(str(tmp_path), str(dest))
+		return dest
+
+	def put(self, name, content):
+		path = self.get_path(name)
+		tmp_path = self.get_tmp_path(path)
+		with open(str(tmp_path), 'wb') as f:
+			f.write(content)
+		os.replace(str(tmp_path), str(path))
+		return path
+
+	def evict(self):
+		""" Remove the least recently used files until the cache fits in max_size """
+		if not self.max_size:
+			return
+		files = []
+		for entry in os.scandir(str(self.path)):
+			try:
+				stat = entry.stat()
+			except OSError:
+				continue
+			if entry.is_file() and not entry.name.endswith('.part'):
+				files.append((stat.st_mtime, stat.st_size, entry.path))
+
+		total_size = sum(size for _, size, _ in files)
+		for _, size, path in sorted(files):
+			if total_size <= self.max_size:
+				break
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+			total_size -= size
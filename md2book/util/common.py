@@ -1,17 +1,12 @@
-import subprocess, os, platform, fnmatch, yaml, time
+import subprocess, os, platform, fnmatch, yaml
 import random, string
 from copy import deepcopy
-import ssl
-from urllib.request import urlopen
+from contextlib import contextmanager
 from pathlib import Path
 
 from .exceptions import ConfigError
 from md2book.config import *
 
-ctx = ssl.create_default_context()
-ctx.check_hostname = False
-ctx.verify_mode = ssl.CERT_NONE
-
 # -------------------- UTILITY -------------------- #
 
 def merge_dicts_recur(settings, overrride):
@@ -45,6 +40,46 @@ def sys_open(filepath):
     else:                                   # linux variants
         subprocess.call(('xdg-open', filepath))
 
+# -------------------- DEPENDENCIES -------------------- #
+
+DEPENDENCY_TRACKERS = []
+
+def remove_tracker(trackers, tracker):
+    """ Remove by identity, the nested trackers may have the same content """
+    trackers[:] = [t for t in trackers if t is not tracker]
+
+def track_dependency(path):
+    """ Record that a file has been read by the current build """
+    for dependencies in DEPENDENCY_TRACKERS:
+        dependencies.add(os.path.abspath(str(path)))
+
+@contextmanager
+def tracking_dependencies():
+    """ Collect all the files read by the build inside this context """
+    dependencies = set()
+    DEPENDENCY_TRACKERS.append(dependencies)
+    try:
+        yield dependencies
+    finally:
+        remove_tracker(DEPENDENCY_TRACKERS, dependencies)
+
+INCOMPLETE_TRACKERS = []
+
+def mark_incomplete(reason):
+    """ Record that the current build is degraded by a temporary failure (network...), and must be done again """
+    for reasons in INCOMPLETE_TRACKERS:
+        reasons.append(reason)
+
+@contextmanager
+def tracking_incomplete():
+    """ Collect the reasons why the build inside this context is incomplete """
+    reasons = []
+    INCOMPLETE_TRACKERS.append(reasons)
+    try:
+        yield reasons
+    finally:
+        remove_tracker(INCOMPLETE_TRACKERS, reasons)
+
 # -------------------- FILES -------------------- #
 
 def escapePath(path):
@@ -60,12 +95,29 @@ def find_files_matching(path, pattern):
         for sub_path in path.iterdir():
             yield from find_files_matching(sub_path, pattern)
 
+YAML_CACHE = {} # path -> (modification time, size, content)
+
 def load_yaml_file(filepath, default=None):
     filepath = str(filepath)
+    track_dependency(filepath)
+    try:
+        stat = os.stat(filepath)
+        state = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        state = None
+
+    # Files are parsed again only if they changed, which keeps watched books fast to rebuild
+    cache_key = os.path.abspath(filepath)
+    if state and YAML_CACHE.get(cache_key, (None,))[:2] == state:
+        return deepcopy(YAML_CACHE[cache_key][2])
+
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             try:
-                return yaml.load(f, Loader=yaml.FullLoader)
+                content = yaml.load(f, Loader=yaml.FullLoader)
+                if state:
+                    YAML_CACHE[cache_key] = state + (content,)
+                return deepcopy(content)
             except yaml.error.YAMLError as e:
                 details = []
                 for arg in e.args:
@@ -81,20 +133,22 @@ def load_yaml_file(filepath, default=None):
             raise ConfigError("This file doesn't exists", filepath)
     return default
 
-def download_url(url, ext='', path=None, repeat_n=2, repeat_delay=0.5):
-    if path is None:
-        path = str(TMP_DIRS[0] / (rand_str(20) + ext))
-    try:
-        with urlopen(url) as img:
-            with open(path, 'wb') as svg:
-                svg.write(img.read())
-        return path
-    except Exception as e:
-        if repeat_n > 0:
-            time.sleep(repeat_delay)
-            return download_url(url, ext=ext, path=path, repeat_n=repeat_n-1, repeat_delay=repeat_delay*2)
-        print('ERROR', e)
-        return None
+TEXT_CACHE = {} # path -> (modification time, size, content)
+
+def load_text_file(filepath):
+    """ Content of a text file (a stylesheet, a script...), kept in memory while it doesn't change """
+    filepath = os.path.abspath(str(filepath))
+    track_dependency(filepath)
+    stat = os.stat(filepath)
+    state = (stat.st_mtime_ns, stat.st_size)
+    if TEXT_CACHE.get(filepath, (None,))[:2] == state:
+        return TEXT_CACHE[filepath][2]
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read()
+    if not any(filepath.startswith(str(tmp_dir)) for tmp_dir in TMP_DIRS): # Created for a single build
+        TEXT_CACHE[filepath] = state + (content,)
+    return content
 
 def get_file_in(path, path_list=['/'], dir_ok=False):
     for base in path_list:
@@ -102,7 +156,10 @@ def get_file_in(path, path_list=['/'], dir_ok=False):
             complete_path = (Path(base) / path).resolve()
             if complete_path.exists() and (complete_path.is_file() or dir_ok):
                 return str(complete_path)
-    return download_url(path)
+    from .fetch import is_remote_url, fetch_remote
+    if is_remote_url(path):
+        return fetch_remote(str(path))
+    return None
     
 
 def get_file_local_path(path, base_path='', user_path='', dir_ok=False):
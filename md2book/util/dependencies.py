@@ -0,0 +1,70 @@
+import importlib, importlib.util, json, os
+from shutil import which
+
+from md2book.config import *
+from .exceptions import ModuleImportError, MissingDependencyError
+
+# -------------------- PYTHON MODULES -------------------- #
+
+def check_module(name, module):
+	if not importlib.util.find_spec(module):
+		raise ModuleImportError(name=name)
+
+def import_module(name, module):
+	""" Import an optional module, name is the package to install """
+	try:
+		return importlib.import_module(module)
+	except ImportError:
+		raise ModuleImportError(name=name)
+
+# -------------------- COMMANDS -------------------- #
+
+COMMANDS_FOUND = {} # (PATH, command) -> path of the executable
+
+def is_executable(path):
+	return os.path.isfile(path) and os.access(path, os.X_OK)
+
+def load_commands_cache():
+	try:
+		with open(str(COMMANDS_CACHE_FILE), 'r', encoding='utf-8') as f:
+			content = json.load(f)
+		return content if isinstance(content, dict) else {}
+	except (OSError, ValueError):
+		return {}
+
+def save_commands_cache(content):
+	try:
+		COMMANDS_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+		tmp_path = '{}.{}'.format(str(COMMANDS_CACHE_FILE), os.getpid())
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			json.dump(content, f)
+		os.replace(tmp_path, str(COMMANDS_CACHE_FILE))
+	except OSError:
+		pass
+
+def find_command(name):
+	"""
+		Path of an external command, or None. The result is cached in the user directory
+		for the current PATH, and the directories are searched again only if the cached executable is gone
+	"""
+	env_path = os.environ.get('PATH', '')
+	if (env_path, name) in COMMANDS_FOUND:
+		return COMMANDS_FOUND[(env_path, name)]
+
+	cache = load_commands_cache()
+	path = cache.get(env_path, {}).get(name)
+	if path is None or not is_executable(path):
+		path = which(name)
+		if path is not None:
+			cache.setdefault(env_path, {})[name] = path
+			save_commands_cache(cache)
+
+	if path is not None:
+		COMMANDS_FOUND[(env_path, name)] = path
+	return path
+
+def require_command(name):
+	path = find_command(name)
+	if path is None:
+		raise MissingDependencyError(name=name)
+	return path
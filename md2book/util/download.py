@@ -0,0 +1,134 @@
+import http.client, ssl, socket, threading, time, os
+from urllib.parse import urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import rand_str
+
+# Errors after which the server is considered unreachable
+CONNECTION_ERRORS = (socket.gaierror, socket.timeout, ConnectionRefusedError, ssl.SSLError)
+# Errors caused by a kept-alive connection closed by the server
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError)
+
+class DownloadError(Exception):
+	pass
+
+class ConnectionPool:
+	"""
+		Download many files concurrently, with a bounded number of threads.
+		Each thread keeps its HTTP(S) connections alive, so that a new connection
+		is not opened (with a TLS handshake) for every file.
+	"""
+	MAX_REDIRECTS = 3
+
+	def __init__(self, max_workers=8, timeout=20, repeat_n=2, repeat_delay=0.5):
+		self.max_workers = max_workers
+		self.timeout = timeout
+		self.repeat_n = repeat_n
+		self.repeat_delay = repeat_delay
+
+		self.local = threading.local()
+		self.connections = []
+		self.lock = threading.Lock()
+		self.ssl_context = ssl.create_default_context()
+		self.offline = False
+
+	def get_connection(self, scheme, netloc, renew=False):
+		connections = getattr(self.local, 'connections', None)
+		if connections is None:
+			connections = self.local.connections = {}
+
+		key = (scheme, netloc)
+		if renew and key in connections:
+			connections.pop(key).close()
+		if key not in connections:
+			if scheme == 'https':
+				conn = http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.ssl_context)
+			elif scheme == 'http':
+				conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+			else:
+				raise DownloadError("Unsupported url scheme: {}".format(scheme))
+			connections[key] = conn
+			with self.lock:
+				self.connections.append(conn)
+		return connections[key]
+
+	def request(self, url, renew=False, headers={}):
+		parts = urlsplit(url)
+		conn = self.get_connection(parts.scheme, parts.netloc, renew)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
+
+		try:
+			conn.request('GET', path, headers={'Connection' : 'keep-alive', **headers})
+			response = conn.getresponse()
+			content = response.read()
+		except STALE_CONNECTION_ERRORS:
+			if renew:
+				raise
+			return self.request(url, renew=True, headers=headers) # The server closed the connection, open a new one
+		return response, content
+
+	def get_response(self, url, headers={}):
+		""" Response (200, or 304 for a conditional request) and content of the file at this url """
+		for _ in range(self.MAX_REDIRECTS + 1):
+			response, content = self.request(url, headers=headers)
+			if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+				url = urljoin(url, response.getheader('Location'))
+			elif response.status not in (200, 304):
+				raise DownloadError("HTTP error {} for {}".format(response.status, url))
+			else:
+				return response, content
+		raise DownloadError("Too many redirections for {}".format(url))
+
+	def get(self, url):
+		""" Content of the file at this url """
+		return self.get_response(url)[1]
+
+	def retry(self, function):
+		""" Result of function(), called again after a delay if it fails, or None """
+		delay = self.repeat_delay
+		for attempt in range(self.repeat_n + 1):
+			if self.offline:
+				return None
+			try:
+				return function()
+			except CONNECTION_ERRORS as e:
+				self.offline = True # Don't wait for all the other files
+				print('ERROR', e)
+				return None
+			except (DownloadError, OSError, http.client.HTTPException) as e:
+				error = e
+			if attempt < self.repeat_n:
+				time.sleep(delay)
+				delay *= 2
+		print('ERROR', error)
+		return None
+
+	def download(self, url, path):
+		""" Download the file at url into path, return path, or None if it failed """
+		def download_file():
+			content = self.get(url)
+			# Write to a temporary file first, so that a partial file is never visible
+			tmp_path = '{}.{}.part'.format(path, rand_str(8))
+			with open(tmp_path, 'wb') as f:
+				f.write(content)
+			os.replace(tmp_path, str(path))
+			return path
+		return self.retry(download_file)
+
+	def download_all(self, files):
+		"""
+			Download concurrently a list of (url, path).
+			Return a dict url -> path, where path is None for the failed downloads
+		"""
+		files = list(dict(files).items())
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			paths = executor.map(lambda f: self.download(*f), files)
+			return {url : path for (url, _), path in zip(files, paths)}
+
+	def close(self):
+		with self.lock:
+			for conn in self.connections:
+				conn.close()
+			self.connections = []
@@ -30,6 +30,11 @@ class ModuleImportError(BaseError):
 class MissingDependencyError(BaseError):
 	TEMPLATE = "{red}[ERROR] The following command is required but has not been found: {name}"
 
+class DaemonError(BaseError):
+	TEMPLATE = "{red}[ERROR IN DAEMON] {white}{error}"
+	def __init__(self, error):
+		super().__init__(error=error)
+
 class TemplateError(BaseError):
 	TEMPLATE = "{red}[ERROR IN TEMPLATE] {white}{error}"
 	def __init__(self, error):
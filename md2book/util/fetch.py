@@ -0,0 +1,180 @@
+"""
+	Files referenced by an url (stylesheets, scripts, images), downloaded once into a cache shared
+	by all the builds of the user, and revalidated with their ETag or Last-Modified headers.
+	The urls that can't be downloaded are not tried again for a short time, and read-only mirror
+	directories (<mirror>/<host>/<path>) are used first, to build without network access.
+"""
+import os, re, json, time, hashlib
+from pathlib import Path
+from urllib.parse import urlsplit, unquote
+
+from md2book.config import *
+from .cache import FileCache
+from .common import mark_incomplete
+
+REMOTE_MIRRORS = [] # Directories checked before the cache and the network
+FAILED_URLS = {} # url -> time of the last failed download
+REMOTE_SCHEMES = ['http', 'https']
+RE_MD_IMAGES = r'!\[.*?\]\((https?://.*?)\)'
+RE_HTML_IMAGES = r'<img\b[^>]*?\ssrc=(["\'])(https?://.*?)\1'
+IMAGES_READ_FORMATS = ['pdf', 'epub', 'odt', 'docx'] # Formats whose build reads the images, the html books leave them to the browser
+
+def is_remote_url(path):
+	return urlsplit(str(path)).scheme in REMOTE_SCHEMES
+
+def get_mirror_path(url):
+	""" Path of the file in a mirror, or None """
+	parts = urlsplit(url)
+	name = unquote(parts.path).lstrip('/') or 'index'
+	if parts.query:
+		name += '?' + parts.query
+	for mirror in REMOTE_MIRRORS:
+		path = Path(mirror) / parts.netloc / name
+		if path.is_file():
+			return path
+	return None
+
+class RemoteFetcher:
+	def __init__(self):
+		self.cache = FileCache(REMOTE_CACHE_PATH, REMOTE_CACHE_SIZE)
+
+	def get_name(self, url):
+		""" Name of the file in the cache, with the extension of the url for the tools that need it """
+		ext = os.path.splitext(urlsplit(url).path)[1]
+		if not re.fullmatch(r'\.\w{1,8}', ext):
+			ext = ''
+		return hashlib.sha1(url.encode('utf-8')).hexdigest() + ext
+
+	def load_meta(self, name):
+		path = self.cache.get(name + '.json')
+		if path is None:
+			return None
+		try:
+			with open(str(path), 'r', encoding='utf-8') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def save_meta(self, name, meta):
+		self.cache.put(name + '.json', json.dumps(meta).encode('utf-8'))
+
+	def find_local(self, url):
+		""" Path of the file in the cache if it was checked recently, or None """
+		name = self.get_name(url)
+		path = self.cache.get(name)
+		meta = self.load_meta(name) if path else None
+		if meta and time.time() - meta['fetched'] < REMOTE_FRESH_TIME:
+			return str(path)
+		return None
+
+	def fetch(self, url, pool):
+		""" Local path of the file at url, downloaded, or revalidated if it is in the cache, or None """
+		name = self.get_name(url)
+		path = self.cache.get(name)
+		meta = self.load_meta(name) if path else None
+
+		headers = {}
+		if meta and meta.get('etag'):
+			headers['If-None-Match'] = meta['etag']
+		if meta and meta.get('last-modified'):
+			headers['If-Modified-Since'] = meta['last-modified']
+		result = pool.retry(lambda: pool.get_response(url, headers))
+
+		if result is None:
+			if path: # Stale, but better than nothing when the server is unreachable
+				return str(path)
+			FAILED_URLS[url] = time.time()
+			return None
+		response, content = result
+		if response.status == 304 and meta:
+			meta['fetched'] = time.time()
+		else:
+			path = self.cache.put(name, content)
+			meta = {
+				'url' : url,
+				'etag' : response.getheader('ETag'),
+				'last-modified' : response.getheader('Last-Modified'),
+				'fetched' : time.time(),
+			}
+		self.save_meta(name, meta)
+		FAILED_URLS.pop(url, None)
+		return str(path)
+
+	def fetch_all(self, urls):
+		""" Local paths of the urls, a dict url -> path, or None if it failed. The downloads are concurrent """
+		paths = self.find_all(urls)
+		for url, path in paths.items():
+			if path is None:
+				mark_incomplete('Can\'t download {}'.format(url))
+		return paths
+
+	def find_all(self, urls, max_workers=REMOTE_FETCH_WORKERS):
+		""" Same as fetch_all, without marking the build incomplete """
+		paths, missing = {}, []
+		for url in urls:
+			if url in paths:
+				continue
+			mirror_path = get_mirror_path(url)
+			if mirror_path:
+				paths[url] = str(mirror_path)
+				continue
+			failed_recently = time.time() - FAILED_URLS.get(url, 0) < REMOTE_NEGATIVE_TTL
+			paths[url] = None if failed_recently else self.find_local(url)
+			if paths[url] is None and not failed_recently:
+				missing.append(url)
+		if not missing:
+			return paths
+
+		from concurrent.futures import ThreadPoolExecutor
+		from .download import ConnectionPool # Loads ssl, only when something must be downloaded
+		pool = ConnectionPool(max_workers=max_workers, repeat_n=1)
+		try:
+			with ThreadPoolExecutor(max_workers=max_workers) as executor:
+				paths.update(zip(missing, executor.map(lambda url: self.fetch(url, pool), missing)))
+		finally:
+			pool.close()
+		self.cache.evict()
+		return paths
+
+FETCHER = []
+
+def get_fetcher():
+	if not FETCHER:
+		FETCHER.append(RemoteFetcher())
+	return FETCHER[0]
+
+def fetch_remote(url):
+	""" Local path of a remote file, or None """
+	return get_fetcher().fetch_all([url])[url]
+
+def get_remote_images(code):
+	""" Urls of the remote images, markdown or html, of the code """
+	return re.findall(RE_MD_IMAGES, code) + [match[1] for match in re.findall(RE_HTML_IMAGES, code)]
+
+def get_remote_references(code, target):
+	""" Urls of the remote files that the build of the target will read """
+	urls = list(target['css'])
+	urls += [AVAILABLE_SCRIPTS.get(script, script) for script in target['js']]
+	if target.format in IMAGES_READ_FORMATS:
+		urls += get_remote_images(code)
+	return [url for url in urls if is_remote_url(url)]
+
+def get_local_image(url):
+	""" Local copy of a remote image, for the tools that would download it themselves, or the url """
+	return (fetch_remote(url) or url) if is_remote_url(url) else url
+
+def localize_html_images(code):
+	""" Refer to the local copies of the remote images of the html code """
+	def replace(match):
+		return match.group(0).replace(match.group(2), get_local_image(match.group(2)))
+	return re.sub(RE_HTML_IMAGES, replace, code)
+
+def prefetch_urls(urls):
+	""" Download concurrently the remote files among urls, before they are read one by one """
+	urls = [url for url in urls if is_remote_url(url)]
+	if urls:
+		get_fetcher().fetch_all(urls)
+
+def prefetch_remote_files(code, target):
+	""" Download concurrently all the remote files of the target """
+	prefetch_urls(get_remote_references(code, target))
@@ -0,0 +1,97 @@
+import json, hashlib, os
+from pathlib import Path
+
+import md2book
+from md2book.config import *
+from .common import rand_str
+
+# -------------------- HASHES -------------------- #
+
+def hash_file(path):
+	h = hashlib.sha1()
+	try:
+		with open(str(path), 'rb') as f:
+			for block in iter(lambda: f.read(1 << 16), b''):
+				h.update(block)
+	except OSError:
+		return None
+	return h.hexdigest()
+
+def get_file_state(path):
+	""" (modification time, size) of a file, or None if it doesn't exists """
+	try:
+		stat = os.stat(str(path))
+	except OSError:
+		return None
+	return [stat.st_mtime_ns, stat.st_size]
+
+def hash_config(*parts):
+	content = json.dumps([md2book.__version__] + list(parts), sort_keys=True, default=str)
+	return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def is_temporary_file(path):
+	return any(str(path).startswith(str(tmp_dir)) for tmp_dir in TMP_DIRS)
+
+# -------------------- BUILD MANIFEST -------------------- #
+
+class BuildManifest:
+	"""
+		Inputs used to build an output file: the hash of the target configuration,
+		and the hash of every file read during the build, or copied next to the output (images, fonts).
+		It is stored next to the output file, and used to skip the targets that are up to date.
+	"""
+	def __init__(self, out_file):
+		self.out_file = Path(out_file)
+		self.path = self.out_file.parent / MANIFEST_FILE.format(self.out_file.name)
+		self.conf_hash = None
+		self.files = {} # path -> [mtime, size, hash]
+		self.load()
+
+	def load(self):
+		try:
+			with open(str(self.path), 'r', encoding='utf-8') as f:
+				content = json.load(f)
+			self.conf_hash = content['conf']
+			self.files = content['files']
+		except (OSError, ValueError, KeyError, TypeError):
+			self.conf_hash = None
+			self.files = {}
+
+	def save(self):
+		content = {'conf' : self.conf_hash, 'files' : self.files}
+		tmp_path = self.path.with_name(self.path.name + '.' + rand_str(8))
+		with open(str(tmp_path), 'w', encoding='utf-8') as f:
+			json.dump(content, f, indent=1, sort_keys=True)
+		os.replace(str(tmp_path), str(self.path))
+
+	def is_file_unchanged(self, path, record):
+		mtime, size, file_hash = record
+		state = get_file_state(path)
+		if state is None or file_hash is None:
+			return state is None and file_hash is None
+		if state == [mtime, size]:
+			return True
+		return hash_file(path) == file_hash
+
+	def is_up_to_date(self, conf_hash):
+		if self.conf_hash != conf_hash or not self.out_file.is_file():
+			return False
+		return all(self.is_file_unchanged(path, record) for path, record in self.files.items())
+
+	def remove(self):
+		""" Forget the inputs, the next build can't be skipped """
+		self.conf_hash = None
+		self.files = {}
+		try:
+			os.remove(str(self.path))
+		except OSError:
+			pass
+
+	def update(self, conf_hash, dependencies):
+		self.conf_hash = conf_hash
+		self.files = {}
+		for path in sorted(dependencies):
+			if not is_temporary_file(path):
+				state = get_file_state(path) or [None, None]
+				self.files[path] = state + [hash_file(path)]
+		self.save()
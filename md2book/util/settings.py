@@ -1,9 +1,9 @@
-import yaml, re
+import yaml, re, os
 from copy import deepcopy
 
 from md2book.config import *
-from .common import merge_dicts_recur, load_yaml_file
-from .style import create_css_file
+from .common import merge_dicts_recur, load_yaml_file, track_dependency
+from .style import InlineStylesheet
 from .exceptions import ConfigError
 from md2book.modules import ALL_MODULES
 
@@ -17,7 +17,25 @@ def merge_settings(settings, overrride):
 			settings[key] = deecopy(val)
 	return settings
 
+SETTINGS_LOADED = [] # State of the settings file when it was merged
+BASE_DEFAULT_TARGET = deepcopy(DEFAULT_TARGET) # Before the user settings are merged
+
+def get_settings_state():
+	try:
+		stat = os.stat(str(DEFAULT_SETTINGS))
+		return (stat.st_mtime_ns, stat.st_size)
+	except OSError:
+		return None
+
 def load_settings():
+	# The settings are merged only once per process, or again if they changed (for the daemon)
+	state = get_settings_state()
+	if SETTINGS_LOADED and SETTINGS_LOADED[-1] == state:
+		return
+	if SETTINGS_LOADED:
+		DEFAULT_TARGET.clear()
+		DEFAULT_TARGET.update(deepcopy(BASE_DEFAULT_TARGET))
+	SETTINGS_LOADED.append(state)
 	settings = load_yaml_file(DEFAULT_SETTINGS, {})
 
 	# Check the settings
@@ -32,12 +50,19 @@ def load_settings():
 		elif isinstance(val, list) and not isinstance(def_target.get(key, None), list):
 			def_target[key] = []
 
-	# Merge settings, and save the file
+	# Merge settings, and save the file if the defaults changed
+	generated = yaml.dump({'default_target': DEFAULT_TARGET})
 	try:
-		with open(GENERATED_SETTINGS_FILE, 'w') as f:
-			yaml.dump({'default_target': DEFAULT_TARGET}, f)
-	except: # If the user can't write to this location
-		pass
+		with open(GENERATED_SETTINGS_FILE, 'r') as f:
+			up_to_date = (f.read() == generated)
+	except OSError:
+		up_to_date = False
+	if not up_to_date:
+		try:
+			with open(GENERATED_SETTINGS_FILE, 'w') as f:
+				f.write(generated)
+		except: # If the user can't write to this location
+			pass
 	merge_dicts_recur(DEFAULT_TARGET, def_target)
 
 # -------------------- BOOK CONFIG -------------------- #
@@ -148,9 +173,12 @@ class Target:
 			self.scripts.extend(mod.get_scripts())
 			custom_css.extend(mod.get_custom_css())
 
-		self.stylesheets.append(create_css_file("\n".join(custom_css)))
+		self.stylesheets.append(InlineStylesheet("\n".join(custom_css)))
 
 		for mod in self.modules:
 			mod.alter_target()
 
-		self.stylesheets = [str(p) for p in self.stylesheets]
+		self.stylesheets = [p if isinstance(p, InlineStylesheet) else str(p) for p in self.stylesheets]
+		for path in self.stylesheets:
+			if not isinstance(path, InlineStylesheet):
+				track_dependency(path)
@@ -1,11 +1,20 @@
 from pathlib import Path
 
 from md2book.config import *
-from .common import rand_str, is_int
+from .common import rand_str, is_int, track_dependency
 from .exceptions import ConfigError
 
 # -------------------- CSS -------------------- #
 
+class InlineStylesheet:
+	""" Stylesheet generated by the modules, kept in memory instead of a file """
+	def __init__(self, content):
+		self.content = content
+
+	def get_path(self):
+		""" Path of a file containing the stylesheet, for the tools that need a file """
+		return create_css_file(self.content)
+
 def create_css_file(content):
 	filepath = str(TMP_DIRS[0] / ("style-" + rand_str(10) + ".css"))
 	with open(filepath, 'w') as f:
@@ -20,18 +29,15 @@ def ensure_with_unit(val, default_unit='px'):
 
 # -------------------- FONTS -------------------- #
 
+FONT_FAMILIES = {} # Font directory -> (modification time, FontFamily)
+
 class FontFamily:
 	HTML_PATH = "{syspath}"
 	EPUB_PATH = "../fonts/{file}"
 
 	def __init__(self, name):
-		basepath = Path(name)
-		if '/' not in name and '\\' not in name:
-			basepath = EMBED_FONTS_PATH / name
-		name = basepath.name
-
-		self.font_path = basepath.resolve()
-		self.name = name
+		self.font_path = self.get_font_path(name)
+		self.name = self.font_path.name
 
 		if not self.font_path.exists() or not self.font_path.is_dir():
 			raise ConfigError("Font {} ({}) doesn't exists".format(self.name, str(self.font_path)))
@@ -50,8 +56,35 @@ class FontFamily:
 				raise ConfigError("{} is not a valid weight for a font (second parameter)".format(weight))
 
 			self.font_files.append((file, style, str(weight)))
+			track_dependency(file)
+
+	@staticmethod
+	def get_font_path(name):
+		basepath = Path(name)
+		if '/' not in name and '\\' not in name:
+			basepath = EMBED_FONTS_PATH / name
+		return basepath.resolve()
+
+	@classmethod
+	def load(cls, name):
+		""" Font family with this name, reused while its directory doesn't change """
+		font_path = cls.get_font_path(name)
+		try:
+			state = font_path.stat().st_mtime_ns
+		except OSError:
+			state = None
+
+		cached = FONT_FAMILIES.get(font_path)
+		if state is None or cached is None or cached[0] != state:
+			cached = (state, cls(name))
+			FONT_FAMILIES[font_path] = cached
+		else:
+			for file, _, _ in cached[1].font_files:
+				track_dependency(file)
+		return cached[1]
 
-	def get_css(self, form):
+	def get_css(self, form, paths=None):
+		""" @font-face rules of the family, paths replaces some font files (by their subsets) """
 		if form in ['epub']:
 			src_template = self.EPUB_PATH
 		else:
@@ -59,6 +92,7 @@ class FontFamily:
 
 		css = []
 		for file, style, weight in self.font_files:
+			file = Path((paths or {}).get(file, file))
 			src = src_template.format(
 				file=file.name,
 				syspath=str(file),
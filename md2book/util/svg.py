@@ -0,0 +1,87 @@
+"""
+	Svg files inserted in the html documents, read and parsed once while they don't change.
+	With the option build.svg-symbols, each distinct image used several times is defined once in the
+	document, as a <symbol>, and each occurrence only references it with <use>.
+"""
+import os, re, hashlib
+
+from .common import track_dependency
+
+SVG_FILES = {} # Path -> (modification time, size, SvgFile)
+RE_SVG_SIZE = r'width="(.*?)" height="(.*?)"'
+RE_SVG_ROOT = r'<svg\b([^>]*?)/?>'
+RE_VIEWBOX = r'\sviewBox="([^"]*)"'
+RE_SVG_IMAGE = r'(<img .*?src="(.*?\.svg)".*?>)'
+SYMBOLS_CONTAINER = '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" \
+style="position: absolute; width: 0; height: 0; overflow: hidden;" aria-hidden="true">{}</svg>\n'
+
+class SvgFile:
+	def __init__(self, xml):
+		self.xml = xml
+		lines = xml.split('\n', 2)
+		self.code = lines[2] if len(lines) > 2 else '' # Without the xml declaration and the doctype
+		sizes = re.search(RE_SVG_SIZE, xml)
+		self.size = (sizes.group(1), sizes.group(2)) if sizes else None
+		self.symbol_id = 'svg-' + hashlib.sha1(xml.encode('utf-8')).hexdigest()[:16]
+
+		root = re.search(RE_SVG_ROOT, xml)
+		self.attributes = root.group(1) if root else ''
+		self.content = ''
+		if root and not root.group(0).endswith('/>'):
+			end = xml.rfind('</svg>')
+			self.content = xml[root.end():end if end >= 0 else len(xml)]
+
+	def get_symbol(self):
+		viewbox = re.search(RE_VIEWBOX, self.attributes)
+		viewbox = ' viewBox="{}"'.format(viewbox.group(1)) if viewbox else ''
+		return '<symbol id="{}"{} overflow="visible">{}</symbol>'.format(self.symbol_id, viewbox, self.content)
+
+	def get_use(self):
+		""" Svg element with the size and the attributes of the image, that displays its symbol """
+		use = '<use xlink:href="#{}"'.format(self.symbol_id)
+		viewbox = re.search(RE_VIEWBOX, self.attributes)
+		if viewbox and len(viewbox.group(1).split()) == 4: # The symbol is placed on the viewBox
+			use += ' x="{}" y="{}" width="{}" height="{}"'.format(*viewbox.group(1).split())
+		return '<svg{}>{}/></svg>'.format(self.attributes, use)
+
+def load_svg_file(path):
+	""" SvgFile of the image at path, parsed again only if it changed """
+	path = str(path)
+	track_dependency(path)
+	stat = os.stat(path)
+	state = (stat.st_mtime_ns, stat.st_size)
+	if SVG_FILES.get(path, (None,))[:2] != state:
+		with open(path, 'r', encoding='utf-8') as f:
+			SVG_FILES[path] = state + (SvgFile(f.read()),)
+	return SVG_FILES[path][2]
+
+def is_local_svg(path):
+	return not (path.startswith('http://') or path.startswith('https://')) and os.path.isfile(path)
+
+def insert_svg_symbols(html):
+	"""
+		Replace the svg images of the html code that occur at least twice by references to symbols,
+		defined at the start of the code. The other images are inserted as they are
+	"""
+	counts = {} # Id -> occurrences
+	for match in re.finditer(RE_SVG_IMAGE, html):
+		if is_local_svg(match.group(2)):
+			symbol_id = load_svg_file(match.group(2)).symbol_id
+			counts[symbol_id] = counts.get(symbol_id, 0) + 1
+
+	symbols = {} # Id -> symbol
+	def replace_image(match):
+		path = match.group(2)
+		if not is_local_svg(path):
+			return match.group(1)
+		svg = load_svg_file(path)
+		if counts[svg.symbol_id] < 2:
+			return svg.code
+		if svg.symbol_id not in symbols:
+			symbols[svg.symbol_id] = svg.get_symbol()
+		return svg.get_use()
+
+	html = re.sub(RE_SVG_IMAGE, replace_image, html)
+	if symbols:
+		html = SYMBOLS_CONTAINER.format(''.join(symbols.values())) + html
+	return html
@@ -36,6 +36,14 @@ def import_module_file(name, path):
 md2book_module = import_module_file("m2b", "md2book/__init__.py")
 md2book_conf = import_module_file("conf", "md2book/config.py")
 
+EXTRAS = { # Optional dependencies, of the options described in the readme
+	'html-tree' : ['lxml'],
+	'images' : ['Pillow'],
+	'fonts' : ['fonttools', 'brotli'],
+	'latex' : ['ziamath', 'latex2mathml'],
+}
+EXTRAS['all'] = sorted({package for packages in EXTRAS.values() for package in packages})
+
 setuptools.setup(
 	name=md2book_conf.M2B_NAME,
 	version=md2book_module.__version__,
@@ -62,6 +70,7 @@ setuptools.setup(
 	},
 	include_package_data=True,
  	package_data={'md2book': find_data_files('md2book/data', 'md2book')},
-	install_requires=['pyyaml>=5.2', 'markdown>=3.2', 'pdfkit>=0.6.1', 'python-docx>-0.8.10'],
+	install_requires=['pyyaml>=5.2', 'markdown>=3.2', 'pdfkit>=0.6.1', 'python-docx>=0.8.10'],
+	extras_require=EXTRAS,
 	python_requires='>=3',
 )
\ No newline at end of file